@@ -0,0 +1,3 @@
+"""
+Офлайн-бенчмарки кода приложения (без обращений к Gemini/YandexGPT)
+"""
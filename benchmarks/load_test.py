@@ -0,0 +1,283 @@
+"""
+Нагрузочный тест: N учеников одновременно работают с одним процессом Streamlit (без браузера)
+
+Запуск:
+    python -m benchmarks.load_test                          # ступени 1, 2, 4, 8, 16 учеников
+    python -m benchmarks.load_test --levels 10 30 --ttft 0.5
+
+Каждый ученик - отдельная сессия AppTest над streamlit_app.py с фейковой LLM (FAKE_LLM=1):
+в Learn Mode выбирает тему и отвечает на вопросы урока, в Study Mode переключает режим,
+нажимает быстрые ответы и пишет ответы текстом. Все сессии выполняются в одном процессе,
+как на сервере класса: общие st.cache_resource, общий GIL.
+
+Отчет: перцентили задержки перезапуска скрипта, память на сессию и потолок
+пропускной способности процесса (перезапусков в секунду).
+"""
+import argparse
+import dataclasses
+import gc
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from unittest.mock import MagicMock
+from urllib import parse
+
+from streamlit.proto.WidgetStates_pb2 import WidgetStates
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.scriptrunner.script_requests import ScriptRequests
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import element_tree
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+from data import TOPICS
+
+from .sessions import STUDY_SCRIPT, learn_script
+
+APP_PATH = Path(__file__).parent.parent / "streamlit_app.py"
+
+# Порядок опций st.radio с режимом в streamlit_app.py
+MODES = ("learn", "study")
+
+
+# ============= ДРАЙВЕР APPTEST =============
+# AppTest в streamlit 1.32 рассчитан на одну сессию за раз, поэтому драйвер
+# обходит его ограничения (только здесь, приложение не меняется).
+
+# Байткод скрипта общий на процесс, как у сервера (AppTest компилирует скрипт
+# на каждый прогон, а параллельный compile() в Python 3.11 иногда падает с SystemError)
+_script_cache = ScriptCache()
+
+
+def _patch_apptest():
+    # 1. Radio.index ищет значение среди подписей, а у радио режима есть format_func
+    original_index = element_tree.Radio.index.fget
+
+    def radio_index(self):
+        try:
+            return original_index(self)
+        except ValueError:
+            return MODES.index(self.value)
+
+    element_tree.Radio.index = property(radio_index)
+
+    # 2. st.rerun() без состояния виджетов не сбрасывает нажатые кнопки - скрипт
+    # перезапускается бесконечно. Сервер в этом случае сбрасывает триггеры.
+    original_request_rerun = ScriptRequests.request_rerun
+
+    def request_rerun(self, rerun_data):
+        if rerun_data.widget_states is None:
+            rerun_data = dataclasses.replace(rerun_data, widget_states=WidgetStates())
+        return original_request_rerun(self, rerun_data)
+
+    ScriptRequests.request_rerun = request_rerun
+
+    # 3. Общий рантайм на все сессии (AppTest.run создает и обнуляет его на каждый прогон)
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+
+
+class StudentSession(AppTest):
+    """Сессия одного ученика: AppTest, который можно запускать параллельно с другими"""
+
+    def _run(self, widget_state=None, timeout=None):
+        runner = LocalScriptRunner(self._script_path, self.session_state, args=self.args, kwargs=self.kwargs)
+        runner._script_cache = _script_cache
+        self._tree = runner.run(widget_state, self.query_params, timeout or self.default_timeout)
+        self._tree._runner = self
+        self.query_params = parse.parse_qs(runner.event_data[-1]["client_state"].query_string)
+        return self
+
+
+# ============= СЦЕНАРИИ УЧЕНИКОВ =============
+
+class Student:
+    """
+    Ученик: выполняет сценарий и замеряет задержку каждого перезапуска скрипта
+
+    Args:
+        index: Номер ученика (четные - Learn Mode, нечетные - Study Mode)
+        think_time: Пауза между действиями, секунды
+        timeout: Таймаут одного перезапуска, секунды
+    """
+
+    def __init__(self, index: int, think_time: float = 0.0, timeout: float = 60):
+        self.index = index
+        self.mode = MODES[index % 2]
+        self.think_time = think_time
+        self.app = StudentSession(str(APP_PATH), default_timeout=timeout)
+        self.latencies = []
+        self.errors = 0
+
+    def _act(self, action):
+        if self.think_time:
+            time.sleep(self.think_time)
+        started = time.perf_counter()
+        try:
+            action()
+            if self.app.exception:
+                self.errors += 1
+        except Exception as e:
+            print(f"Ученик {self.index}: {type(e).__name__}: {e}")
+            self.errors += 1
+        self.latencies.append(time.perf_counter() - started)
+
+    def _answer(self, text: str):
+        """Отвечает кнопкой быстрого ответа (через раз, если кнопки есть) или текстом"""
+        quick_replies = [b for b in self.app.main.button if b.key and b.key.startswith("quick_reply_")]
+        if quick_replies and len(self.latencies) % 2:
+            self._act(lambda: quick_replies[self.index % len(quick_replies)].click().run())
+        else:
+            self._act(lambda: self.app.chat_input[0].set_value(text).run())
+
+    def run(self):
+        """Полный сценарий: открыть приложение, выбрать режим или тему, пройти диалог"""
+        self._act(self.app.run)
+
+        if self.mode == "study":
+            self._act(lambda: self.app.sidebar.radio(key="mode_selector").set_value("study").run())
+            script = STUDY_SCRIPT
+        else:
+            topic_ids = list(TOPICS)
+            topic_id = topic_ids[self.index // 2 % len(topic_ids)]
+            self._act(lambda: self.app.sidebar.button(key=f"topic_{topic_id}").click().run())
+            script = learn_script(TOPICS[topic_id])
+
+        for text in script:
+            self._answer(text)
+
+
+def _percentile(values: list, q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def run_level(students: int, think_time: float) -> dict:
+    """
+    Одна ступень нагрузки: students учеников одновременно проходят свои сценарии
+
+    Returns:
+        Перцентили задержки перезапуска (мс), пропускная способность, ошибки
+    """
+    group = [Student(i, think_time) for i in range(students)]
+    threads = [threading.Thread(target=s.run, name=f"student-{s.index}") for s in group]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = [lat for s in group for lat in s.latencies]
+    return {
+        'students': students,
+        'reruns': len(latencies),
+        'errors': sum(s.errors for s in group),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 1),
+        'p90_ms': round(_percentile(latencies, 90) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 1),
+        'max_ms': round(max(latencies) * 1000, 1),
+        'reruns_per_sec': round(len(latencies) / elapsed, 1),
+    }
+
+
+def measure_session_memory(sessions: int) -> dict:
+    """
+    Память, которую удерживает одна сессия после сценария (session_state: сообщения, память разговора, ...)
+
+    Сценарии выполняются последовательно под tracemalloc; дерево элементов AppTest
+    (это сторона браузера) отбрасывается, остается только состояние сессии.
+    """
+    # Прогрев: кеши процесса (шаблоны, схемы, LLM) не относятся к сессии
+    Student(0).run()
+    Student(1).run()
+    gc.collect()
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = []
+        for i in range(sessions):
+            student = Student(i)
+            student.run()
+            kept.append(student.app.session_state)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    return {'sessions': sessions, 'kb_per_session': round((after - before) / sessions / 1024, 1)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест streamlit_app.py на фейковой LLM")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="Ступени нагрузки: сколько учеников одновременно")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Задержка фейковой LLM до первого токена, с")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="Задержка между чанками, с")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Пауза ученика между действиями, с")
+    parser.add_argument("--memory-sessions", type=int, default=10, help="Сколько сессий для замера памяти")
+    parser.add_argument("--json", type=Path, help="Сохранить отчет в JSON")
+    args = parser.parse_args(argv)
+
+    # Фейковая LLM вместо провайдера; ключ нужен только для проверки в UI
+    os.environ["FAKE_LLM"] = "1"
+    os.environ["FAKE_LLM_TTFT"] = str(args.ttft)
+    os.environ["FAKE_LLM_TOKEN_DELAY"] = str(args.token_delay)
+    os.environ.setdefault("GOOGLE_API_KEY", "fake")
+    # Сессии - в памяти процесса: тест не оставляет файл базы
+    os.environ.setdefault("SESSION_STORE", "memory")
+    _patch_apptest()
+
+    # Прогрев процесса: импорт приложения, st.cache_resource
+    Student(0).run()
+
+    print(f"{'Учеников':>9} {'Перезапусков':>13} {'Ошибок':>7} {'p50 мс':>8} {'p90 мс':>8} "
+          f"{'p99 мс':>8} {'max мс':>8} {'в секунду':>10}")
+    levels = []
+    for students in args.levels:
+        level = run_level(students, args.think_time)
+        levels.append(level)
+        print(f"{level['students']:>9} {level['reruns']:>13} {level['errors']:>7} {level['p50_ms']:>8} "
+              f"{level['p90_ms']:>8} {level['p99_ms']:>8} {level['max_ms']:>8} {level['reruns_per_sec']:>10}")
+
+    # Потолок: максимум пропускной способности и ступень, после которой она перестает расти
+    ceiling = max(levels, key=lambda level: level['reruns_per_sec'])
+    saturation = next(
+        (prev for prev, cur in zip(levels, levels[1:]) if cur['reruns_per_sec'] < prev['reruns_per_sec'] * 1.1),
+        None
+    )
+    memory = measure_session_memory(args.memory_sessions)
+
+    print(f"\nПотолок процесса: {ceiling['reruns_per_sec']} перезапусков/с при {ceiling['students']} учениках")
+    if saturation:
+        print(f"Насыщение: после {saturation['students']} учеников пропускная способность растет меньше чем на 10%")
+    print(f"Память на сессию: {memory['kb_per_session']} КБ (по {memory['sessions']} сессиям)")
+
+    if args.json:
+        report = {
+            'settings': {'ttft': args.ttft, 'token_delay': args.token_delay, 'think_time': args.think_time},
+            'levels': levels,
+            'ceiling': ceiling,
+            'memory': memory,
+        }
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding='utf-8')
+        print(f"Отчет сохранен: {args.json}")
+
+    return 1 if any(level['errors'] for level in levels) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Офлайн-бенчмарк: сценарии Learn/Study Mode на фейковой LLM для всех тем и классов
+
+Запуск:
+    python -m benchmarks.run_benchmarks                    # сравнить с baseline.json
+    python -m benchmarks.run_benchmarks --update-baseline  # записать новый baseline
+
+Для каждого сценария (режим, тема, класс) считается на один ход:
+процессорное время, пик выделенной памяти и размер промпта в байтах.
+Код завершается с ошибкой, если метрика хуже baseline больше допуска.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from data import GRADE_INSTRUCTIONS, TOPICS
+from utils import format_chat_to_markdown, render_message_html, split_history
+from utils.fake_llm import FakeTutorLLM
+from utils.google_sheets import build_sheet_rows
+
+from .sessions import STUDY_SCRIPT, ScriptedSession, learn_script
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+
+# Допустимое ухудшение относительно baseline (доля)
+DEFAULT_TOLERANCE = {
+    'cpu_ms_per_turn': 0.5,         # Процессорное время шумит между машинами
+    'alloc_kb_per_turn': 0.2,
+    'prompt_bytes_per_turn': 0.05,  # Размер промпта детерминирован
+}
+
+
+def run_session(mode: str, grade: str, topic_id: str = None, trace_memory: bool = False) -> dict:
+    """
+    Прогоняет одну сессию и возвращает замеры по ходам
+
+    Returns:
+        {'cpu': [...], 'alloc': [...], 'prompt_bytes': [...]}
+    """
+    session = ScriptedSession(mode, grade, FakeTutorLLM(), topic_id)
+    script = learn_script(session.topic) if topic_id else list(STUDY_SCRIPT)
+    steps = [lambda q=q: session.turn(q) for q in script] + [session.finish]
+
+    result = {'cpu': [], 'alloc': [], 'prompt_bytes': []}
+    for step in steps:
+        if trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        started = time.process_time()
+
+        prompt_bytes = step()
+
+        result['cpu'].append(time.process_time() - started)
+        if trace_memory:
+            result['alloc'].append(tracemalloc.get_traced_memory()[1] - before)
+        if prompt_bytes:
+            result['prompt_bytes'].append(prompt_bytes)
+
+    return result
+
+
+def bench_scenario(mode: str, grade: str, topic_id: str = None, repeats: int = 10) -> dict:
+    """
+    Замеряет сценарий: процессорное время - без tracemalloc, память - отдельным прогоном
+
+    Returns:
+        Средние значения на один ход
+    """
+    # Прогрев (кеши шаблонов и схем, как у работающего процесса)
+    run_session(mode, grade, topic_id)
+
+    # Процессорное время - лучший из прогонов (меньше шума от планировщика и GC)
+    cpu_per_run = []
+    prompt_bytes = []
+    for _ in range(repeats):
+        measured = run_session(mode, grade, topic_id)
+        cpu_per_run.append(statistics.mean(measured['cpu']))
+        prompt_bytes.extend(measured['prompt_bytes'])
+
+    tracemalloc.start()
+    try:
+        alloc = run_session(mode, grade, topic_id, trace_memory=True)['alloc']
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'cpu_ms_per_turn': round(min(cpu_per_run) * 1000, 3),
+        'alloc_kb_per_turn': round(statistics.mean(alloc) / 1024, 1),
+        'prompt_bytes_per_turn': round(statistics.mean(prompt_bytes)),
+    }
+
+
+def _best_cpu_ms(func, repeats: int, batches: int = 5) -> float:
+    """Процессорное время одного вызова, мс: лучшая из нескольких серий"""
+    best = None
+    for _ in range(batches):
+        started = time.process_time()
+        for _ in range(repeats):
+            func()
+        elapsed = (time.process_time() - started) / repeats
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 3)
+
+
+def bench_components(repeats: int = 100) -> dict:
+    """Отдельные функции без кешей: экспорт в Markdown, строки для Sheets, разметка истории"""
+    results = {}
+    messages = [
+        {"role": "user" if i % 2 else "assistant", "content": "Сколько килограммов в $7$ тоннах? " * 10}
+        for i in range(40)
+    ]
+
+    for name, func in (
+        ("format_chat_to_markdown", lambda: format_chat_to_markdown(messages, "Тема")),
+        ("build_sheet_rows", lambda: build_sheet_rows(messages, "Тема", "bench", "-")),
+        # Разметка истории без кеша сообщений - худший случай (первый вывод после восстановления сессии)
+        ("split_history", lambda: (render_message_html.cache_clear(), split_history(messages, {}))),
+    ):
+        results[f"component/{name}"] = {'cpu_ms_per_turn': _best_cpu_ms(func, repeats)}
+
+    return results
+
+
+def run_all(repeats: int) -> dict:
+    """Все сценарии: Learn Mode - каждая тема в каждом классе, Study Mode - каждый класс"""
+    results = {}
+    for grade in GRADE_INSTRUCTIONS:
+        for topic_id in TOPICS:
+            results[f"learn/{topic_id}/{grade}"] = bench_scenario("learn", grade, topic_id, repeats)
+        results[f"study/{grade}"] = bench_scenario("study", grade, repeats=repeats)
+    results.update(bench_components())
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: dict) -> list:
+    """
+    Сравнивает результаты с baseline
+
+    Returns:
+        Список описаний регрессий (пустой, если все в пределах допуска)
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        for metric, value in metrics.items():
+            if metric not in base or not base[metric]:
+                continue
+            limit = base[metric] * (1 + tolerance[metric])
+            if value > limit:
+                regressions.append(
+                    f"{scenario}: {metric} = {value} (baseline {base[metric]}, допуск +{tolerance[metric]:.0%})"
+                )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк кода приложения на фейковой LLM")
+    parser.add_argument("--repeats", type=int, default=10, help="Сколько раз прогонять каждый сценарий")
+    parser.add_argument("--update-baseline", action="store_true", help="Записать результаты в baseline.json")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Путь к baseline")
+    parser.add_argument("--cpu-tolerance", type=float, default=DEFAULT_TOLERANCE['cpu_ms_per_turn'],
+                        help="Допуск по процессорному времени (доля)")
+    args = parser.parse_args(argv)
+
+    results = run_all(args.repeats)
+
+    print(f"{'Сценарий':<40} {'CPU мс/ход':>12} {'Память КБ/ход':>14} {'Промпт Б/ход':>13}")
+    for scenario, metrics in results.items():
+        print(f"{scenario:<40} {metrics.get('cpu_ms_per_turn', '-'):>12} "
+              f"{metrics.get('alloc_kb_per_turn', '-'):>14} {metrics.get('prompt_bytes_per_turn', '-'):>13}")
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, ensure_ascii=False, indent=2) + "\n", encoding='utf-8')
+        print(f"\n✅ Baseline записан: {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"\n⚠️ Baseline не найден ({args.baseline}), запустите с --update-baseline")
+        return 0
+
+    tolerance = {**DEFAULT_TOLERANCE, 'cpu_ms_per_turn': args.cpu_tolerance}
+    baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+    regressions = compare(results, baseline, tolerance)
+
+    if regressions:
+        print("\n❌ Регрессии относительно baseline:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+
+    print("\n✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Сценарии уроков для бенчмарков: тот же конвейер хода, что и в streamlit_app.py, но без UI
+"""
+from data import TOPICS, get_grade_instruction
+from prompts import get_compiled_prompt
+from utils import (
+    ConversationMemory,
+    InstrumentedLLM,
+    LessonEngine,
+    MarkerStreamFilter,
+    MetricsRegistry,
+    build_prompt_messages,
+    check_answer_correctness,
+    format_chat_to_markdown,
+    format_feedback_context,
+    parse_quick_replies,
+)
+from utils.google_sheets import build_sheet_rows
+
+MODEL = "fake"
+
+# Реплики ученика в Study Mode
+STUDY_SCRIPT = (
+    "Привет! Я в 6 классе",
+    "Хочу разобраться с дробями",
+    "Не знаю",
+    "1/2",
+    "А почему знаменатель не складывается?",
+    "Понятно, спасибо!",
+)
+
+
+def learn_script(topic) -> list:
+    """
+    Реплики ученика в Learn Mode для темы
+
+    Старт, затем по каждому блоку объяснения - типичная ошибка (если есть) и
+    правильный ответ, затем правильные ответы на шаги финальной задачи.
+    """
+    script = ["Готов!"]
+    for block in topic.explanation:
+        if block.mistakes:
+            script.append(next(iter(block.mistakes)))
+        script.append(block.answer)
+    for step in (topic.boss.steps if topic.boss else ()):
+        script.append(step.answer)
+    return script
+
+
+class ScriptedSession:
+    """
+    Одна сессия ученика: повторяет шаги обработки сообщения из streamlit_app.py
+
+    Args:
+        mode: "learn" или "study"
+        grade: Класс ученика
+        llm: LLM (обычно FakeTutorLLM)
+        topic_id: ID темы (для Learn Mode)
+    """
+
+    def __init__(self, mode: str, grade: str, llm, topic_id: str = None):
+        self.mode = mode
+        self.grade = grade
+        self.topic_id = topic_id
+        self.topic = TOPICS[topic_id] if topic_id else None
+        self.llm = InstrumentedLLM(llm, model=MODEL, registry=MetricsRegistry())
+        self.memory = ConversationMemory(session_id="bench")
+        self.lesson = LessonEngine(topic_id, self.topic) if self.topic else None
+        self.messages = []
+        self.quick_replies = []
+        self.finished = False
+
+        if self.topic:
+            self.template = get_compiled_prompt('lesson_step_prompt').partial(
+                grade_instructions=get_grade_instruction(grade)
+            )
+            self.messages.append({"role": "assistant", "content": self.topic.welcome_message})
+        else:
+            self.template = get_compiled_prompt('tutor_prompt').partial(
+                grade_instructions=get_grade_instruction(grade)
+            )
+
+    def _stream(self, prompt, call: str) -> str:
+        tags = {"call": call, "mode": self.mode, "grade": self.grade, "topic_id": self.topic_id or "-"}
+        stream_filter = MarkerStreamFilter()
+        for _ in stream_filter.iter_visible(self.llm.stream(prompt, metrics_tags=tags)):
+            pass
+        return stream_filter.text
+
+    def turn(self, question: str) -> int:
+        """
+        Обрабатывает одно сообщение ученика
+
+        Returns:
+            Размер отправленного промпта в байтах (0, если ответ дан без LLM)
+        """
+        self.messages.append({"role": "user", "content": question})
+
+        values = {}
+        if self.lesson is not None:
+            turn = self.lesson.handle(question)
+            if not turn.needs_llm:
+                # Известная ошибка - ответ без вызова LLM
+                self.messages.append({"role": "assistant", "content": turn.reply})
+                return 0
+            values['lesson'] = turn.context
+
+        chat_history = self.memory.render_history(self.messages)
+        prompt = build_prompt_messages(
+            self.template, chat_history=chat_history, input=question, **values
+        )
+
+        response = self._stream(prompt, call=self.mode)
+        if self.mode == "study":
+            response, self.quick_replies = parse_quick_replies(response)
+            check_answer_correctness(response)
+        elif turn.completed:
+            self.finished = True
+
+        self.messages.append({"role": "assistant", "content": response})
+
+        return sum(len(msg.content.encode('utf-8')) for msg in prompt)
+
+    def finish(self) -> int:
+        """
+        Завершение сессии: фидбек (для Learn Mode), экспорт в Markdown и строки для Sheets
+
+        Returns:
+            Размер промпта фидбека в байтах (0 для Study Mode)
+        """
+        prompt_bytes = 0
+        title = self.topic.title if self.topic else None
+
+        if self.topic:
+            feedback_context = (
+                f"[Прогресс урока: {self.lesson.describe()}]\n\n"
+                + self.memory.render_feedback_context(self.messages)
+            )
+            prompt = build_prompt_messages(
+                get_compiled_prompt('feedback_prompt'),
+                **format_feedback_context(self.topic, feedback_context)
+            )
+            feedback = self._stream(prompt, call="feedback")
+            self.messages.append({"role": "assistant", "content": f"\n\n---\n\n{feedback}"})
+            prompt_bytes = sum(len(msg.content.encode('utf-8')) for msg in prompt)
+
+        format_chat_to_markdown(self.messages, title)
+        build_sheet_rows(self.messages, title, "bench", "-")
+        return prompt_bytes
@@ -1,15 +1,25 @@
 """
 Данные тем для обучения
 """
-from .new_topics import NEW_LEARNING_TOPICS
-from .learning_topics import LEARNING_TOPICS  # Старый формат (legacy, используется для Study Mode)
+from .topic_catalog import TopicCatalog, TopicInfo
 from .grade_instructions import GRADE_INSTRUCTIONS, get_grade_instruction
 
-# Основной источник тем - новый формат
-TOPICS = NEW_LEARNING_TOPICS
+# Основной источник тем - файлы data/topics/ (схемы загружаются при выборе темы)
+TOPICS = TopicCatalog()
+
+
+def __getattr__(name):
+    # Старые темы (legacy) импортируются только по требованию: Learn Mode их не использует
+    if name == 'LEARNING_TOPICS':
+        from .learning_topics import LEARNING_TOPICS
+        return LEARNING_TOPICS
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [
-    'TOPICS',              # Новые темы (для Learn Mode)
+    'TOPICS',              # Каталог тем (для Learn Mode)
+    'TopicCatalog',        # Каталог тем из файлов JSON/YAML
+    'TopicInfo',           # Запись индекса темы (для сайдбара)
     'LEARNING_TOPICS',     # Старые темы (legacy, только для Study Mode если нужно)
     'GRADE_INSTRUCTIONS',  # Инструкции для разных классов
     'get_grade_instruction' # Функция для получения инструкции по классу
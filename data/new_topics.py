@@ -1,113 +0,0 @@
-"""
-Темы в новом формате (без квизов, сразу по схеме)
-"""
-
-NEW_LEARNING_TOPICS = {
-    "weight_units": {
-        "title": "Единицы измерения веса",
-        "description": "Научимся переводить тонны в килограммы",
-
-        "plan": """План наших действий:
-1) Выясним, сколько килограммов в одной тонне
-2) Научимся переводить целое количество тонн в килограммы
-3) Научимся выражать смешанные единицы (тонны и килограммы) в килограммах""",
-
-        "explanation": [
-            {
-                "info": """Давай начнём с самого главного. Запомни: $1$ тонна = $1000$ килограммов. Это основа для всех переводов.
-
-Например, $3$ тонны — это $3 \\cdot 1000 = 3000$ килограммов.""",
-                "action": "Проверим, как ты запомнил. Сколько килограммов в $7$ тоннах?",
-                "solution": "$7 \\text{ т} \\cdot 1000 = 7000 \\text{ кг}$",
-                "answer": "7000"
-            },
-            {
-                "info": """Килограмм (кг) — это единица измерения массы, которую мы часто используем в повседневной жизни. В килограммах взвешивают продукты в магазине (например, яблоки, конфеты, муку), вес человека тоже измеряют в килограммах.
-
-Тонна (т) — это единица измерения для очень тяжелых предметов. Она намного больше килограмма.
-
-Главное правило, которое нужно запомнить: $1 \\text{ т} = 1000 \\text{ кг}$.
-
-В тоннах измеряют вес машины, грузовика с песком, урожая картофеля с целого поля или, например, небольшого слона.""",
-                "action": "Сколько килограммов в $1$ тонне?",
-                "solution": "В одной тонне $1000$ килограммов.",
-                "mistake_explanation": {
-                    "100": "Возможно, допущена ошибка в количестве нулей. Стоит вспомнить, что в одной тонне не сто, а тысяча килограммов.",
-                    "1": "Скорее всего, произошла путаница в единицах измерения. Нужно уточнить, что вопрос был о том, сколько килограммов в тонне, а не наоборот."
-                },
-                "answer": "1000"
-            },
-            {
-                "info": """Теперь, когда ты знаешь, что в одной тонне $1000$ килограммов, мы можем переводить в килограммы любое количество тонн.
-
-Для этого нужно количество тонн умножить на $1000$.
-
-Например, чтобы узнать, сколько килограммов в $4$ тоннах, нужно выполнить действие: $4 \\cdot 1000$.""",
-                "action": "Переведи $3$ тонны в килограммы",
-                "solution": """Мы знаем, что $1 \\text{ т} = 1000 \\text{ кг}$.
-
-Чтобы найти, сколько килограммов в $3$ тоннах, нужно умножить количество тонн на $1000$:
-$3 \\cdot 1000 = 3000$
-
-Значит, $3$ тонны — это $3000$ килограммов.""",
-                "mistake_explanation": {
-                    "300": "Вероятно, произошла ошибка в количестве нулей. Стоит вспомнить, что мы умножаем на $1000$ (тысячу), а не на $100$ (сто).",
-                    "3": "Возможно, произошла путаница, и тонны были перепутаны с килограммами без перевода. Важно помнить правило: чтобы перевести тонны в килограммы, необходимо умножить на $1000$."
-                },
-                "answer": "3000"
-            },
-            {
-                "info": """Теперь научимся переводить смешанные единицы (тонны и килограммы) в килограммы. Это не сложнее!
-
-Часто вес указывают именно так: например, $3$ тонны $450$ килограммов.
-
-Наша задача — сложить всё вместе и получить одно число в килограммах.""",
-                "action": "Переведи $3$ тонны $450$ килограммов в килограммы.",
-                "solution": """Мы знаем, что $3 \\text{ т} = 3000 \\text{ кг}$.
-
-Теперь прибавим оставшиеся килограммы:
-$3000 + 450 = 3450$
-
-Значит, $3 \\text{ т } 450 \\text{ кг} = 3450 \\text{ кг}$.""",
-                "mistake_explanation": {
-                    "300450": "Вероятно, числа были просто записаны подряд, без выполнения арифметических действий. Важно помнить, что тонны нужно перевести в килограммы (умножить на $1000$), а затем сложить с килограммами.",
-                    "300": "Возможно, была учтена только часть условия (только тонны) или допущена ошибка в количестве нулей при переводе.",
-                    "3540": "Скорее всего, произошла ошибка в сложении ($3000 + 540$ вместо $3000 + 450$). Стоит проверить арифметику."
-                },
-                "answer": "3450"
-            }
-        ],
-
-        "boss": {
-            "problem": "Выразите в килограммах: 2 т 112 кг",
-            "steps": [
-                {
-                    "step_num": 1,
-                    "action": "Переведём $2$ тонны в килограммы.",
-                    "solution": """В одной тонне $1000$ килограммов.
-
-Чтобы перевести $2$ тонны в килограммы, умножим $1000$ на $2$:
-$1000 \\cdot 2 = 2000$ кг""",
-                    "answer": "2000"
-                },
-                {
-                    "step_num": 2,
-                    "action": "Сложим килограммы из $2$ тонн и оставшиеся $112$ килограммов.",
-                    "solution": """В $2$ тоннах $2000$ кг.
-
-Сложим $2000$ кг и $112$ кг:
-$2000 + 112 = 2112$ кг""",
-                    "answer": "2112"
-                }
-            ],
-            "final_answer": "2112"
-        },
-
-        "summary": """Чтобы перевести массу, заданную в тоннах и килограммах, в килограммы:
-
-✅ Переведи тонны в килограммы (умножь количество тонн на $1000$)
-✅ Прибавь оставшиеся килограммы к полученному результату
-
-**Пример:** $3$ т $450$ кг = $3 \\times 1000 + 450 = 3450$ кг"""
-    }
-}
@@ -0,0 +1,187 @@
+"""
+Каталог тем: индекс для сайдбара и ленивая загрузка схем из data/topics/
+
+Каждая тема - отдельный файл <topic_id>.json (или .yaml / .yml) в формате схемы
+Learn Mode. В памяти постоянно держится только индекс (название, описание, классы);
+полная схема читается при выборе темы и перечитывается, если файл изменился.
+Для индекса из файла берутся только метаданные; схема проверяется и собирается в
+модель Topic (utils.topic_models) при открытии темы - ошибка в одной теме не мешает
+показать остальные.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+
+from utils.topic_models import Topic
+
+TOPICS_DIR = Path(__file__).parent / "topics"
+TOPIC_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+
+@dataclass(frozen=True)
+class TopicInfo:
+    """Запись индекса: все, что нужно сайдбару, без тела схемы"""
+    topic_id: str
+    title: str
+    description: str
+    grades: tuple       # Классы ("1-4", "5-6", ...); пустой - тема для всех классов
+    path: Path
+    mtime_ns: int
+
+    def fits_grade(self, grade: str) -> bool:
+        return not self.grades or grade in self.grades
+
+
+def read_topic_file(path: Path) -> dict:
+    """
+    Читает схему темы из JSON или YAML
+
+    Raises:
+        ValueError: Если в файле не объект схемы
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.suffix == '.json':
+            topic = json.load(f)
+        else:
+            import yaml  # PyYAML нужен только для тем в YAML
+            topic = yaml.safe_load(f)
+
+    if not isinstance(topic, dict):
+        raise ValueError(f"В файле темы нет схемы: {path}")
+    return topic
+
+
+class TopicCatalog(Mapping):
+    """
+    Темы Learn Mode: {topic_id: Topic}, схемы загружаются лениво
+
+    Индекс перестраивается, когда меняется mtime каталога (файл темы добавлен,
+    удален или сохранен через переименование); схема темы перечитывается, когда
+    меняется mtime ее файла. Загруженные схемы держатся в LRU на max_loaded тем.
+
+    Args:
+        directory: Каталог с файлами тем
+        max_loaded: Сколько полных схем держать в памяти
+    """
+
+    def __init__(self, directory: Path = TOPICS_DIR, max_loaded: int = 32):
+        self.directory = Path(directory)
+        self.max_loaded = max_loaded
+
+        self._index = {}              # {topic_id: TopicInfo}, по имени файла
+        self._directory_mtime = None
+        self._loaded = OrderedDict()  # {topic_id: (mtime_ns, Topic)}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _info(topic_id: str, path: Path, mtime: int, data: dict) -> TopicInfo:
+        """Запись индекса из метаданных схемы (без проверки остальных полей)"""
+        grades = data.get('grades')
+        return TopicInfo(
+            topic_id=topic_id,
+            title=str(data.get('title') or topic_id),
+            description=str(data.get('description') or ""),
+            grades=tuple(grade for grade in grades if isinstance(grade, str)) if isinstance(grades, list) else (),
+            path=path,
+            mtime_ns=mtime,
+        )
+
+    def _scan(self):
+        """Перестраивает индекс, если состав каталога изменился"""
+        mtime = self.directory.stat().st_mtime_ns
+        if mtime == self._directory_mtime:
+            return
+
+        index = {}
+        for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+            path = Path(entry.path)
+            if path.suffix not in TOPIC_EXTENSIONS or entry.name.startswith(('.', '_')):
+                continue
+            topic_id = path.stem
+            known = self._index.get(topic_id)
+            if known and known.path == path and known.mtime_ns == entry.stat().st_mtime_ns:
+                index[topic_id] = known
+                continue
+            try:
+                index[topic_id] = self._info(topic_id, path, entry.stat().st_mtime_ns, read_topic_file(path))
+            except (OSError, ValueError) as e:
+                # Нечитаемый файл (недописанный, не JSON/YAML) не должен ронять список тем
+                print(f"❌ Тема {entry.name} пропущена: {e}")
+
+        for topic_id in set(self._loaded) - set(index):
+            del self._loaded[topic_id]
+        self._index = index
+        self._directory_mtime = mtime
+
+    def index(self, grade: str = None) -> list:
+        """
+        Индекс тем для сайдбара (без загрузки схем)
+
+        Args:
+            grade: Класс ученика - оставить только темы для него
+
+        Returns:
+            Список TopicInfo в порядке имен файлов
+        """
+        with self._lock:
+            self._scan()
+            infos = list(self._index.values())
+        if grade is not None:
+            infos = [info for info in infos if info.fits_grade(grade)]
+        return infos
+
+    def info(self, topic_id: str) -> TopicInfo:
+        """Запись индекса темы (KeyError, если темы нет)"""
+        with self._lock:
+            self._scan()
+            return self._index[topic_id]
+
+    def __getitem__(self, topic_id: str) -> Topic:
+        """
+        Схема темы: читается и проверяется при первом обращении и после изменения файла
+
+        Raises:
+            KeyError: Темы нет
+            TopicSchemaError: Схема темы не прошла проверку
+        """
+        with self._lock:
+            self._scan()
+            info = self._index[topic_id]
+            try:
+                mtime = info.path.stat().st_mtime_ns
+            except FileNotFoundError:
+                self._directory_mtime = None  # Файл удален: при следующем обращении индекс перестроится
+                raise KeyError(topic_id)
+
+            cached = self._loaded.get(topic_id)
+            if cached and cached[0] == mtime:
+                self._loaded.move_to_end(topic_id)
+                return cached[1]
+
+            data = read_topic_file(info.path)
+            topic = Topic.from_dict(topic_id, data)
+            self._index[topic_id] = info = self._info(topic_id, info.path, mtime, data)
+            self._loaded[topic_id] = (mtime, topic)
+            self._loaded.move_to_end(topic_id)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+            return topic
+
+    def __iter__(self):
+        with self._lock:
+            self._scan()
+            return iter(list(self._index))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._scan()
+            return len(self._index)
+
+    def __contains__(self, topic_id) -> bool:
+        with self._lock:
+            self._scan()
+            return topic_id in self._index
@@ -1,17 +1,29 @@
 """
 Модуль управления промптами
 """
-from .loader import load_prompt, load_all_prompts
+from .loader import load_prompt, load_all_prompts, compile_prompt, get_compiled_prompt, CompiledPrompt
 
 # Загружаем промпты из markdown файлов
 TUTOR_PROMPT = load_prompt('tutor_prompt')              # Study Mode (свободный тьютор)
-LEARN_MODE_PROMPT = load_prompt('learn_mode_prompt')   # Learn Mode (по схеме)
+LESSON_STEP_PROMPT = load_prompt('lesson_step_prompt')  # Learn Mode (один ход урока, только активный блок)
 FEEDBACK_PROMPT = load_prompt('feedback_prompt')        # Финальный фидбек
 
+# Те же промпты, разобранные на сегменты и слоты (для подстановки за один проход)
+# (актуальную версию после правки .md файла возвращает get_compiled_prompt)
+TUTOR_TEMPLATE = get_compiled_prompt('tutor_prompt')
+LESSON_STEP_TEMPLATE = get_compiled_prompt('lesson_step_prompt')
+FEEDBACK_TEMPLATE = get_compiled_prompt('feedback_prompt')
+
 __all__ = [
     'TUTOR_PROMPT',
-    'LEARN_MODE_PROMPT',
+    'LESSON_STEP_PROMPT',
     'FEEDBACK_PROMPT',
+    'TUTOR_TEMPLATE',
+    'LESSON_STEP_TEMPLATE',
+    'FEEDBACK_TEMPLATE',
+    'CompiledPrompt',
     'load_prompt',
-    'load_all_prompts'
+    'load_all_prompts',
+    'compile_prompt',
+    'get_compiled_prompt'
 ]
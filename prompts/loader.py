@@ -1,8 +1,14 @@
 """
 Загрузчик промптов из Markdown файлов
 """
+import hashlib
+import re
+import threading
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+
+# Плейсхолдер в тексте промпта: {chat_history}, {input}, ...
+PLACEHOLDER_PATTERN = re.compile(r'\{([a-z_]+)\}')
 
 
 def load_prompt(name: str, variables: Optional[Dict[str, str]] = None) -> str:
@@ -49,3 +55,170 @@ def load_all_prompts() -> Dict[str, str]:
         prompts[prompt_name] = md_file.read_text(encoding='utf-8')
 
     return prompts
+
+
+class _Slot(str):
+    """Имя слота внутри разобранного промпта (отличается от литерала по типу)"""
+    __slots__ = ()
+
+
+class CompiledPrompt:
+    """
+    Промпт, один раз разобранный на литеральные сегменты и слоты
+
+    Подстановка значений выполняется за один проход (один "".join), поэтому
+    большой промпт не копируется на каждый плейсхолдер, а подставленный текст
+    (например, сообщение ученика с "{input}" внутри) повторно не сканируется.
+
+    Example:
+        >>> template = compile_prompt('tutor_prompt')
+        >>> prompt = template.render(grade_instructions="...", chat_history="...", input="...")
+    """
+
+    def __init__(self, text: str, name: Optional[str] = None):
+        segments = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            segments.append(text[position:match.start()])
+            segments.append(_Slot(match.group(1)))
+            position = match.end()
+        segments.append(text[position:])
+
+        self._init_segments(segments, name)
+
+    def _init_segments(self, segments: list, name: Optional[str]):
+        # Склеиваем соседние литералы, чтобы render делал как можно меньше работы
+        merged = []
+        for segment in segments:
+            if merged and not isinstance(segment, _Slot) and not isinstance(merged[-1], _Slot):
+                merged[-1] += segment
+            else:
+                merged.append(segment)
+
+        self.name = name
+        self._segments = merged
+        # Имена слотов в порядке появления (без повторов)
+        self.slots = tuple(dict.fromkeys(s for s in merged if isinstance(s, _Slot)))
+        self._split = None
+
+    @property
+    def text(self) -> str:
+        """Исходный текст промпта с незаполненными плейсхолдерами"""
+        return "".join("{" + s + "}" if isinstance(s, _Slot) else s for s in self._segments)
+
+    def render(self, **values: str) -> str:
+        """
+        Подставляет значения во все слоты за один проход
+
+        Args:
+            **values: Значения для каждого слота промпта
+
+        Returns:
+            Готовый текст промпта
+
+        Raises:
+            KeyError: Если не передано значение для какого-то слота
+        """
+        missing = [slot for slot in self.slots if slot not in values]
+        if missing:
+            raise KeyError(f"Не переданы значения для слотов промпта {self.name}: {', '.join(missing)}")
+
+        return "".join(values[s] if isinstance(s, _Slot) else s for s in self._segments)
+
+    def partial(self, **values: str) -> "CompiledPrompt":
+        """
+        Заполняет часть слотов и возвращает новый шаблон с оставшимися
+
+        Используется для статической части промпта (инструкции класса), которая не
+        меняется между сообщениями: ее собирают один раз и переиспользуют.
+
+        Args:
+            **values: Значения для части слотов
+
+        Returns:
+            Новый CompiledPrompt, в котором заполненные слоты стали литералами
+        """
+        segments = [
+            str(values[s]) if isinstance(s, _Slot) and s in values else s
+            for s in self._segments
+        ]
+
+        compiled = CompiledPrompt.__new__(CompiledPrompt)
+        compiled._init_segments(segments, self.name)
+        return compiled
+
+    @property
+    def version(self) -> str:
+        """Короткий хеш текста шаблона (меняется при изменении файла промпта)"""
+        return hashlib.sha1(self.text.encode('utf-8')).hexdigest()[:12]
+
+    def split_prefix(self) -> Tuple[str, "CompiledPrompt"]:
+        """
+        Делит шаблон на статический префикс и шаблон для остатка
+
+        Префикс - весь литеральный текст до первого незаполненного слота. Для шаблонов
+        урока и тьютора после partial(grade_instructions=...) это преамбула промпта и
+        инструкции класса - они одинаковы на каждом ходе. Активный блок урока ({lesson}),
+        история и сообщение ученика остаются в шаблоне остатка.
+
+        Returns:
+            (префикс, CompiledPrompt с оставшимися слотами)
+        """
+        if self._split is None:
+            segments = self._segments
+            if segments and not isinstance(segments[0], _Slot):
+                prefix, rest = segments[0], segments[1:]
+            else:
+                prefix, rest = "", segments
+
+            suffix = CompiledPrompt.__new__(CompiledPrompt)
+            suffix._init_segments(list(rest), self.name)
+            self._split = (prefix, suffix)
+
+        return self._split
+
+    def __repr__(self) -> str:
+        return f"CompiledPrompt(name={self.name!r}, slots={self.slots!r})"
+
+
+def compile_prompt(name: str) -> CompiledPrompt:
+    """
+    Загружает промпт из markdown файла и разбирает его на сегменты и слоты
+
+    Args:
+        name: Имя файла промпта (без расширения .md)
+
+    Returns:
+        CompiledPrompt
+    """
+    return CompiledPrompt(load_prompt(name), name=name)
+
+
+_compiled_prompts = {}  # {name: (mtime_ns, CompiledPrompt)}
+_compiled_prompts_lock = threading.Lock()
+
+
+def get_compiled_prompt(name: str) -> CompiledPrompt:
+    """
+    Возвращает разобранный промпт, перечитывая файл только если он изменился
+
+    Args:
+        name: Имя файла промпта (без расширения .md)
+
+    Returns:
+        CompiledPrompt актуальной версии файла
+    """
+    prompt_path = Path(__file__).parent / f"{name}.md"
+    mtime = prompt_path.stat().st_mtime_ns
+
+    with _compiled_prompts_lock:
+        cached = _compiled_prompts.get(name)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+    compiled = compile_prompt(name)
+
+    with _compiled_prompts_lock:
+        _compiled_prompts[name] = (mtime, compiled)
+
+    return compiled
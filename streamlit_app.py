@@ -1,14 +1,25 @@
 import streamlit as st
+import json
 import os
+import secrets
 import uuid
-import re
 from datetime import datetime
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
-from data import TOPICS, get_grade_instruction  # Новый формат схем
-from prompts import TUTOR_PROMPT, LEARN_MODE_PROMPT, FEEDBACK_PROMPT
-from utils import format_schema, format_chat_to_markdown, get_chat_filename, save_chat_to_sheets
+from data import TOPICS, get_grade_instruction  # Каталог тем (data/topics/)
+from prompts import get_compiled_prompt
+from utils import format_feedback_context, iter_chat_markdown, get_chat_filename, get_sheets_exporter
+from utils import LessonEngine
+from utils import MarkerStreamFilter, parse_quick_replies, check_answer_correctness, LESSON_COMPLETE_MARKER
+from utils import build_prompt_messages, ConversationMemory
+from utils import InstrumentedLLM, start_metrics_server
+from utils import LLMProvider, create_llm_router, get_outbound_gate
+from utils import CachedLLM, get_response_cache, make_cache_key
+from utils import get_llm_task_runner
+from utils import get_session_store, quiz_state_from_log, quiz_state_to_log
+from utils import CHAT_CSS, HISTORY_BLOCK_SIZE, split_history, render_quiz_html, quiz_key
+from utils.fake_llm import fake_llm_from_env
 
 load_dotenv()
 
@@ -16,101 +27,452 @@ st.set_page_config(page_title="Математический помощник AI"
 
 # ============= УТИЛИТЫ =============
 
-def parse_quick_replies(text):
-    """
-    Парсит маркер быстрых ответов из текста
+def llm_call_tags(call):
+    """Метки вызова LLM для метрик: тип вызова, режим, класс и тема"""
+    return {
+        "call": call,
+        "mode": st.session_state.mode,
+        "grade": st.session_state.grade,
+        "topic_id": st.session_state.current_topic or "-"
+    }
 
-    Формат: [QUICK_REPLIES: "Вариант 1" | "Вариант 2" | ...]
 
-    Returns:
-        tuple: (cleaned_text, list_of_replies)
+def start_llm_task(llm, prompt, call, cache_key=None):
     """
-    pattern = r'\[QUICK_REPLIES:\s*(.+?)\]'
-    match = re.search(pattern, text)
+    Запускает вызов LLM в фоне (поток скрипта не ждет сеть)
 
-    if match:
-        # Извлекаем варианты ответов
-        replies_str = match.group(1)
-        # Разбиваем по разделителю |
-        replies = [r.strip().strip('"\'') for r in replies_str.split('|')]
-        # Убираем маркер из текста
-        cleaned_text = re.sub(pattern, '', text).strip()
-        return cleaned_text, replies
+    Args:
+        llm: LLM из init_bot/init_tutor
+        prompt: Полный промпт
+        call: Тип вызова для метрик (greeting, tutor, learn, feedback)
+        cache_key: Ключ кеша ответов (только для ходов Learn Mode при включенном кеше)
 
-    return text, []
+    Returns:
+        LLMTask - handle, который хранится в session_state до вывода ответа
+    """
+    kwargs = {"cache_key": cache_key} if cache_key else {}
+    return get_llm_task_runner().submit(llm, prompt, call=call, metrics_tags=llm_call_tags(call), **kwargs)
 
 
-def check_answer_correctness(response_text):
+def show_llm_task(task):
     """
-    Определяет правильность ответа по тексту ответа AI
+    Выводит ответ фоновой задачи по мере генерации, скрывая служебные маркеры
 
-    Args:
-        response_text: Текст ответа AI
+    Если ответ уже готов (скрипт перезапускался, пока шла генерация), он выводится сразу.
 
     Returns:
-        bool: True если ответ правильный, False если неправильный, None если не удалось определить
+        str: Полный текст ответа вместе с маркерами (для разбора после окончания потока)
     """
-    response_lower = response_text.lower()
+    # Если провайдер занят всем классом, ученик видит свое место в очереди, а не ошибку
+    queue_notice = st.empty()
 
-    # Ищем явные маркеры правильности
-    correct_markers = ['правильно', 'верно', 'точно', 'отлично', 'молодец', 'именно так', 'да, это правильный ответ']
-    incorrect_markers = ['неправильно', 'неверно', 'ошибка', 'не совсем', 'почти', 'к сожалению, нет']
+    def show_queue_position():
+        if task.queue_position and task.first_chunk_at is None:
+            queue_notice.info(f"⏳ Сейчас много учеников задают вопросы. Ты {task.queue_position}-й в очереди — ответ скоро будет!")
 
-    # Проверяем первые 100 символов ответа (обычно там содержится оценка)
-    first_part = response_lower[:150]
+    def hide_notice_on_first_chunk(chunks):
+        for i, chunk in enumerate(chunks):
+            if i == 0:
+                queue_notice.empty()
+            yield chunk
 
-    has_correct = any(marker in first_part for marker in correct_markers)
-    has_incorrect = any(marker in first_part for marker in incorrect_markers)
+    stream_filter = MarkerStreamFilter()
+    try:
+        chunks = task.iter_text(on_idle=show_queue_position)
+        st.write_stream(stream_filter.iter_visible(hide_notice_on_first_chunk(chunks)))
+    finally:
+        queue_notice.empty()
+    return stream_filter.text
 
-    if has_correct and not has_incorrect:
-        return True
-    elif has_incorrect and not has_correct:
-        return False
+# ============= ИНИЦИАЛИЗАЦИЯ АГЕНТА =============
 
-    return None
+# Провайдеры LLM: выбранный в сайдбаре - основной, другой (если для него есть ключ) - запасной
+PROVIDERS = ("Google Gemini 2.5 Flash", "YandexGPT 5.1 Pro")
 
-# ============= ИНИЦИАЛИЗАЦИЯ АГЕНТА =============
+# Сколько ждать первый токен от провайдера, секунды (после этого - запасной провайдер)
+PROVIDER_TIMEOUTS = {
+    "Google Gemini 2.5 Flash": float(os.getenv("LLM_TIMEOUT_GEMINI", "20")),
+    "YandexGPT 5.1 Pro": float(os.getenv("LLM_TIMEOUT_YANDEX", "20")),
+}
+
+# Лимиты исходящих запросов на провайдера и ключ (по умолчанию - под квоты платного тарифа)
+PROVIDER_LIMITS = {
+    "Google Gemini 2.5 Flash": {
+        "max_concurrent": int(os.getenv("LLM_CONCURRENCY_GEMINI", "16")),
+        "rpm": float(os.getenv("LLM_RPM_GEMINI", "1000")),
+    },
+    "YandexGPT 5.1 Pro": {
+        "max_concurrent": int(os.getenv("LLM_CONCURRENCY_YANDEX", "10")),
+        "rpm": float(os.getenv("LLM_RPM_YANDEX", "600")),
+    },
+}
+
+
+def create_provider_llm(provider, api_key, temperature, thinking=True):
+    """Чат-модель одного провайдера (thinking=False - Gemini без thinking mode, быстрее отвечает)"""
+    if provider == "YandexGPT 5.1 Pro":
+        return ChatOpenAI(api_key=api_key, base_url="http://localhost:8520/v1",
+                          model="yandexgpt/latest", temperature=temperature)
+
+    kwargs = {} if thinking else {"model_kwargs": {"thinking_config": {"thinking_mode": "DISABLED"}}}
+    return ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=api_key,
+                                  temperature=temperature, convert_system_message_to_human=True, **kwargs)
+
+
+def create_llm(model_choice, yandex_key, gemini_key, temperature, thinking=True):
+    """
+    LLM с таймаутами, повторами и переключением между провайдерами (LLMRouter)
+
+    Ключ запасного провайдера берется из сайдбара или из окружения (YANDEX_API_KEY,
+    GOOGLE_API_KEY); без ключа провайдер не подключается.
+    """
+    keys = {
+        "Google Gemini 2.5 Flash": gemini_key or os.getenv("GOOGLE_API_KEY", ""),
+        "YandexGPT 5.1 Pro": yandex_key or os.getenv("YANDEX_API_KEY", ""),
+    }
+    # FAKE_LLM=1 - локальная фейковая LLM для нагрузочных тестов (benchmarks/load_test.py)
+    fake_llm = fake_llm_from_env()
+
+    providers = []
+    for provider in [model_choice] + [p for p in PROVIDERS if p != model_choice]:
+        if fake_llm is not None:
+            llm = fake_llm
+        elif provider == model_choice or keys[provider]:
+            llm = create_provider_llm(provider, keys[provider], temperature, thinking)
+        else:
+            continue
+        # Общий на процесс шлюз на провайдера и ключ: очередь, лимиты, предохранитель
+        gate = get_outbound_gate(
+            provider, keys[provider],
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+            **PROVIDER_LIMITS[provider]
+        )
+        # Каждый вызов замеряется (размер промпта, время до первого токена, задержка, ошибки)
+        providers.append(LLMProvider(provider, InstrumentedLLM(llm, model=provider), PROVIDER_TIMEOUTS[provider], gate))
+        if fake_llm is not None:
+            break
+
+    return create_llm_router(providers)
 
 @st.cache_resource
 def init_bot(model_choice, yandex_key, gemini_key):
     """Инициализирует помощника - возвращает прямой LLM без инструментов"""
-    if model_choice == "YandexGPT 5.1 Pro":
-        llm = ChatOpenAI(api_key=yandex_key, base_url="http://localhost:8520/v1",
-                        model="yandexgpt/latest", temperature=0.3)
-    else:
-        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=gemini_key,
-                                    temperature=0.3, convert_system_message_to_human=True)
-
-    return llm
+    return create_llm(model_choice, yandex_key, gemini_key, temperature=0.3)
 
 @st.cache_resource
 def init_tutor(model_choice, yandex_key, gemini_key):
     """Инициализирует тьютора для Study Mode - возвращает прямой LLM без агента"""
-    if model_choice == "YandexGPT 5.1 Pro":
-        llm = ChatOpenAI(api_key=yandex_key, base_url="http://localhost:8520/v1",
-                        model="yandexgpt/latest", temperature=0.6)
-    else:
-        # Используем Gemini без thinking mode для более быстрых ответов
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=gemini_key,
-            temperature=0.6,
-            convert_system_message_to_human=True,
-            model_kwargs={
-                "thinking_config": {
-                    "thinking_mode": "DISABLED"
-                }
-            }
-        )
+    # Используем Gemini без thinking mode для более быстрых ответов
+    llm = create_llm(model_choice, yandex_key, gemini_key, temperature=0.6, thinking=False)
 
+    # RESPONSE_CACHE=1 - одинаковые ответы на одном шаге урока отдаются из кеша
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        return CachedLLM(llm, response_cache)
     return llm
 
 # ============= ФУНКЦИИ =============
 # (Старые функции удалены - используем промпт-подход)
 
+def get_tutor_template(grade):
+    """Шаблон Study Mode со статической частью (инструкции класса), собирается один раз на класс"""
+    # Версия файла промпта в ключе: после правки tutor_prompt.md шаблон соберется заново
+    return _build_tutor_template(grade, get_compiled_prompt('tutor_prompt').version)
+
+@st.cache_resource
+def _build_tutor_template(grade, prompt_version):
+    return get_compiled_prompt('tutor_prompt').partial(grade_instructions=get_grade_instruction(grade))
+
+def get_lesson_template(grade):
+    """Шаблон хода урока со статической частью (инструкции класса), собирается один раз на класс"""
+    # Версия файла промпта в ключе: после правки lesson_step_prompt.md шаблон соберется заново
+    return _build_lesson_template(grade, get_compiled_prompt('lesson_step_prompt').version)
+
+@st.cache_resource
+def _build_lesson_template(grade, prompt_version):
+    return get_compiled_prompt('lesson_step_prompt').partial(grade_instructions=get_grade_instruction(grade))
+
+def open_topic(topic_id):
+    """
+    Схема темы или None, если файл темы не прошел проверку (ошибка выводится на странице)
+
+    Индекс тем проверяет только метаданные, поэтому ошибку в схеме видно лишь при открытии темы.
+    """
+    try:
+        return TOPICS[topic_id]
+    except ValueError as e:  # TopicSchemaError или нечитаемый файл
+        st.error(f"❌ Тема «{topic_id}» не открывается: {e}")
+        return None
+
+def get_lesson():
+    """Движок урока текущей темы (хранится в session_state, создается при выборе темы)"""
+    lesson = st.session_state.get("lesson")
+    if lesson is None or lesson.topic_id != st.session_state.current_topic:
+        topic_id = st.session_state.current_topic
+        lesson = LessonEngine(topic_id, TOPICS[topic_id])
+        st.session_state.lesson = lesson
+    return lesson
+
+def get_memory():
+    """Память разговора текущей сессии (создается заново при смене сессии)"""
+    memory = st.session_state.get("memory")
+    if memory is None or memory.session_id != st.session_state.session_id:
+        memory = ConversationMemory(session_id=st.session_state.session_id)
+        st.session_state.memory = memory
+    return memory
+
+# Случайных байт в токене сессии (в адресе ~22 символа); более короткие токены не принимаются
+SESSION_TOKEN_BYTES = 16
+
+# Сколько последних сообщений поднимается из хранилища при возвращении ученика
+SESSION_RESTORE_WINDOW = int(os.getenv("SESSION_RESTORE_WINDOW", "200"))
+
+# Сколько сообщений в блоке истории, который выводится одной готовой разметкой (0 - выключено)
+CHAT_HISTORY_BLOCK = int(os.getenv("CHAT_HISTORY_BLOCK", str(HISTORY_BLOCK_SIZE)))
+
+def start_new_session():
+    """
+    Новая сессия: короткий ID для экрана и выгрузок и отдельный секретный токен для адреса
+
+    По токену (?session=) сессия поднимается из хранилища, то есть он дает доступ к
+    диалогу ученика - поэтому это не session_id, который виден в интерфейсе и в таблице.
+    """
+    st.session_state.session_id = str(uuid.uuid4())[:8]  # Короткий уникальный ID
+    st.session_state.session_token = secrets.token_urlsafe(SESSION_TOKEN_BYTES)
+    st.session_state.session_start = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
+
+def message_offset():
+    """Номер первого сообщения из session_state.messages в журнале сессии (не 0, если поднято окно)"""
+    persisted_session, offset, _, _ = st.session_state.session_persisted
+    return offset if persisted_session == st.session_state.session_id else 0
+
+def session_state_record():
+    """Небольшое состояние сессии для хранилища (сообщения пишутся отдельно, в журнал)"""
+    lesson = st.session_state.lesson
+    offset = message_offset()
+    return {
+        "session_id": st.session_state.session_id,
+        "mode": st.session_state.mode,
+        "grade": st.session_state.grade,
+        "current_topic": st.session_state.current_topic,
+        "session_start": st.session_state.session_start,
+        "study_mode_initialized": st.session_state.study_mode_initialized,
+        "needs_feedback": st.session_state.needs_feedback,
+        "quick_replies": st.session_state.quick_replies,
+        # Ключи квиза - номера сообщений в журнале, а не в поднятом окне
+        "quiz_state": quiz_state_to_log(st.session_state.quiz_state, offset),
+        "lesson": lesson.snapshot() if lesson is not None else None,
+    }
+
+def restore_session():
+    """
+    Поднимает сессию из хранилища по ?session=<токен> в адресе
+
+    Так ученик после обновления страницы или перезапуска сервера продолжает урок
+    с того же места, а не проходит заново уже оплаченные ходы.
+
+    Returns:
+        bool: True, если сессия восстановлена
+    """
+    store = get_session_store()
+    token = st.query_params.get("session")
+    # Короткие значения - старые ссылки с session_id вместо токена: их легко подобрать
+    if store is None or not token or len(token) < SESSION_TOKEN_BYTES:
+        return False
+
+    stored = store.load(token, window=SESSION_RESTORE_WINDOW)
+    if stored is None:
+        return False
+    state = stored.state
+
+    lesson = None
+    topic_id = state.get("current_topic")
+    if topic_id is not None:
+        topic = open_topic(topic_id) if topic_id in TOPICS else None
+        if topic is None:
+            return False  # Тему удалили или испортили - начинаем новую сессию
+        lesson = LessonEngine(topic_id, topic)
+        if state.get("lesson"):
+            lesson.restore(state["lesson"])
+
+    session_id = state.get("session_id") or str(uuid.uuid4())[:8]
+    st.session_state.session_id = session_id
+    st.session_state.session_token = token
+    st.session_state.session_start = state.get("session_start") or datetime.now().strftime('%d.%m.%Y %H:%M:%S')
+    st.session_state.mode = state.get("mode", "learn")
+    st.session_state.mode_selector = st.session_state.mode  # Иначе радио вернет режим по умолчанию и сбросит урок
+    st.session_state.grade = state.get("grade", "5-6")
+    st.session_state.current_topic = topic_id
+    st.session_state.lesson = lesson
+    st.session_state.messages = stored.messages
+    st.session_state.study_mode_initialized = state.get("study_mode_initialized", bool(stored.messages))
+    st.session_state.needs_feedback = state.get("needs_feedback", False)
+    st.session_state.quick_replies = state.get("quick_replies", [])
+    # Ключи квиза - номера сообщений; если поднято только окно журнала, номера сдвигаются
+    st.session_state.quiz_state = quiz_state_from_log(state.get("quiz_state", {}), stored.offset)
+    # Поднятые сообщения уже в журнале - дописываться будут только новые
+    st.session_state.session_persisted = (session_id, stored.offset, len(stored.messages), None)
+    return True
+
+def persist_session():
+    """
+    Дописывает в хранилище новые сообщения и, если оно изменилось, состояние сессии
+
+    Сообщения уходят в журнал по одному разу; список сообщений целиком не сериализуется.
+    """
+    session_id = st.session_state.session_id
+    token = st.session_state.session_token
+    if st.query_params.get("session") != token:
+        st.query_params["session"] = token  # Адрес с сессией переживает обновление страницы
+
+    store = get_session_store()
+    if store is None:
+        return
+
+    persisted_session, offset, persisted_count, persisted_state = st.session_state.session_persisted
+    if persisted_session != session_id:
+        offset, persisted_count, persisted_state = 0, 0, None
+
+    messages = st.session_state.messages
+    if len(messages) > persisted_count:
+        store.append_messages(token, offset + persisted_count, messages[persisted_count:])
+
+    state = json.dumps(session_state_record(), ensure_ascii=False)
+    if state != persisted_state:
+        store.save_state(token, json.loads(state))
+    st.session_state.session_persisted = (session_id, offset, len(messages), state)
+
+def chat_export_key(topic_title):
+    """Ключ кеша экспорта: (session_id, сколько сообщений в сессии, тема)"""
+    return (st.session_state.session_id, message_offset() + len(st.session_state.messages), topic_title)
+
+def chat_export_data(topic_title):
+    """
+    Диалог в Markdown для скачивания - собирается по частям и кешируется
+
+    Пока диалог не изменился (тот же chat_export_key), прогоны скрипта отдают
+    готовые байты и не форматируют историю заново.
+
+    Returns:
+        (имя файла, байты UTF-8)
+    """
+    key = chat_export_key(topic_title)
+    cached_key, filename, data = st.session_state.chat_export
+    if cached_key != key:
+        filename = get_chat_filename(topic_title, "md")
+        data = b"".join(
+            chunk.encode("utf-8") for chunk in iter_chat_markdown(st.session_state.messages, topic_title)
+        )
+        st.session_state.chat_export = (key, filename, data)
+    return filename, data
+
+def chat_export_ready(topic_title):
+    """Есть ли в кеше экспорт текущего диалога (тогда кнопка скачивания не требует подготовки)"""
+    return st.session_state.chat_export[0] == chat_export_key(topic_title)
+
+def cancel_llm_tasks():
+    """Отменяет фоновые ответы, которые еще не выведены (новая тема, смена режима, начать заново)"""
+    for key in ("reply_task", "feedback_task"):
+        task = st.session_state.get(key)
+        if task is not None:
+            task.cancel()
+        st.session_state[key] = None
+
+def deliver_llm_tasks():
+    """
+    Выводит ответы фоновых задач и добавляет их в историю
+
+    Вызывается на каждом прогоне: если прошлый прогон прервался посреди вывода,
+    ответ дочитывается из handle в session_state, а не запрашивается заново.
+    Фидбек генерируется параллельно с ответом на ход, но выводится после него.
+    """
+    task = st.session_state.reply_task
+    if task is not None:
+        quick_replies = []
+        with st.chat_message("assistant"):
+            try:
+                response = show_llm_task(task)
+                if task.call == "learn":
+                    # Служебные метки урока больше не нужны; если модель все же добавила - не сохраняем
+                    response = response.replace(LESSON_COMPLETE_MARKER, "").strip()
+                else:
+                    # Парсим быстрые ответы (маркер уже скрыт из потока)
+                    response, quick_replies = parse_quick_replies(response)
+            except Exception as e:
+                if task.call == "greeting":
+                    print(f"Study Mode init error: {e}")
+                    # Фоллбек на простое приветствие
+                    response = "Привет! Я помогу тебе разобраться с любой темой 📚 Скажи, пожалуйста, в каком ты классе и что сегодня будем изучать?"
+                else:
+                    print(f"{'Tutor' if task.call == 'tutor' else 'Learn mode'} error: {e}")
+                    response = "Извини, произошла ошибка. Попробуй переформулировать вопрос."
+                st.markdown(response)
+
+        st.session_state.messages.append({"role": "assistant", "content": response})
+        st.session_state.reply_task = None
+        if task.call != "learn":
+            st.session_state.quick_replies = quick_replies
+
+        # Проверяем был ли это ответ на квиз
+        if task.call == "tutor" and st.session_state.pending_quiz_answer:
+            quiz_info = st.session_state.pending_quiz_answer
+            # Определяем правильность ответа
+            is_correct = check_answer_correctness(response)
+
+            # Сохраняем результат в quiz_state
+            st.session_state.quiz_state[quiz_info["message_idx"]] = {
+                "selected": quiz_info["selected"],
+                "correct": is_correct if is_correct is not None else False,
+                "replies": quiz_info["replies"]
+            }
+
+            # Очищаем pending_quiz_answer
+            st.session_state.pending_quiz_answer = None
+
+        # Если есть быстрые ответы, делаем rerun чтобы кнопки появились
+        if quick_replies:
+            st.rerun()
+
+    task = st.session_state.feedback_task
+    if task is not None and st.session_state.reply_task is None:
+        with st.chat_message("assistant"):
+            try:
+                # Показываем фидбек по мере генерации
+                st.markdown("\n\n---\n\n")
+                feedback = show_llm_task(task)
+                st.session_state.messages.append({"role": "assistant", "content": f"\n\n---\n\n{feedback}"})
+
+                # Сбрасываем флаг
+                st.session_state.needs_feedback = False
+            except Exception as e:
+                # Флаг остается - фидбек запросится заново после следующего ответа ученика
+                print(f"Feedback error: {e}")
+        # Handle сбрасывается только после вывода: если перезапуск прервал поток,
+        # следующий прогон дочитает тот же фидбек, а не запросит его заново
+        st.session_state.feedback_task = None
+
+
+@st.cache_resource
+def init_metrics_endpoint():
+    """Поднимает endpoint /metrics (формат Prometheus), если задан LLM_METRICS_PORT"""
+    port = os.getenv("LLM_METRICS_PORT")
+    if port:
+        return start_metrics_server(int(port))
+    return None
+
+
+init_metrics_endpoint()
 
 # ============= ИНИЦИАЛИЗАЦИЯ СОСТОЯНИЯ =============
 
+# Хранилище сессий: запись новых сообщений (session_id, смещение окна, сколько записано, состояние)
+if "session_persisted" not in st.session_state:
+    st.session_state.session_persisted = (None, 0, 0, None)
+# Новое подключение: если в адресе есть ?session=, урок продолжается с того же места
+if "session_id" not in st.session_state:
+    restore_session()
+
 if "mode" not in st.session_state:
     # По умолчанию режим изучения темы
     st.session_state.mode = "learn"
@@ -124,12 +486,13 @@ if "study_mode_initialized" not in st.session_state:
     st.session_state.study_mode_initialized = False
 if "needs_feedback" not in st.session_state:
     st.session_state.needs_feedback = False
+# Состояние урока: этап, текущий блок или шаг, попытки (LessonEngine)
+if "lesson" not in st.session_state:
+    st.session_state.lesson = None
 
-# ID сессии и метаданные для Google Sheets
+# ID сессии (для экрана и Google Sheets), токен для адреса и время начала
 if "session_id" not in st.session_state:
-    st.session_state.session_id = str(uuid.uuid4())[:8]  # Короткий уникальный ID
-if "session_start" not in st.session_state:
-    st.session_state.session_start = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
+    start_new_session()
 
 # Быстрые ответы (кнопки)
 if "quick_replies" not in st.session_state:
@@ -143,6 +506,23 @@ if "quiz_state" not in st.session_state:
 if "pending_quiz_answer" not in st.session_state:
     st.session_state.pending_quiz_answer = None
 
+# Фоновые вызовы LLM (handle LLMTask): ответ на ход и фидбек, пока они не выведены в чат
+if "reply_task" not in st.session_state:
+    st.session_state.reply_task = None
+if "feedback_task" not in st.session_state:
+    st.session_state.feedback_task = None
+
+# Экспорт диалога в Markdown: (ключ (session_id, число сообщений, тема), имя файла, байты)
+if "chat_export" not in st.session_state:
+    st.session_state.chat_export = (None, None, None)
+
+# Фоновое сохранение в Google Sheets (handle последней задачи)
+if "sheets_export" not in st.session_state:
+    st.session_state.sheets_export = None
+# Автосохранение: (session_id, сколько сообщений уже отправлено в очередь)
+if "sheets_flushed" not in st.session_state:
+    st.session_state.sheets_flushed = (None, 0)
+
 # Класс ученика (по умолчанию 5-6)
 if "grade" not in st.session_state:
     st.session_state.grade = "5-6"
@@ -181,9 +561,9 @@ with st.sidebar:
         st.session_state.study_mode_initialized = False
         st.session_state.needs_feedback = False
         st.session_state.quiz_state = {}  # Очищаем состояние квиза
-        # Новая сессия
-        st.session_state.session_id = str(uuid.uuid4())[:8]
-        st.session_state.session_start = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
+        st.session_state.lesson = None  # Урок начнется заново
+        cancel_llm_tasks()  # Недоставленные ответы прошлой сессии не нужны
+        start_new_session()
     
     st.markdown("---")
     
@@ -218,27 +598,29 @@ with st.sidebar:
     if mode == "learn":
         # Режим изучения темы
         st.header("📚 Выбери тему")
-        for topic_id, topic_data in TOPICS.items():
-            if st.button(topic_data['title'], key=f"topic_{topic_id}", use_container_width=True):
+        # Индекс тем без загрузки схем; схема читается только при выборе темы
+        topic_index = TOPICS.index(st.session_state.grade)
+        if not topic_index:
+            st.caption("Для твоего класса тем пока нет — вот все темы")
+            topic_index = TOPICS.index()
+        for topic_info in topic_index:
+            topic_id = topic_info.topic_id
+            if st.button(topic_info.title, key=f"topic_{topic_id}", help=topic_info.description or None,
+                         use_container_width=True):
+                topic = open_topic(topic_id)
+                if topic is None:
+                    continue
                 st.session_state.current_topic = topic_id
                 st.session_state.needs_feedback = False  # Сбрасываем при выборе новой темы
                 st.session_state.quiz_state = {}  # Очищаем состояние квиза
-                # Новая сессия
-                st.session_state.session_id = str(uuid.uuid4())[:8]
-                st.session_state.session_start = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
-
-                # Приветственное сообщение с планом урока
-                welcome_message = f"**{topic_data['title']}**\n\n{topic_data.get('description', '')}\n\n"
-
-                # Добавляем план, если он есть
-                if 'plan' in topic_data:
-                    welcome_message += f"{topic_data['plan']}\n\n"
-
-                welcome_message += "Готов? Поехали! 🚀"
+                st.session_state.lesson = None  # Урок начнется заново
+                cancel_llm_tasks()  # Недоставленные ответы прошлой сессии не нужны
+                start_new_session()
 
+                # Приветственное сообщение с планом урока (собрано при загрузке темы)
                 st.session_state.messages = [{
                     "role": "assistant",
-                    "content": welcome_message
+                    "content": topic.welcome_message
                 }]
                 st.rerun()
     st.markdown("---")
@@ -249,9 +631,9 @@ with st.sidebar:
         st.session_state.study_mode_initialized = False
         st.session_state.needs_feedback = False
         st.session_state.quiz_state = {}  # Очищаем состояние квиза
-        # Новая сессия
-        st.session_state.session_id = str(uuid.uuid4())[:8]
-        st.session_state.session_start = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
+        st.session_state.lesson = None  # Урок начнется заново
+        cancel_llm_tasks()  # Недоставленные ответы прошлой сессии не нужны
+        start_new_session()
         st.rerun()
 
     # Кнопка экспорта диалога
@@ -262,36 +644,46 @@ with st.sidebar:
         # Получаем название темы если есть
         topic_title = None
         if st.session_state.mode == "learn" and st.session_state.current_topic:
-            topic_title = TOPICS[st.session_state.current_topic].get('title', 'Тема')
-
-        # Форматируем диалог
-        chat_markdown = format_chat_to_markdown(st.session_state.messages, topic_title)
-        filename = get_chat_filename(topic_title, "md")
-
-        # Кнопка скачивания
-        st.download_button(
-            label="📥 Скачать диалог (Markdown)",
-            data=chat_markdown,
-            file_name=filename,
-            mime="text/markdown",
-            use_container_width=True
-        )
-
-        # Кнопка сохранения в Google Sheets
+            topic_title = TOPICS.info(st.session_state.current_topic).title
+
+        # Диалог форматируется только по запросу (и один раз на состояние диалога),
+        # а не на каждом прогоне скрипта
+        if chat_export_ready(topic_title):
+            filename, chat_markdown = chat_export_data(topic_title)
+            st.download_button(
+                label="📥 Скачать диалог (Markdown)",
+                data=chat_markdown,
+                file_name=filename,
+                mime="text/markdown",
+                use_container_width=True
+            )
+        elif st.button("📥 Подготовить диалог (Markdown)", use_container_width=True):
+            chat_export_data(topic_title)
+            st.rerun()
+
+        # Кнопка сохранения в Google Sheets - диалог ставится в фоновую очередь
         if st.button("📊 Сохранить в Google Sheets", use_container_width=True):
-            with st.spinner("Сохраняю в Google Sheets..."):
-                success = save_chat_to_sheets(
-                    messages=st.session_state.messages,
-                    topic_title=topic_title,
-                    session_id=st.session_state.session_id,
-                    session_start=st.session_state.session_start
-                )
-
-                if success:
-                    st.success(f"✅ Диалог сохранен в Google Sheets! (Session ID: {st.session_state.session_id})")
-                else:
-                    st.error("❌ Ошибка сохранения. Проверьте настройки Google Sheets в .env файле")
-                    st.info("💡 Инструкция по настройке в файле GOOGLE_SHEETS_SETUP.md")
+            st.session_state.sheets_export = get_sheets_exporter().submit(
+                messages=st.session_state.messages,
+                topic_title=topic_title,
+                session_id=st.session_state.session_id,
+                session_start=st.session_state.session_start,
+                grade=st.session_state.grade,
+                offset=message_offset()
+            )
+
+        # Статус последнего сохранения (опрашиваем handle, не блокируя страницу)
+        export_handle = st.session_state.sheets_export
+        if export_handle is not None:
+            if export_handle.is_pending:
+                st.info("⏳ Диалог сохранен на сервере, отправляю в Google Sheets в фоне...")
+                st.button("🔄 Проверить статус", use_container_width=True)
+            elif export_handle.status == "done":
+                st.success(f"✅ Диалог сохранен в Google Sheets! (Session ID: {export_handle.session_id}, новых сообщений: {export_handle.rows_count})")
+            else:
+                # Диалог уже в локальном журнале - в таблицу он уйдет, когда Sheets станет доступен
+                st.error("❌ Диалог сохранен на сервере, но не отправлен в Google Sheets. Проверьте настройки Google Sheets в .env файле")
+                st.info("💡 Инструкция по настройке в файле GOOGLE_SHEETS_SETUP.md")
 
 # ============= ПРОВЕРКА API =============
 
@@ -316,86 +708,64 @@ if st.session_state.mode == "study" and not st.session_state.study_mode_initiali
     # Вызываем модель с пустым input - она сама начнет диалог согласно TUTOR_PROMPT
     tutor_llm = init_tutor(model_choice, yandex_api_key, gemini_api_key)
 
-    # Получаем инструкции для выбранного класса
-    grade_instructions = get_grade_instruction(st.session_state.grade)
+    # Формируем промпт с пустой историей и пустым input (инструкции класса уже в шаблоне)
+    # Статический префикс уходит отдельным системным сообщением (кешируется провайдером)
+    full_prompt = build_prompt_messages(
+        get_tutor_template(st.session_state.grade), chat_history="", input=""
+    )
 
-    # Формируем промпт с пустой историей и пустым input
-    full_prompt = TUTOR_PROMPT.replace("{grade_instructions}", grade_instructions).replace("{chat_history}", "").replace("{input}", "")
+    # Приветствие генерируется в фоне и выводится ниже, вместе с другими ответами
+    st.session_state.reply_task = start_llm_task(tutor_llm, full_prompt, call="greeting")
+    st.session_state.study_mode_initialized = True
 
-    try:
-        response_obj = tutor_llm.invoke(full_prompt)
-        welcome_message = response_obj.content if hasattr(response_obj, 'content') else str(response_obj)
-
-        # Парсим быстрые ответы
-        cleaned_message, quick_replies = parse_quick_replies(welcome_message)
-
-        st.session_state.messages.append({
-            "role": "assistant",
-            "content": cleaned_message
-        })
-        st.session_state.quick_replies = quick_replies
-    except Exception as e:
-        print(f"Study Mode init error: {e}")
-        # Фоллбек на простое приветствие
-        st.session_state.messages.append({
-            "role": "assistant",
-            "content": "Привет! Я помогу тебе разобраться с любой темой 📚 Скажи, пожалуйста, в каком ты классе и что сегодня будем изучать?"
-        })
-        st.session_state.quick_replies = []
+# Новые сообщения и состояние прошлого прогона (если он закончился st.rerun) - в хранилище сессий
+persist_session()
 
-    st.session_state.study_mode_initialized = True
-    st.rerun()
+# Автосохранение новых сообщений в Google Sheets (в фоне, только новые с прошлого раза)
+if os.getenv("GOOGLE_SHEETS_AUTO_FLUSH") == "1" and st.session_state.messages:
+    flushed_session, flushed_count = st.session_state.sheets_flushed
+    message_count = message_offset() + len(st.session_state.messages)  # Сообщений в сессии всего
+    if flushed_session != st.session_state.session_id or flushed_count < message_count:
+        topic_title = None
+        if st.session_state.mode == "learn" and st.session_state.current_topic:
+            topic_title = TOPICS.info(st.session_state.current_topic).title
+
+        st.session_state.sheets_export = get_sheets_exporter().submit(
+            messages=st.session_state.messages,
+            topic_title=topic_title,
+            session_id=st.session_state.session_id,
+            session_start=st.session_state.session_start,
+            grade=st.session_state.grade,
+            offset=message_offset()
+        )
+        st.session_state.sheets_flushed = (st.session_state.session_id, message_count)
 
-# История сообщений
-for idx, message in enumerate(st.session_state.messages):
+# Стили чата (формулы, кнопки квиза, блоки истории) - один раз за прогон
+st.markdown(CHAT_CSS, unsafe_allow_html=True)
+
+# История сообщений: завершенные блоки - готовой разметкой (браузер получает их
+# из кеша Streamlit по хешу), последний блок - обычными сообщениями чата
+history_blocks, live_start = split_history(
+    st.session_state.messages, st.session_state.quiz_state, message_offset(), CHAT_HISTORY_BLOCK
+)
+for block in history_blocks:
+    st.markdown(block, unsafe_allow_html=True)
+
+for idx in range(live_start, len(st.session_state.messages)):
+    message = st.session_state.messages[idx]
     with st.chat_message(message["role"]):
         # Рендерим содержимое сообщения, поддерживая крупный LaTeX
         st.markdown(message["content"], unsafe_allow_html=True)
 
     # Проверяем есть ли сохраненные кнопки квиза для этого сообщения
     # idx+1 потому что quiz_state сохраняется по индексу после добавления вопроса пользователя
-    quiz_data = st.session_state.quiz_state.get(idx + 1)
-    if quiz_data:
-        # CSS для подсветки
-        st.markdown("""
-        <style>
-        .quiz-button {
-            padding: 0.5rem 1rem;
-            border-radius: 0.5rem;
-            border: 2px solid #e0e0e0;
-            background-color: #f5f5f5;
-            cursor: default;
-            text-align: center;
-            margin: 0.25rem;
-            font-size: 1rem;
-        }
-        .quiz-button-correct {
-            background-color: #4caf50 !important;
-            color: white !important;
-            border-color: #45a049 !important;
-        }
-        .quiz-button-incorrect {
-            background-color: #f44336 !important;
-            color: white !important;
-            border-color: #da190b !important;
-        }
-        </style>
-        """, unsafe_allow_html=True)
-
-        # Рендерим кнопки с подсветкой через HTML
-        cols = st.columns(len(quiz_data["replies"]))
-        for btn_idx, reply in enumerate(quiz_data["replies"]):
-            with cols[btn_idx]:
-                # Определяем класс кнопки
-                if reply == quiz_data["selected"]:
-                    if quiz_data["correct"]:
-                        button_class = "quiz-button quiz-button-correct"
-                    else:
-                        button_class = "quiz-button quiz-button-incorrect"
-                else:
-                    button_class = "quiz-button"
+    quiz = quiz_key(st.session_state.quiz_state.get(idx + 1))
+    if quiz:
+        # Кнопки с подсветкой через HTML
+        st.markdown(render_quiz_html(quiz), unsafe_allow_html=True)
 
-                st.markdown(f'<div class="{button_class}">{reply}</div>', unsafe_allow_html=True)
+# Ответы, которые еще генерируются или не были выведены (прогон прервался посреди вывода)
+deliver_llm_tasks()
 
 # Быстрые ответы (кнопки) - только для текущего вопроса
 if st.session_state.quick_replies:
@@ -430,142 +800,97 @@ if question:
     with st.chat_message("user"):
         st.markdown(question)
 
-    with st.chat_message("assistant"):
-        with st.spinner("🤔 Думаю..."):
-            # Обработка в зависимости от режима
-            if st.session_state.mode == "study":
-                # Study Mode - свободный тьютор (прямой вызов LLM без агента)
-                tutor_llm = init_tutor(model_choice, yandex_api_key, gemini_api_key)
+    # Обработка в зависимости от режима: вызовы LLM уходят в фон, ответ выводит deliver_llm_tasks
+    if st.session_state.mode == "study":
+        # Study Mode - свободный тьютор (прямой вызов LLM без агента)
+        tutor_llm = init_tutor(model_choice, yandex_api_key, gemini_api_key)
 
-                # Получаем инструкции для выбранного класса
-                grade_instructions = get_grade_instruction(st.session_state.grade)
+        # История чата: свежие реплики дословно, старые - в сводке (в пределах бюджета токенов)
+        chat_history = get_memory().render_history(st.session_state.messages)
 
-                # Формируем полный промпт с историей чата
-                chat_history = "\n".join([
-                    f"{'Ученик' if msg['role'] == 'user' else 'Тьютор'}: {msg['content']}"
-                    for msg in st.session_state.messages[-5:]  # Последние 5 сообщений для контекста
-                ])
+        # Формируем полное сообщение для LLM
+        # Статический префикс уходит отдельным системным сообщением (кешируется провайдером)
+        full_prompt = build_prompt_messages(
+            get_tutor_template(st.session_state.grade),
+            chat_history=chat_history, input=question
+        )
 
-                # Формируем полное сообщение для LLM
-                full_prompt = TUTOR_PROMPT.replace("{grade_instructions}", grade_instructions).replace("{chat_history}", chat_history).replace("{input}", question)
+        st.session_state.reply_task = start_llm_task(tutor_llm, full_prompt, call="tutor")
 
-                try:
-                    response_obj = tutor_llm.invoke(full_prompt)
-                    response = response_obj.content if hasattr(response_obj, 'content') else str(response_obj)
+    elif st.session_state.current_topic is None:
+        response = "Пожалуйста, выбери тему из списка слева! 👈"
+        with st.chat_message("assistant"):
+            st.markdown(response)
+        st.session_state.messages.append({"role": "assistant", "content": response})
+    else:
+        # Learn Mode - урок ведет LessonEngine: в промпт идет только активный блок схемы
+        topic = open_topic(st.session_state.current_topic)
+        if topic is None:
+            st.stop()
+        learn_llm = init_tutor(model_choice, yandex_api_key, gemini_api_key)
+        lesson = get_lesson()
+
+        # Шаг урока до ответа ученика - часть ключа кеша ответов
+        step = lesson.step_fingerprint()
+
+        # Движок проверяет ответ, считает попытки и решает, что делать на этом ходе
+        turn = lesson.handle(question)
+
+        # Урок завершен, когда движок засчитал последний шаг финальной задачи
+        if turn.completed:
+            st.session_state.needs_feedback = True
+
+        # Фидбек запускается сразу, как только движок засчитал финальный ответ, - параллельно
+        # с ответом на ход (от его текста фидбек не зависит). Если ученик уйдет из урока
+        # раньше, чем фидбек выведен, cancel_llm_tasks снимет запрос с очереди
+        if st.session_state.needs_feedback and st.session_state.feedback_task is None:
+            # Компактная история для фидбека: прогресс урока, сводка и последние реплики в пределах бюджета
+            full_chat_history = (
+                f"[Прогресс урока: {lesson.describe()}]\n\n"
+                + get_memory().render_feedback_context(st.session_state.messages)
+            )
+
+            # Формируем промпт для фидбека
+            feedback_prompt = build_prompt_messages(
+                get_compiled_prompt('feedback_prompt'),
+                **format_feedback_context(topic, full_chat_history)
+            )
+            st.session_state.feedback_task = start_llm_task(learn_llm, feedback_prompt, call="feedback")
+
+        if not turn.needs_llm:
+            # Известная ошибка из mistake_explanation - отвечаем сразу, без вызова LLM
+            response = turn.reply
+            with st.chat_message("assistant"):
+                st.markdown(response)
+            st.session_state.messages.append({"role": "assistant", "content": response})
+        else:
+            lesson_template = get_lesson_template(st.session_state.grade)
+
+            # Ключ кеша ответов: тема, класс, шаг урока и нормализованный ответ ученика
+            cache_key = None
+            if get_response_cache() is not None:
+                cache_key = make_cache_key(
+                    st.session_state.current_topic,
+                    st.session_state.grade,
+                    step,
+                    question,
+                    version=f"{model_choice}/{lesson_template.version}/"
+                            f"{topic.fingerprint}"
+                )
 
-                    # Парсим быстрые ответы
-                    response, quick_replies = parse_quick_replies(response)
-                    st.session_state.quick_replies = quick_replies
-                except Exception as e:
-                    print(f"Tutor error: {e}")
-                    response = "Извини, произошла ошибка. Попробуй переформулировать вопрос."
-                    st.session_state.quick_replies = []
+            # История чата: свежие реплики дословно, старые - в сводке
+            chat_history = get_memory().render_history(st.session_state.messages)
 
-                st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
-
-                # Проверяем был ли это ответ на квиз
-                if st.session_state.pending_quiz_answer:
-                    quiz_info = st.session_state.pending_quiz_answer
-                    # Определяем правильность ответа
-                    is_correct = check_answer_correctness(response)
-
-                    # Сохраняем результат в quiz_state
-                    st.session_state.quiz_state[quiz_info["message_idx"]] = {
-                        "selected": quiz_info["selected"],
-                        "correct": is_correct if is_correct is not None else False,
-                        "replies": quiz_info["replies"]
-                    }
-
-                    # Очищаем pending_quiz_answer
-                    st.session_state.pending_quiz_answer = None
-
-                # Если есть быстрые ответы, делаем rerun чтобы кнопки появились
-                if st.session_state.quick_replies:
-                    st.rerun()
-
-            elif st.session_state.current_topic is None:
-                response = "Пожалуйста, выбери тему из списка слева! 👈"
-                st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
-            else:
-                # Learn Mode - используем LEARN_MODE_PROMPT со схемой темы
-                topic = TOPICS[st.session_state.current_topic]
-                learn_llm = init_tutor(model_choice, yandex_api_key, gemini_api_key)
-
-                # Получаем инструкции для выбранного класса
-                grade_instructions = get_grade_instruction(st.session_state.grade)
-
-                # Форматируем схему темы
-                schema = format_schema(topic)
-
-                # Формируем историю чата
-                chat_history = "\n".join([
-                    f"{'Ученик' if msg['role'] == 'user' else 'Тьютор'}: {msg['content']}"
-                    for msg in st.session_state.messages[-5:]  # Последние 5 сообщений
-                ])
-
-                # Формируем полный промпт
-                full_prompt = LEARN_MODE_PROMPT.replace("{grade_instructions}", grade_instructions).replace("{schema}", schema).replace("{chat_history}", chat_history).replace("{input}", question)
-
-                try:
-                    response_obj = learn_llm.invoke(full_prompt)
-                    response = response_obj.content if hasattr(response_obj, 'content') else str(response_obj)
-                except Exception as e:
-                    print(f"Learn mode error: {e}")
-                    response = "Извини, произошла ошибка. Попробуй переформулировать вопрос."
+            # Промпт хода: инструкции класса (в шаблоне), прогресс, активный блок и задание хода
+            # Статический префикс уходит отдельным системным сообщением (кешируется провайдером)
+            full_prompt = build_prompt_messages(
+                lesson_template,
+                lesson=turn.context, chat_history=chat_history, input=question
+            )
 
-                # Проверяем маркер завершения урока
-                # LLM добавляет [УРОК_ЗАВЕРШЕН] только после показа конспекта
-                if "[УРОК_ЗАВЕРШЕН]" in response:
-                    st.session_state.needs_feedback = True
-                    # Убираем маркер из отображаемого текста (он служебный)
-                    response = response.replace("[УРОК_ЗАВЕРШЕН]", "").strip()
+            st.session_state.reply_task = start_llm_task(learn_llm, full_prompt, call="learn", cache_key=cache_key)
 
-                st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
-
-                # Если нужен фидбек, показываем его автоматически
-                if st.session_state.needs_feedback:
-                    # Формируем историю для фидбека (весь разговор)
-                    full_chat_history = "\n".join([
-                        f"{'Ученик' if msg['role'] == 'user' else 'Тьютор'}: {msg['content']}"
-                        for msg in st.session_state.messages
-                    ])
-
-                    # Формируем промпт для фидбека
-                    feedback_prompt = FEEDBACK_PROMPT.replace(
-                        "{topic_title}", topic.get('title', '')
-                    ).replace(
-                        "{topic_description}", topic.get('description', '')
-                    ).replace(
-                        "{chat_history}", full_chat_history
-                    ).replace(
-                        "{final_summary}", topic.get('summary', '')
-                    )
-
-                    try:
-                        feedback_obj = learn_llm.invoke(feedback_prompt)
-                        feedback = feedback_obj.content if hasattr(feedback_obj, 'content') else str(feedback_obj)
-
-                        # Показываем фидбек
-                        st.markdown("\n\n---\n\n")
-                        st.markdown(feedback)
-                        st.session_state.messages.append({"role": "assistant", "content": f"\n\n---\n\n{feedback}"})
-
-                        # Сбрасываем флаг
-                        st.session_state.needs_feedback = False
-                    except Exception as e:
-                        print(f"Feedback error: {e}")
-
-# Вставляем CSS, чтобы увеличить размер формул
-st.markdown(
-    """
-    <style>
-    .stMarkdown .katex {
-        font-size: 1.5em !important;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
\ No newline at end of file
+    deliver_llm_tasks()
+
+# Ответ этого хода - в хранилище сессий
+persist_session()
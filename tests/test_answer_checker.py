@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from utils.answer_checker import check_answer, unit_from_question
+
+
+@pytest.mark.parametrize("answer, status", [
+    ("7000", "correct"),
+    ("7000 кг", "correct"),
+    ("7 т", "correct"),
+    ("7000000 г", "correct"),
+    ("7000 г", "incorrect"),
+    ("7000 т", "incorrect"),
+    ("7000 с", "incorrect"),
+    ("7000 мм", "incorrect"),
+    ("700", "incorrect"),
+])
+def test_mass_answer_is_converted_to_expected_unit(answer, status):
+    assert check_answer(answer, "7000", unit="кг").status == status
+
+
+@pytest.mark.parametrize("answer, status", [
+    ("250", "correct"),
+    ("2 м 50 см", "correct"),
+    ("2500 мм", "correct"),
+    ("250 мм", "incorrect"),
+    ("250 г", "incorrect"),
+])
+def test_length_answer_is_converted_to_expected_unit(answer, status):
+    assert check_answer(answer, "250", unit="сантиметров").status == status
+
+
+@pytest.mark.parametrize("answer, status", [
+    ("125", "correct"),
+    ("2 ч 5 мин", "correct"),
+    ("7500 с", "correct"),
+    ("125 с", "incorrect"),
+    ("125 кг", "incorrect"),
+])
+def test_time_answer_is_converted_to_expected_unit(answer, status):
+    assert check_answer(answer, "125", unit="минут").status == status
+
+
+def test_expected_answer_with_written_unit():
+    assert check_answer("3 кг", "3000 г").status == "correct"
+    assert check_answer("3000", "3000 г").status == "correct"
+    assert check_answer("3 г", "3000 г").status == "incorrect"
+
+
+def test_answer_with_units_is_unknown_without_expected_unit():
+    assert check_answer("7000 г", "7000").status == "unknown"
+
+
+def test_known_mistake_is_matched_in_expected_unit():
+    verdict = check_answer("100 кг", "1000", {"100": "Не хватает нуля"}, unit="килограммов")
+    assert verdict.status == "known_mistake"
+    assert verdict.mistake_key == "100"
+
+
+@pytest.mark.parametrize("question, unit", [
+    ("Сколько килограммов в $7$ тоннах?", "килограммов"),
+    ("Переведи $3$ тонны в килограммы", "килограммы"),
+    ("Сложим килограммы из $2$ тонн и оставшиеся $112$ килограммов.", "килограммы"),
+    ("Реши уравнение $2x + 3 = 7$", None),
+])
+def test_unit_from_question(question, unit):
+    assert unit_from_question(question) == unit
+
+
+@pytest.mark.parametrize("message", ["а?", "в", "с", "А почему?", "x"])
+def test_single_cyrillic_words_are_not_parsed_as_expressions(message):
+    assert check_answer(message, "2x + 3").status == "unknown"
+
+
+@pytest.mark.parametrize("answer, status", [
+    ("2х+3", "correct"),
+    ("3 + 2*x", "correct"),
+    ("2x + 4", "incorrect"),
+])
+def test_symbolic_answers(answer, status):
+    assert check_answer(answer, "2x + 3").status == status
+
+
+@pytest.mark.parametrize("answer, status", [
+    ("1/2", "correct"),
+    ("0,5", "correct"),
+    ("ответ: 0.5", "correct"),
+    ("1/3", "incorrect"),
+])
+def test_numeric_answers(answer, status):
+    assert check_answer(answer, "0.5").status == status
+
+
+@pytest.mark.parametrize("answer", [
+    "10**10**10",
+    "2**99999999999",
+    "2^999",
+    "9**(99*99*99*99)",
+    "2^(9*99*99)",
+    "x^(9*99*99*99)",
+    "(2**3)**2",
+])
+def test_costly_powers_are_rejected_quickly(answer):
+    started = time.perf_counter()
+    verdict = check_answer(answer, "1000")
+    assert time.perf_counter() - started < 1
+    assert verdict.status != "correct"
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("2**10", "1024"),
+    ("2^10", "1024"),
+    ("2^(3+1)", "16"),
+    ("2**-1", "0.5"),
+    ("x^2 + 1", "x**2 + 1"),
+])
+def test_short_powers_are_still_checked(answer, expected):
+    assert check_answer(answer, expected).status == "correct"
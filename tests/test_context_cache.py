@@ -0,0 +1,33 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from prompts import get_compiled_prompt
+from prompts.loader import CompiledPrompt
+from utils.context_cache import build_prompt_messages
+
+
+def test_static_prefix_goes_to_system_message():
+    template = CompiledPrompt("Ты учитель. {grade_instructions}\nУрок: {lesson}\nУченик: {input}").partial(
+        grade_instructions="Класс 5-6."
+    )
+
+    messages = build_prompt_messages(template, lesson="блок 1", input="7000")
+
+    assert [type(message) for message in messages] == [SystemMessage, HumanMessage]
+    assert messages[0].content == "Ты учитель. Класс 5-6.\nУрок: "
+    assert messages[1].content == "блок 1\nУченик: 7000"
+
+
+def test_prefix_is_identical_between_turns():
+    template = get_compiled_prompt('lesson_step_prompt').partial(grade_instructions="Класс 5-6.")
+
+    first = build_prompt_messages(template, lesson="блок 1", chat_history="", input="а")
+    second = build_prompt_messages(template, lesson="блок 2", chat_history="а", input="б")
+
+    assert first[0].content == second[0].content
+    assert "Класс 5-6." in first[0].content
+    assert "блок 2" in second[1].content
+
+
+def test_template_starting_with_slot_has_no_system_message():
+    messages = build_prompt_messages(CompiledPrompt("{input} - ответ"), input="7000")
+    assert messages == [HumanMessage(content="7000 - ответ")]
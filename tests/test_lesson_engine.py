@@ -0,0 +1,79 @@
+import pytest
+
+from utils.lesson_engine import PHASE_BOSS, PHASE_DONE, PHASE_EXPLANATION, LessonEngine
+from utils.topic_models import Topic
+
+TOPIC = Topic.from_dict("test_topic", {
+    "title": "Тонны и килограммы",
+    "explanation": [
+        {
+            "info": "В одной тонне 1000 килограммов.",
+            "action": "Сколько килограммов в $2$ тоннах?",
+            "answer": "2000",
+            "mistake_explanation": {"200": "В тонне не сто, а тысяча килограммов."},
+        },
+    ],
+    "boss": {
+        "problem": "Грузовик везет $3$ тонны.",
+        "steps": [{"action": "Сколько это килограммов?", "answer": "3000"}],
+    },
+    "summary": "1 т = 1000 кг",
+})
+
+
+@pytest.fixture
+def engine():
+    engine = LessonEngine("test_topic", TOPIC, max_attempts=3)
+    assert engine.handle("Готов").task == "present"
+    return engine
+
+
+def test_correct_answers_walk_through_lesson(engine):
+    assert engine.handle("2000").task == "correct"
+    assert engine.phase == PHASE_BOSS
+
+    turn = engine.handle("3 т")
+    assert turn.completed
+    assert engine.phase == PHASE_DONE
+
+
+def test_questions_do_not_count_as_attempts(engine):
+    for _ in range(5):
+        turn = engine.handle("а почему?")
+        assert turn.task == "hint"
+        assert turn.verdict.status == "unknown"
+
+    assert engine.attempts.get(0, 0) == 0
+    assert engine.phase == PHASE_EXPLANATION
+
+
+def test_known_mistake_replies_without_llm_then_reveals(engine):
+    turn = engine.handle("200")
+    assert turn.task == "mistake"
+    assert not turn.needs_llm
+
+    assert engine.handle("200").task == "mistake"
+
+    turn = engine.handle("200")
+    assert turn.task == "correct"  # Разбор решения и переход дальше
+    assert turn.needs_llm
+    assert engine.phase == PHASE_BOSS
+
+
+def test_wrong_answers_reveal_after_max_attempts(engine):
+    assert engine.handle("1500").task == "hint"
+    assert engine.handle("что?").verdict.status == "unknown"
+    assert engine.handle("2500").task == "hint"
+    assert engine.attempts[0] == 2
+
+    engine.handle("1000")
+    assert engine.position == 1
+    assert engine.phase == PHASE_BOSS
+
+
+def test_snapshot_restores_progress(engine):
+    engine.handle("1500")
+    restored = LessonEngine("test_topic", TOPIC)
+    restored.restore(engine.snapshot())
+
+    assert (restored.phase, restored.position, restored.attempts) == (engine.phase, engine.position, engine.attempts)
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from utils.llm_gate import (
+    CircuitBreaker,
+    CircuitOpenError,
+    OutboundGate,
+    QueueTimeoutError,
+    RequestCancelledError,
+    TokenBucket,
+)
+
+
+def _open_breaker(gate: OutboundGate):
+    for _ in range(gate.breaker.failure_threshold):
+        gate.record_failure()
+    assert gate.breaker.state == CircuitBreaker.OPEN
+
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=10, burst=2)
+    bucket.take()
+    bucket.take()
+    assert 0 < bucket.wait_time() <= 0.1
+
+
+def test_breaker_opens_after_threshold_and_closes_after_trial():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()       # Пробный запрос
+    assert not breaker.allow()   # Второй ждет итога пробы
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_total == 2
+
+
+def test_open_breaker_rejects_new_requests():
+    gate = OutboundGate("test", failure_threshold=1)
+    _open_breaker(gate)
+    with pytest.raises(CircuitOpenError):
+        gate.acquire(timeout=1)
+    assert gate.stats()['rejected'] == 1
+
+
+def test_queued_request_is_rejected_when_breaker_opens():
+    gate = OutboundGate("test", max_concurrent=1, failure_threshold=1)
+    gate.acquire(timeout=1)
+    errors = []
+
+    def waiter():
+        try:
+            gate.acquire(timeout=5)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.1)
+    gate.release(False)  # Ошибка размыкает предохранитель и освобождает слот
+    thread.join(2)
+
+    assert [type(e) for e in errors] == [CircuitOpenError]
+    assert gate.stats()['in_flight'] == 0
+    assert gate.stats()['queued'] == 0
+
+
+def test_cancelled_trial_frees_half_open_slot():
+    gate = OutboundGate("test", failure_threshold=1, reset_timeout=0.05)
+    _open_breaker(gate)
+    time.sleep(0.06)
+
+    gate.acquire(timeout=1)          # Пробный запрос
+    with pytest.raises(CircuitOpenError):
+        gate.acquire(timeout=1)      # Проба уже идет
+    gate.release(None)               # Пробу отменили, не отправив
+
+    gate.acquire(timeout=1)          # Пробным становится следующий
+    gate.release(True)
+    assert gate.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_queue_timeout_and_cancel_leave_queue():
+    gate = OutboundGate("test", max_concurrent=1)
+    gate.acquire(timeout=1)
+
+    with pytest.raises(QueueTimeoutError):
+        gate.acquire(timeout=0.05)
+
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(RequestCancelledError):
+        gate.acquire(timeout=1, cancel=cancel)
+
+    stats = gate.stats()
+    assert (stats['queued'], stats['queue_timeouts'], stats['cancelled']) == (0, 1, 1)
+
+
+def test_requests_are_admitted_in_arrival_order():
+    gate = OutboundGate("test", max_concurrent=1)
+    gate.acquire(timeout=1)
+    order = []
+
+    def waiter(number):
+        gate.acquire(timeout=5)
+        order.append(number)
+        gate.release(True)
+
+    threads = []
+    for number in range(3):
+        threads.append(threading.Thread(target=waiter, args=(number,)))
+        threads[-1].start()
+        time.sleep(0.05)
+    gate.release(True)
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2]
@@ -0,0 +1,82 @@
+import json
+import threading
+
+import pytest
+
+from utils.llm_metrics import InstrumentedLLM, LLMCallRecord, MetricsRegistry
+
+
+class ChunksLLM:
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def stream(self, prompt, **kwargs):
+        yield from self.chunks
+        if self.error is not None:
+            raise self.error
+
+
+def _single(registry: MetricsRegistry) -> dict:
+    [row] = registry.snapshot()
+    return row
+
+
+def test_closed_stream_is_counted_as_cancelled():
+    registry = MetricsRegistry()
+    llm = InstrumentedLLM(ChunksLLM(["а", "б", "в"]), model="fake", registry=registry)
+
+    stream = llm.stream("?", metrics_tags={"call": "learn"})
+    next(stream)
+    stream.close()
+
+    row = _single(registry)
+    assert (row['calls'], row['errors'], row['cancelled']) == (1, 0, 1)
+
+
+def test_failed_stream_is_counted_as_error():
+    registry = MetricsRegistry()
+    llm = InstrumentedLLM(ChunksLLM(["а"], error=RuntimeError("503")), model="fake", registry=registry)
+
+    with pytest.raises(RuntimeError):
+        list(llm.stream("?", metrics_tags={"call": "learn"}))
+
+    row = _single(registry)
+    assert (row['errors'], row['cancelled']) == (1, 0)
+    assert registry.records[-1].error == "RuntimeError"
+
+
+def test_prometheus_families_are_contiguous():
+    registry = MetricsRegistry()
+    registry.record(LLMCallRecord(call="learn", latency=1.5, ttft=0.3))
+    registry.record(LLMCallRecord(call="tutor", latency=0.2))
+
+    family = None
+    seen = set()
+    for line in registry.render_prometheus().splitlines():
+        if line.startswith("# TYPE "):
+            family = line.split()[2]
+            assert family not in seen
+            seen.add(family)
+        else:
+            assert line.split("{")[0].split(" ")[0].startswith(family)
+    assert {"llm_calls_total", "llm_cancelled_total", "llm_latency_seconds"} <= seen
+
+
+def test_jsonl_gets_every_record(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    registry = MetricsRegistry(jsonl_path=str(path))
+
+    def worker(number):
+        for i in range(50):
+            registry.record(LLMCallRecord(call=f"call-{number}", latency=i / 100))
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    rows = [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+    assert len(rows) == 400
+    assert sum(row['calls'] for row in registry.snapshot()) == 400
@@ -0,0 +1,166 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from utils.llm_gate import OutboundGate, RequestCancelledError
+from utils.llm_router import AllProvidersFailedError, LLMProvider, LLMRouter, ProviderTimeoutError
+
+_names = itertools.count()
+
+
+class SlowStreamLLM:
+    """Поток из чанков с паузой; запоминает, сколько отдал и закрыт ли"""
+
+    def __init__(self, chunks: int = 20, delay: float = 0.05, first_delay: float = None, text: str = "",
+                 error: Exception = None):
+        self.chunks = chunks
+        self.delay = delay
+        self.first_delay = delay if first_delay is None else first_delay
+        self.text = text
+        self.error = error
+        self.calls = 0
+        self.sent = 0
+        self.closed = threading.Event()
+
+    def stream(self, prompt, **kwargs):
+        self.calls += 1
+        try:
+            if self.error is not None:
+                raise self.error
+            for i in range(self.chunks):
+                time.sleep(self.first_delay if i == 0 else self.delay)
+                self.sent += 1
+                yield f"{self.text}{i}"
+        finally:
+            self.closed.set()
+
+
+def _provider(llm, timeout: float = 5, gate=None) -> LLMProvider:
+    # Здоровье провайдеров общее на процесс - у каждого теста свои имена
+    return LLMProvider(f"router-test-{next(_names)}", llm, timeout=timeout, gate=gate)
+
+
+def _wait_until(condition, timeout: float = 2.0) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_failover_to_next_provider():
+    broken = SlowStreamLLM(error=RuntimeError("503"))
+    backup = SlowStreamLLM(chunks=2, delay=0.01, text="b")
+    first, second = _provider(broken), _provider(backup)
+    router = LLMRouter([first, second], retries=0)
+
+    assert list(router.stream("?")) == ["b0", "b1"]
+    assert (broken.calls, backup.calls) == (1, 1)
+    assert first.health.errors == 1
+
+
+def test_silent_provider_is_replaced_after_its_timeout():
+    silent = SlowStreamLLM(chunks=1, first_delay=2.0, text="a")
+    backup = SlowStreamLLM(chunks=1, delay=0.01, text="b")
+    first = _provider(silent, timeout=0.2)
+    router = LLMRouter([first, _provider(backup)], retries=0)
+
+    started = time.perf_counter()
+    assert list(router.stream("?")) == ["b0"]
+    assert time.perf_counter() - started < 1.0
+    assert first.health.timeouts == 1
+    assert first.health.last_error.startswith(ProviderTimeoutError.__name__)
+
+
+def test_hedge_answers_before_slow_primary():
+    slow = SlowStreamLLM(chunks=1, first_delay=1.0, text="a")
+    fast = SlowStreamLLM(chunks=1, delay=0.01, text="b")
+    primary, backup = _provider(slow), _provider(fast)
+    router = LLMRouter([primary, backup], retries=0, hedge=True, hedge_delay=0.1)
+
+    started = time.perf_counter()
+    assert list(router.stream("?")) == ["b0"]
+    assert time.perf_counter() - started < 0.8
+    assert (backup.health.hedges, backup.health.hedge_wins) == (1, 1)
+    assert slow.closed.wait(2)  # Проигравший поток закрыт
+
+
+def test_all_providers_failed_after_retries():
+    broken = [SlowStreamLLM(error=RuntimeError("503")), SlowStreamLLM(error=ConnectionError("reset"))]
+    router = LLMRouter([_provider(llm) for llm in broken], retries=1, backoff=0.01, max_backoff=0.02)
+
+    with pytest.raises(AllProvidersFailedError) as error:
+        list(router.stream("?"))
+
+    assert [llm.calls for llm in broken] == [2, 2]
+    assert [type(e) for _, e in error.value.errors] == [RuntimeError, ConnectionError] * 2
+
+
+def test_cancelled_stream_is_closed_on_next_chunk():
+    llm = SlowStreamLLM()
+    cancel = threading.Event()
+    router = LLMRouter([_provider(llm)], retries=0)
+
+    chunks = router.stream("?", cancel=cancel)
+    assert next(chunks) == "0"
+    cancel.set()
+    chunks.close()
+
+    assert llm.closed.wait(1)
+    assert llm.sent < llm.chunks
+
+
+def test_request_cancelled_in_queue_is_not_sent():
+    llm = SlowStreamLLM()
+    gate = OutboundGate("router-test-queue", max_concurrent=1)
+    router = LLMRouter([_provider(llm, gate=gate)], retries=0)
+    gate.acquire(timeout=1)
+
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    with pytest.raises(RequestCancelledError):
+        list(router.stream("?", cancel=cancel))
+
+    assert llm.calls == 0
+    assert gate.stats()['queued'] == 0
+
+
+def test_abandoned_stream_returns_gate_slot():
+    gate = OutboundGate("router-test-abandoned", max_concurrent=2)
+    router = LLMRouter([_provider(SlowStreamLLM(), gate=gate)], retries=0)
+
+    chunks = router.stream("?")
+    next(chunks)
+    assert gate.stats()['in_flight'] == 1
+    chunks.close()  # Ученик ушел со страницы
+
+    assert _wait_until(lambda: gate.stats()['in_flight'] == 0)
+
+
+def test_cancel_before_first_token_returns_gate_slot():
+    gate = OutboundGate("router-test-cancel", max_concurrent=2)
+    router = LLMRouter([_provider(SlowStreamLLM(first_delay=0.5), gate=gate)], retries=0)
+
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    with pytest.raises(RequestCancelledError):
+        list(router.stream("?", cancel=cancel))
+
+    assert _wait_until(lambda: gate.stats()['in_flight'] == 0)
+    assert gate.breaker.failures == 0  # Отмена - не ошибка провайдера
+
+
+def test_hedge_loser_returns_gate_slot():
+    slow_gate = OutboundGate("router-test-hedge-slow")
+    fast_gate = OutboundGate("router-test-hedge-fast")
+    router = LLMRouter(
+        [_provider(SlowStreamLLM(chunks=2, first_delay=0.5), gate=slow_gate),
+         _provider(SlowStreamLLM(chunks=1, delay=0.01), gate=fast_gate)],
+        retries=0, hedge=True, hedge_delay=0.1,
+    )
+
+    assert list(router.stream("?")) == ["0"]
+    assert _wait_until(lambda: slow_gate.stats()['in_flight'] == 0 and fast_gate.stats()['in_flight'] == 0)
@@ -0,0 +1,91 @@
+import pytest
+
+from utils import response_cache
+from utils.response_cache import CachedLLM, ResponseCache, make_cache_key
+
+
+class Clock:
+    """Подмена time в модуле кеша: time() двигается вручную, perf_counter - настоящий"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+        self.perf_counter = response_cache.time.perf_counter
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+
+class CountingLLM:
+    def __init__(self, text: str = "Верно! 7000 кг"):
+        self.text = text
+        self.calls = 0
+
+    def stream(self, prompt, **kwargs):
+        self.calls += 1
+        for i in range(0, len(self.text), 3):
+            yield self.text[i:i + 3]
+
+
+def test_memory_entry_expires_after_ttl(clock):
+    cache = ResponseCache(ttl=60)
+    cache.put("k", "ответ", latency=1.5)
+
+    clock.now += 59
+    assert cache.get("k") == "ответ"
+    clock.now += 2
+    assert cache.get("k") is None
+
+    stats = cache.stats()
+    assert (stats['memory_hits'], stats['misses'], stats['saved_latency']) == (1, 1, 1.5)
+
+
+def test_disk_entry_survives_restart_until_ttl(clock, tmp_path):
+    path = str(tmp_path / "response_cache.sqlite3")
+    ResponseCache(ttl=60, disk_path=path).put("k", "ответ", latency=2.0)
+
+    clock.now += 30
+    restarted = ResponseCache(ttl=60, disk_path=path)
+    assert restarted.get("k") == "ответ"
+    assert restarted.stats()['disk_hits'] == 1
+
+    clock.now += 31
+    assert ResponseCache(ttl=60, disk_path=path).get("k") is None
+    assert restarted.get("k") is None  # Поднятая в память запись истекает в тот же момент
+
+
+def test_memory_is_lru_bounded(clock):
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "1", 0)
+    cache.put("b", "2", 0)
+    cache.get("a")
+    cache.put("c", "3", 0)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("1", "3")
+
+
+def test_cache_key_normalizes_student_input():
+    assert make_cache_key("t", "5-6", "step", " 0,5 ") == make_cache_key("t", "5-6", "step", "0.5")
+    assert make_cache_key("t", "5-6", "step", "0.5") != make_cache_key("t", "5-6", "step", "0.5", version="v2")
+
+
+def test_cached_llm_stores_only_finished_streams(clock):
+    llm = CountingLLM()
+    cached = CachedLLM(llm, ResponseCache())
+
+    stream = cached.stream("?", cache_key="k")
+    next(stream)
+    stream.close()  # Прерванный поток не кешируется
+    assert "".join(cached.stream("?", cache_key="k")) == llm.text
+    assert llm.calls == 2
+
+    [chunk] = cached.stream("?", cache_key="k")
+    assert chunk.content == llm.text
+    assert llm.calls == 2
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+from utils.session_store import (
+    MemorySessionStore,
+    SQLiteSessionStore,
+    quiz_state_from_log,
+    quiz_state_to_log,
+)
+
+TOKEN = "k3J9x-Qm2Lw8vT1nRb7YsA"
+
+
+def _messages(count: int, start: int = 0) -> list:
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"сообщение {i}"}
+        for i in range(start, start + count)
+    ]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"))
+
+
+def test_save_and_load_round_trip(store):
+    state = {"session_id": "ab12cd34", "mode": "learn", "quiz_state": {"3": {"selected": "да"}}}
+    store.save_state(TOKEN, state)
+    store.append_messages(TOKEN, 0, _messages(4))
+
+    stored = store.load(TOKEN)
+    assert stored.state == state
+    assert stored.messages == _messages(4)
+    assert (stored.offset, stored.total) == (0, 4)
+
+
+def test_state_is_replaced_and_messages_kept(store):
+    store.append_messages(TOKEN, 0, _messages(2))
+    store.save_state(TOKEN, {"mode": "learn", "grade": "5-6"})
+    store.save_state(TOKEN, {"mode": "study"})
+
+    stored = store.load(TOKEN)
+    assert stored.state == {"mode": "study"}
+    assert stored.total == 2
+
+
+def test_appending_the_same_messages_twice_does_not_duplicate(store):
+    store.append_messages(TOKEN, 0, _messages(3))
+    store.append_messages(TOKEN, 0, _messages(3))
+    # Повтор с перекрытием: первые два номера уже записаны, дописывается только хвост
+    store.append_messages(TOKEN, 1, _messages(4, start=1))
+
+    stored = store.load(TOKEN)
+    assert stored.messages == _messages(5)
+    assert stored.total == 5
+
+
+def test_rewritten_message_number_keeps_first_version(store):
+    store.append_messages(TOKEN, 0, _messages(2))
+    store.append_messages(TOKEN, 1, [{"role": "assistant", "content": "другой текст"}])
+    assert store.load(TOKEN).messages[1]["content"] == "сообщение 1"
+
+
+@pytest.mark.parametrize("total, window, offset", [
+    (10, 10, 0),   # Журнал ровно в окно
+    (10, 11, 0),   # Журнал меньше окна
+    (11, 10, 1),   # На одно сообщение больше окна
+    (10, 1, 9),    # Окно из одного сообщения
+])
+def test_windowed_load_at_boundaries(store, total, window, offset):
+    store.append_messages(TOKEN, 0, _messages(total))
+
+    stored = store.load(TOKEN, window=window)
+    assert (stored.offset, stored.total) == (offset, total)
+    assert stored.messages == _messages(total - offset, start=offset)
+
+
+def test_appending_after_windowed_load_continues_numbering(store):
+    store.append_messages(TOKEN, 0, _messages(6))
+    stored = store.load(TOKEN, window=2)
+
+    # Приложение дописывает новые сообщения с номера offset + len(окна)
+    store.append_messages(TOKEN, stored.offset + len(stored.messages), _messages(2, start=6))
+    assert store.load(TOKEN, window=100).messages == _messages(8)
+
+
+def test_unknown_token_is_not_found(store):
+    store.append_messages(TOKEN, 0, _messages(2))
+    assert store.load("no-such-token") is None
+    assert store.load(TOKEN[:8]) is None
+
+
+def test_sqlite_store_survives_reopen(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    SQLiteSessionStore(path).append_messages(TOKEN, 0, _messages(3))
+
+    stored = SQLiteSessionStore(path).load(TOKEN)
+    assert stored.messages == _messages(3)
+
+
+def test_quiz_state_is_reindexed_for_the_restored_window():
+    # Квизы под сообщениями 2 и 8 журнала; поднято окно с сообщения 5
+    log_keys = quiz_state_to_log({2: {"selected": "a"}, 8: {"selected": "b"}}, offset=0)
+    restored = quiz_state_from_log(json.loads(json.dumps(log_keys)), offset=5)
+    assert restored == {3: {"selected": "b"}}
+
+    # Обратно в журнал - на прежний номер
+    assert quiz_state_to_log(restored, offset=5) == {8: {"selected": "b"}}
+
+
+def test_quiz_state_at_window_edge():
+    assert quiz_state_from_log({"5": {}, "6": {}}, offset=5) == {1: {}}
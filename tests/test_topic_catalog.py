@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from data.topic_catalog import TopicCatalog
+from utils.topic_models import TopicSchemaError
+
+
+def _write(directory, name: str, data):
+    path = directory / name
+    path.write_text(data if isinstance(data, str) else json.dumps(data, ensure_ascii=False), encoding='utf-8')
+    return path
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    _write(tmp_path, "good.json", {"title": "Массы", "grades": ["5-6"], "summary": "1 т = 1000 кг"})
+    _write(tmp_path, "typo.json", {"title": "Длины", "sumary": "опечатка в поле"})
+    _write(tmp_path, "broken.json", '{"title": ')
+    return TopicCatalog(tmp_path)
+
+
+def test_index_reads_only_metadata(catalog):
+    assert [(info.topic_id, info.title) for info in catalog.index()] == [("good", "Массы"), ("typo", "Длины")]
+    assert [info.topic_id for info in catalog.index("7-8")] == ["typo"]
+
+
+def test_schema_is_validated_when_topic_is_opened(catalog):
+    assert catalog["good"].summary == "1 т = 1000 кг"
+    with pytest.raises(TopicSchemaError, match="sumary"):
+        catalog["typo"]
+    with pytest.raises(KeyError):
+        catalog["broken"]
+
+
+def test_changed_file_is_reloaded(catalog, tmp_path):
+    assert catalog["good"].title == "Массы"
+    path = _write(tmp_path, "good.json", {"title": "Массы и тонны"})
+    path.touch()
+
+    assert catalog["good"].title == "Массы и тонны"
+    assert catalog.info("good").title == "Массы и тонны"
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+
+from utils.transcript_log import TranscriptLog
+
+NOW = datetime(2026, 9, 1, 10, 0, 0)
+
+
+def _messages(count: int, start: int = 0) -> list:
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"сообщение {i}"}
+        for i in range(start, start + count)
+    ]
+
+
+@pytest.fixture
+def log(tmp_path):
+    return TranscriptLog(str(tmp_path / "transcripts.sqlite3"))
+
+
+def _session_messages(log: TranscriptLog, session_id: str) -> list:
+    return [row['Сообщение'] for row in log.session_rows(session_id)]
+
+
+def test_append_adds_only_new_messages(log):
+    assert log.append(_messages(3), "Тема", "s1", now=NOW)[0] == 3
+    assert log.append(_messages(3), "Тема", "s1", now=NOW)[0] == 0
+    assert log.append(_messages(5), "Тема", "s1", now=NOW)[0] == 2
+    assert _session_messages(log, "s1") == [f"сообщение {i}" for i in range(5)]
+
+
+def test_append_with_offset_keeps_session_numbering(log):
+    log.append(_messages(10), "Тема", "s1", now=NOW)
+
+    # Восстановленная сессия: в session_state только окно из последних 4 сообщений и 2 новых
+    added, _ = log.append(_messages(6, start=6), "Тема", "s1", now=NOW, offset=6)
+
+    assert added == 2
+    assert _session_messages(log, "s1") == [f"сообщение {i}" for i in range(12)]
+
+
+def test_append_with_offset_on_empty_log(log):
+    log.append(_messages(3, start=5), "Тема", "s1", now=NOW, offset=5)
+    log.append(_messages(4, start=5), "Тема", "s1", now=NOW, offset=5)
+    assert _session_messages(log, "s1") == [f"сообщение {i}" for i in range(5, 9)]
+
+
+def test_cursor_moves_only_forward(log):
+    _, last_seq = log.append(_messages(4), "Тема", "s1", now=NOW)
+    assert log.get_cursor("sheets") == 0
+    assert log.count_after(0) == 4
+
+    log.set_cursor("sheets", last_seq)
+    log.set_cursor("sheets", 1)
+    assert log.get_cursor("sheets") == last_seq
+    assert log.count_after(log.get_cursor("sheets")) == 0
+    assert log.read_after(last_seq) == []
+
+
+def test_filters_by_date_topic_and_grade(log):
+    log.append(_messages(2), "Массы", "s1", now=datetime(2026, 9, 1), grade="5-6")
+    log.append(_messages(2), "Длины", "s2", now=datetime(2026, 9, 15), grade="5-6")
+    log.append(_messages(2), "Массы", "s3", now=datetime(2026, 10, 1), grade="7-8")
+
+    assert list(log.iter_sessions()) == ["s1", "s2", "s3"]
+    assert list(log.iter_sessions(since="2026-09-10", until="2026-09-30")) == ["s2"]
+    assert list(log.iter_sessions(topics=["Массы"])) == ["s1", "s3"]
+    assert list(log.iter_sessions(topics=["Массы"], grades=["5-6"])) == ["s1"]
+    assert log.session_rows("s3")[0]['Класс'] == "7-8"
@@ -1,17 +1,107 @@
 """
 Утилиты для приложения
 """
-from .schema_formatter import format_schema, format_feedback_context
+from .schema_formatter import format_feedback_context
+from .topic_models import Topic, ExplanationBlock, BossStep, Boss, TopicSchemaError
 from .chat_export import format_chat_to_markdown, format_chat_to_text, get_chat_filename
-from .google_sheets import save_chat_to_sheets, get_google_sheets_client, create_new_sheet
+from .chat_export import iter_chat_markdown, iter_chat_text
+from .chat_render import CHAT_CSS, HISTORY_BLOCK_SIZE, split_history, render_message_html, render_quiz_html, quiz_key
+from .google_sheets import (
+    get_google_sheets_client,
+    get_pooled_client,
+    get_cached_worksheet,
+    reset_sheets_cache,
+    create_new_sheet
+)
+from .streaming import MarkerStreamFilter, parse_quick_replies, check_answer_correctness, LESSON_COMPLETE_MARKER
+from .transcript_log import TranscriptLog, get_transcript_log
+from .sheets_exporter import SheetsExporter, ExportHandle, get_sheets_exporter
+from .conversation_memory import ConversationMemory
+from .lesson_engine import LessonEngine, LessonTurn
+from .llm_metrics import InstrumentedLLM, MetricsRegistry, get_metrics_registry, start_metrics_server
+from .context_cache import build_prompt_messages
+from .answer_checker import AnswerVerdict, check_answer, format_mistake_reply, unit_from_question
+from .response_cache import ResponseCache, CachedLLM, make_cache_key, get_response_cache
+from .llm_gate import OutboundGate, CircuitOpenError, QueueTimeoutError, RequestCancelledError, get_outbound_gate
+from .llm_router import (
+    LLMRouter,
+    LLMProvider,
+    ProviderTimeoutError,
+    AllProvidersFailedError,
+    create_llm_router,
+    provider_health_stats
+)
+from .llm_tasks import LLMTask, LLMTaskRunner, get_llm_task_runner
+from .session_store import SessionStore, MemorySessionStore, SQLiteSessionStore, StoredSession, get_session_store
+from .session_store import quiz_state_from_log, quiz_state_to_log
 
 __all__ = [
-    'format_schema',
     'format_feedback_context',
+    'Topic',
+    'ExplanationBlock',
+    'BossStep',
+    'Boss',
+    'TopicSchemaError',
     'format_chat_to_markdown',
     'format_chat_to_text',
     'get_chat_filename',
-    'save_chat_to_sheets',
+    'iter_chat_markdown',
+    'iter_chat_text',
+    'CHAT_CSS',
+    'HISTORY_BLOCK_SIZE',
+    'split_history',
+    'render_message_html',
+    'render_quiz_html',
+    'quiz_key',
     'get_google_sheets_client',
-    'create_new_sheet'
+    'get_pooled_client',
+    'get_cached_worksheet',
+    'reset_sheets_cache',
+    'create_new_sheet',
+    'TranscriptLog',
+    'get_transcript_log',
+    'SheetsExporter',
+    'ExportHandle',
+    'get_sheets_exporter',
+    'MarkerStreamFilter',
+    'parse_quick_replies',
+    'check_answer_correctness',
+    'LESSON_COMPLETE_MARKER',
+    'build_prompt_messages',
+    'ConversationMemory',
+    'LessonEngine',
+    'LessonTurn',
+    'InstrumentedLLM',
+    'MetricsRegistry',
+    'get_metrics_registry',
+    'start_metrics_server',
+    'ResponseCache',
+    'CachedLLM',
+    'make_cache_key',
+    'get_response_cache',
+    'OutboundGate',
+    'CircuitOpenError',
+    'QueueTimeoutError',
+    'RequestCancelledError',
+    'get_outbound_gate',
+    'LLMRouter',
+    'LLMProvider',
+    'ProviderTimeoutError',
+    'AllProvidersFailedError',
+    'create_llm_router',
+    'provider_health_stats',
+    'LLMTask',
+    'LLMTaskRunner',
+    'get_llm_task_runner',
+    'SessionStore',
+    'MemorySessionStore',
+    'SQLiteSessionStore',
+    'StoredSession',
+    'get_session_store',
+    'quiz_state_from_log',
+    'quiz_state_to_log',
+    'AnswerVerdict',
+    'check_answer',
+    'unit_from_question',
+    'format_mistake_reply'
 ]
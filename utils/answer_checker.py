@@ -0,0 +1,329 @@
+"""
+Локальная проверка ответов ученика по схеме темы (без вызова LLM)
+
+Сравнивает числовые, дробные, алгебраические ответы и ответы с единицами
+измерения с эталоном `answer` и известными ошибками `mistake_explanation`.
+"""
+import re
+from dataclasses import dataclass
+from fractions import Fraction
+from tokenize import TokenError
+from typing import Optional
+
+import numexpr
+import sympy
+from sympy.parsing.sympy_parser import (
+    convert_xor,
+    implicit_multiplication_application,
+    parse_expr,
+    standard_transformations,
+)
+
+
+def _unit_forms(kind: str, factor: int, *words) -> dict:
+    return {word: (kind, factor) for word in words}
+
+
+# Единицы измерения: величина и множитель к базовой единице (г, мм, с)
+UNITS = {
+    # Масса (граммы)
+    **_unit_forms('mass', 1, 'г', 'гр', 'грамм', 'грамма', 'граммов', 'граммы'),
+    **_unit_forms('mass', 1000, 'кг', 'килограмм', 'килограмма', 'килограммов', 'килограммы'),
+    **_unit_forms('mass', 100_000, 'ц', 'центнер', 'центнера', 'центнеров', 'центнеры'),
+    **_unit_forms('mass', 1_000_000, 'т', 'тонна', 'тонны', 'тонн', 'тонну'),
+    # Длина (миллиметры)
+    **_unit_forms('length', 1, 'мм', 'миллиметр', 'миллиметра', 'миллиметров', 'миллиметры'),
+    **_unit_forms('length', 10, 'см', 'сантиметр', 'сантиметра', 'сантиметров', 'сантиметры'),
+    **_unit_forms('length', 100, 'дм', 'дециметр', 'дециметра', 'дециметров', 'дециметры'),
+    **_unit_forms('length', 1000, 'м', 'метр', 'метра', 'метров', 'метры'),
+    **_unit_forms('length', 1_000_000, 'км', 'километр', 'километра', 'километров', 'километры'),
+    # Время (секунды)
+    **_unit_forms('time', 1, 'с', 'сек', 'секунда', 'секунды', 'секунд', 'секунду'),
+    **_unit_forms('time', 60, 'мин', 'минута', 'минуты', 'минут', 'минуту'),
+    **_unit_forms('time', 3600, 'ч', 'час', 'часа', 'часов', 'часы'),
+}
+
+# Кириллические буквы, которые ученики пишут вместо латинских переменных
+CYRILLIC_VARIABLES = str.maketrans({'х': 'x', 'у': 'y', 'а': 'a', 'в': 'b', 'с': 'c'})
+
+NUMBER_PATTERN = r'-?\d+(?:[.,]\d+)?'
+QUANTITY_PATTERN = re.compile(rf'({NUMBER_PATTERN})\s*([а-яё]+)\.?')
+# Допустимые символы выражения (все прочее parse_expr не получает)
+EXPRESSION_PATTERN = re.compile(r'^[0-9a-z+\-*/^().\s]+$')
+MAX_EXPRESSION_LENGTH = 60
+# Степень: знак ^ или ** и показатель - переменная, число до двух цифр или их сумма в скобках
+POWER_PATTERN = re.compile(r'\^|\*\*')
+_EXPONENT_TERM = r'(?:[a-z]|\d{1,2}(?![\d.]))'
+SAFE_EXPONENT_PATTERN = re.compile(
+    rf'(?:\^|\*\*)\s*-?\s*(?:{_EXPONENT_TERM}|\(\s*-?\s*{_EXPONENT_TERM}(?:\s*[+\-]\s*{_EXPONENT_TERM})*\s*\))'
+)
+
+_TRANSFORMATIONS = standard_transformations + (implicit_multiplication_application, convert_xor)
+
+# Единица ответа в вопросе: «Сколько килограммов...», «...переведи в граммы»
+QUESTION_UNIT_PATTERN = re.compile(r'(?:сколько|\bв)\s+([а-яё]+)')
+
+
+@dataclass(frozen=True)
+class Quantity:
+    """Величина с единицами: значение в базовой единице (г, мм, с) и род величины"""
+    value: Fraction
+    kind: str
+
+
+@dataclass
+class AnswerVerdict:
+    """Результат проверки ответа"""
+    status: str                          # correct / known_mistake / incorrect / unknown
+    expected: str = ""                   # Эталонный ответ из схемы
+    normalized: str = ""                 # Ответ ученика после нормализации
+    method: str = ""                     # exact / numeric / symbolic / units
+    mistake_key: Optional[str] = None    # Ключ из mistake_explanation
+    mistake_explanation: Optional[str] = None
+
+    @property
+    def is_correct(self) -> Optional[bool]:
+        """True / False, или None, если ответ не удалось разобрать"""
+        if self.status == "unknown":
+            return None
+        return self.status == "correct"
+
+    def prompt_note(self) -> str:
+        """Строка для промпта: LLM формулирует ответ, не проверяя заново"""
+        if self.status == "correct":
+            return "[Автопроверка: ответ верный]"
+        if self.status == "known_mistake":
+            return f"[Автопроверка: типичная ошибка - {self.mistake_explanation}]"
+        if self.status == "incorrect":
+            return f"[Автопроверка: ответ неверный, правильный ответ {self.expected} - не называй его ученику]"
+        return ""
+
+
+def _too_costly(text: str) -> bool:
+    """
+    Выражение, которое нельзя отдавать вычислителю: слишком длинное, степень степени или тяжелый показатель
+
+    numexpr и sympy считают целые степени точно, поэтому 10**10**10 или 2**99999999999
+    вычислялись бы бесконечно и держали поток скрипта.
+    """
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        return True
+    powers = POWER_PATTERN.findall(text)
+    if not powers:
+        return False
+    # Одна степень с коротким показателем (9**(99*99*99) короткий по записи, но не по вычислению)
+    return len(powers) > 1 or not SAFE_EXPONENT_PATTERN.search(text)
+
+
+def _to_number(text: str) -> Optional[Fraction]:
+    """Число или числовое выражение ('7000', '3,5', '3*1000+450', '1/2') -> Fraction"""
+    if not re.fullmatch(r'[0-9+\-*/().\s]+', text) or not re.search(r'\d', text) or _too_costly(text):
+        return None
+    try:
+        # Точные дроби - через Fraction (numexpr считает во float)
+        if re.fullmatch(r'-?\d+(?:\.\d+)?(?:/\d+)?', text):
+            return Fraction(text)
+        value = numexpr.evaluate(text).item()
+    except (ValueError, ZeroDivisionError, SyntaxError, KeyError, TypeError, OverflowError):
+        return None
+    return Fraction(value).limit_denominator(10 ** 9)
+
+
+def _to_quantity(text: str) -> Optional[Quantity]:
+    """
+    Величина с единицами -> Quantity в базовой единице своей величины
+
+    '7 кг' -> 7000 г, '3 т 450 кг' -> 3450000 г, '2 ч 5 мин' -> 7500 с
+    """
+    parts = QUANTITY_PATTERN.findall(text)
+    if not parts or QUANTITY_PATTERN.sub('', text).strip():
+        return None
+
+    units = []
+    for number, unit in parts:
+        if unit not in UNITS:
+            return None
+        units.append((Fraction(number.replace(',', '.')), *UNITS[unit]))
+
+    kinds = {kind for _, kind, _ in units}
+    if len(kinds) != 1:
+        return None
+    return Quantity(sum(value * factor for value, _, factor in units), kinds.pop())
+
+
+def _to_expression(text: str):
+    """Алгебраическое выражение ('2x+3', '3 + 2*x') -> выражение sympy"""
+    text = text.translate(CYRILLIC_VARIABLES)
+    # Выражение - только с оператором или с числом при переменной: одиночное «а», «в», «с»
+    # (союзы и предлоги) или «x» без числа ответом не считаются
+    if not re.search(r'[+\-*/^]', text) and not (re.search(r'\d', text) and re.search(r'[a-z]', text)):
+        return None
+    # Только однобуквенные переменные: строка не должна превратиться в вызов функции
+    if not EXPRESSION_PATTERN.match(text) or re.search(r'[a-z]{2,}', text) or _too_costly(text):
+        return None
+    try:
+        return parse_expr(text, transformations=_TRANSFORMATIONS, evaluate=True)
+    except (SyntaxError, TypeError, ValueError, sympy.SympifyError, TokenError):
+        return None
+
+
+def normalize_text(text) -> str:
+    """Нормализация записи: регистр, пробелы в числах, запятая, знаки препинания по краям"""
+    text = str(text).strip().lower().replace('ё', 'е')
+    # Ответ в формате «x = 5» или «ответ: 5»
+    text = re.sub(r'^(ответ|x|х|y|у)\s*[=:]\s*', '', text)
+    text = text.replace('−', '-').replace('×', '*').replace('·', '*')
+    text = re.sub(r'(?<=\d)\s*:\s*(?=\d)', '/', text)           # 6 : 3 -> 6/3
+    text = re.sub(r'(?<=\d)[\s ](?=\d{3}\b)', '', text)   # 7 000 -> 7000
+    text = re.sub(r'(?<=\d),(?=\d)', '.', text)                 # 3,5 -> 3.5
+    text = text.strip(' .!?;')
+    return re.sub(r'\s+', ' ', text)
+
+
+def parse_answer(text):
+    """
+    Разбирает ответ: число (Fraction), величина с единицами (Quantity), выражение sympy или None
+
+    Returns:
+        (значение, способ разбора)
+    """
+    normalized = normalize_text(text)
+
+    number = _to_number(normalized)
+    if number is not None:
+        return number, "numeric"
+
+    # Смешанное число: «1 1/2»
+    mixed = re.fullmatch(r'(\d+) (\d+)/(\d+)', normalized)
+    if mixed:
+        whole, num, den = map(int, mixed.groups())
+        if den:
+            return whole + Fraction(num, den), "numeric"
+
+    quantity = _to_quantity(normalized)
+    if quantity is not None:
+        return quantity, "units"
+
+    expression = _to_expression(normalized)
+    if expression is not None:
+        return expression, "symbolic"
+
+    return None, ""
+
+
+def unit_from_question(question: str) -> Optional[str]:
+    """
+    Единица, в которой ждут ответ, по тексту вопроса (None, если не понятно)
+
+    'Сколько килограммов в $7$ тоннах?' -> 'килограммов', 'Переведи $3$ тонны в граммы' -> 'граммы'.
+    Если такого оборота нет - первая полная (не сокращенная) единица в вопросе.
+    """
+    question = question.lower().replace('ё', 'е')
+    for word in QUESTION_UNIT_PATTERN.findall(question):
+        if word in UNITS:
+            return word
+    for word in re.findall(r'[а-я]{3,}', question):
+        if word in UNITS:
+            return word
+    return None
+
+
+def _written_unit(text: str) -> Optional[str]:
+    """Единица эталона, записанного с одной единицей ('7000 кг' -> 'кг')"""
+    parts = QUANTITY_PATTERN.findall(normalize_text(text))
+    return parts[0][1] if len(parts) == 1 else None
+
+
+def _in_unit(value, unit: Optional[str]):
+    """Число без единиц -> Quantity в единице unit (величины и выражения не меняются)"""
+    if isinstance(value, Fraction) and unit in UNITS:
+        kind, factor = UNITS[unit]
+        return Quantity(value * factor, kind)
+    return value
+
+
+def _equal(a, b) -> bool:
+    if isinstance(a, Quantity) or isinstance(b, Quantity):
+        return a == b
+    if isinstance(a, Fraction) and isinstance(b, Fraction):
+        return a == b
+    try:
+        return sympy.simplify(sympy.nsimplify(a) - sympy.nsimplify(b)) == 0
+    except (TypeError, ValueError, sympy.SympifyError):
+        return False
+
+
+def check_answer(student_answer: str, expected, mistakes: dict = None, unit: str = None) -> AnswerVerdict:
+    """
+    Проверяет ответ ученика по эталону и известным ошибкам
+
+    Ответ с единицами переводится в единицу эталона: если ждут килограммы, то
+    «7 т» и «7000000 г» верны, «7000 г» - нет, а «7000 с» - другая величина.
+
+    Args:
+        student_answer: Сообщение ученика
+        expected: Эталонный ответ (`answer` из схемы)
+        mistakes: Известные ошибки (`mistake_explanation`: {неверный ответ: объяснение})
+        unit: Единица, в которой записан эталон без единиц (unit_from_question); без нее
+            ответ с единицами получает status 'unknown'
+
+    Returns:
+        AnswerVerdict; status 'unknown', если ответ не разобран (например, вопрос вместо ответа)
+    """
+    normalized = normalize_text(student_answer)
+    expected_text = str(expected)
+    verdict = AnswerVerdict(status="unknown", expected=expected_text, normalized=normalized)
+
+    if not normalized:
+        return verdict
+
+    if normalized == normalize_text(expected_text):
+        verdict.status, verdict.method = "correct", "exact"
+        return verdict
+
+    value, method = parse_answer(normalized)
+    if value is None:
+        return verdict
+    verdict.method = method
+
+    expected_value, _ = parse_answer(expected_text)
+    if isinstance(value, Quantity) or isinstance(expected_value, Quantity):
+        # Сравнение в базовых единицах; число без единиц - в единице эталона
+        unit = unit or _written_unit(expected_text)
+        value, expected_value = _in_unit(value, unit), _in_unit(expected_value, unit)
+        if not isinstance(value, Quantity) or not isinstance(expected_value, Quantity):
+            return verdict  # Единица эталона неизвестна - перевести ответ не во что
+        if value.kind != expected_value.kind:
+            verdict.status = "incorrect"  # Другая величина (секунды вместо килограммов)
+            return verdict
+
+    if expected_value is not None and _equal(value, expected_value):
+        verdict.status = "correct"
+        return verdict
+
+    for key, explanation in (mistakes or {}).items():
+        mistake_value, _ = parse_answer(key)
+        if isinstance(value, Quantity):
+            mistake_value = _in_unit(mistake_value, unit)
+        if normalize_text(key) == normalized or (mistake_value is not None and _equal(value, mistake_value)):
+            verdict.status = "known_mistake"
+            verdict.mistake_key = key
+            verdict.mistake_explanation = explanation
+            return verdict
+
+    verdict.status = "incorrect" if expected_value is not None else "unknown"
+    return verdict
+
+
+def format_mistake_reply(verdict: AnswerVerdict, action: str = "") -> str:
+    """
+    Мгновенный ответ на известную ошибку (без вызова LLM): подсказка из схемы и тот же вопрос
+
+    Args:
+        verdict: Вердикт со status='known_mistake'
+        action: Вопрос текущего пункта урока
+    """
+    reply = f"Почти! 🙂 {verdict.mistake_explanation}"
+    if action:
+        reply += f"\n\nПопробуй ещё раз: {action}"
+    return reply
@@ -0,0 +1,202 @@
+"""
+Выгрузка диалогов из журнала (TranscriptLog) по классу, теме и датам
+
+Запуск:
+    python -m utils.bulk_export --format md --out export/ --topic weight_units --grade 5-6
+    python -m utils.bulk_export --format csv --out dialogs.csv --since 2026-09-01 --until 2026-09-30
+
+Форматы: md и txt - файл на сессию в каталоге --out; csv и parquet - один файл.
+Сессии рендерятся в параллельных процессах; в работе одновременно не больше
+нескольких сессий на процесс, поэтому память не растет с размером журнала.
+"""
+import argparse
+import csv
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .chat_export import iter_chat_markdown, iter_chat_text, get_session_filename
+from .google_sheets import SHEET_HEADERS
+from .transcript_log import TranscriptLog
+
+FORMATS = ("md", "txt", "csv", "parquet")
+COLUMNS = SHEET_HEADERS + ['Класс']
+
+# Сколько сессий на процесс может быть в работе одновременно
+IN_FLIGHT_PER_WORKER = 4
+
+# Сколько строк копить перед записью группы строк Parquet
+PARQUET_ROW_GROUP = 10000
+
+_worker_log = None  # Свое соединение с журналом в каждом процессе
+
+
+def _init_worker(log_path: str):
+    global _worker_log
+    _worker_log = TranscriptLog(log_path)
+
+
+def _render_session(session_id: str, filters: dict, fmt: str, out: str):
+    """
+    Рендерит одну сессию (выполняется в процессе пула)
+
+    Returns:
+        md/txt: (имя файла, строк); csv/parquet: (None, список строк в порядке COLUMNS)
+    """
+    rows = _worker_log.session_rows(session_id, **filters)
+    if fmt in ("csv", "parquet"):
+        return None, [[row[column] for column in COLUMNS] for row in rows]
+
+    first = rows[0]
+    messages = [
+        {"role": "user" if row['Роль'] == "Ученик" else "assistant", "content": row['Сообщение']}
+        for row in rows
+    ]
+    topic_title = first['Тема'] if first['Тема'] != "-" else None
+    date = f"{first['Дата']} {first['Время'][:5]}"
+    render = iter_chat_markdown if fmt == "md" else iter_chat_text
+
+    filename = get_session_filename(session_id, topic_title, fmt)
+    with open(Path(out) / filename, "w", encoding="utf-8") as f:
+        f.writelines(render(messages, topic_title, date=date))
+    return filename, len(rows)
+
+
+def _ordered_results(executor, fn, items, window: int, *args):
+    """Как executor.map, но держит в работе не больше window задач (входной итератор читается по мере надобности)"""
+    in_flight = deque()
+    for item in items:
+        in_flight.append(executor.submit(fn, item, *args))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+class _ParquetSink:
+    """Пишет строки в Parquet группами по PARQUET_ROW_GROUP (pyarrow нужен только для этого формата)"""
+
+    def __init__(self, path: Path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise SystemExit(f"Для формата parquet нужен pyarrow: pip install pyarrow ({e})")
+        self._pa = pa
+        self._schema = pa.schema([(column, pa.string()) for column in COLUMNS])
+        self._writer = pq.ParquetWriter(str(path), self._schema)
+        self._rows = []
+
+    def write(self, rows: list):
+        self._rows.extend(rows)
+        if len(self._rows) >= PARQUET_ROW_GROUP:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            columns = list(zip(*self._rows))
+            self._writer.write_table(self._pa.Table.from_arrays(
+                [self._pa.array(column, type=self._pa.string()) for column in columns], schema=self._schema
+            ))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def export_transcripts(log_path: str, fmt: str, out: str, since: str = None, until: str = None,
+                       topics: list = None, grades: list = None, workers: int = None) -> dict:
+    """
+    Выгружает сессии журнала под фильтр
+
+    Args:
+        log_path: Файл журнала диалогов
+        fmt: Формат (md, txt, csv, parquet)
+        out: Каталог (md, txt) или файл (csv, parquet)
+        since, until: Диапазон дат сообщений 'гггг-мм-дд' включительно
+        topics: Названия тем
+        grades: Классы ("5-6", ...)
+        workers: Число процессов (по умолчанию - число ядер)
+
+    Returns:
+        {'sessions': выгружено сессий, 'rows': сообщений}
+    """
+    workers = workers or os.cpu_count() or 1
+    filters = {'since': since, 'until': until, 'topics': topics, 'grades': grades}
+    log = TranscriptLog(log_path)
+    sessions = log.iter_sessions(**filters)
+
+    out_path = Path(out)
+    if fmt in ("md", "txt"):
+        out_path.mkdir(parents=True, exist_ok=True)
+    else:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    sink = None
+    csv_file = None
+    if fmt == "csv":
+        # utf-8-sig - чтобы Excel открыл кириллицу без мастера импорта
+        csv_file = open(out_path, "w", encoding="utf-8-sig", newline="")
+        sink = csv.writer(csv_file)
+        sink.writerow(COLUMNS)
+        write_rows = sink.writerows
+    elif fmt == "parquet":
+        sink = _ParquetSink(out_path)
+        write_rows = sink.write
+
+    totals = {'sessions': 0, 'rows': 0}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(log_path,)) as executor:
+            window = workers * IN_FLIGHT_PER_WORKER
+            for filename, result in _ordered_results(executor, _render_session, sessions, window,
+                                                     filters, fmt, str(out_path)):
+                totals['sessions'] += 1
+                if filename is None:
+                    write_rows(result)
+                    totals['rows'] += len(result)
+                else:
+                    totals['rows'] += result
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+        elif sink is not None:
+            sink.close()
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка диалогов из журнала по классу, теме и датам")
+    parser.add_argument("--format", choices=FORMATS, default="md", help="Формат выгрузки")
+    parser.add_argument("--out", required=True,
+                        help="Каталог (md, txt - файл на сессию) или файл (csv, parquet)")
+    parser.add_argument("--log", default=os.getenv("TRANSCRIPT_LOG_PATH", "transcripts.sqlite3"),
+                        help="Файл журнала диалогов (TRANSCRIPT_LOG_PATH)")
+    parser.add_argument("--since", help="С даты, гггг-мм-дд (включительно)")
+    parser.add_argument("--until", help="По дату, гггг-мм-дд (включительно)")
+    parser.add_argument("--topic", action="append",
+                        help="ID темы (имя файла в data/topics) или ее название; можно несколько")
+    parser.add_argument("--grade", action="append", help="Класс (1-4, 5-6, 7-8, 9-11); можно несколько")
+    parser.add_argument("--workers", type=int, help="Число процессов (по умолчанию - число ядер)")
+    args = parser.parse_args(argv)
+
+    if not Path(args.log).exists():
+        print(f"❌ Журнал не найден: {args.log}")
+        return 1
+
+    # В журнале хранится название темы - ID переводим в название по каталогу
+    topics = None
+    if args.topic:
+        from data import TOPICS
+        topics = [TOPICS.info(topic).title if topic in TOPICS else topic for topic in args.topic]
+
+    totals = export_transcripts(args.log, args.format, args.out, args.since, args.until,
+                                topics, args.grade, args.workers)
+    print(f"✅ Выгружено сессий: {totals['sessions']}, сообщений: {totals['rows']} → {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
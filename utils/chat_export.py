@@ -4,91 +4,97 @@
 from datetime import datetime
 
 
-def format_chat_to_markdown(messages: list, topic_title: str = None) -> str:
+def iter_chat_markdown(messages: list, topic_title: str = None, date: str = None):
     """
-    Форматирует историю чата в красивый Markdown
+    Отдает диалог в Markdown по частям - весь текст целиком в памяти не собирается
 
     Args:
         messages: Список сообщений [{"role": "user"/"assistant", "content": "..."}]
         topic_title: Название темы (опционально)
+        date: Дата диалога (по умолчанию - текущая, для выгрузки из журнала - дата сессии)
 
-    Returns:
-        Отформатированная строка в Markdown
+    Yields:
+        Фрагменты Markdown (заголовок, затем по фрагменту на сообщение, футер)
     """
-    lines = []
-
-    # Заголовок
-    lines.append("# 📚 Диалог с AI Тьютором\n")
-
-    # Дата и тема
-    lines.append(f"**Дата:** {datetime.now().strftime('%d.%m.%Y %H:%M')}\n")
+    # Заголовок, дата и тема
+    header = "# 📚 Диалог с AI Тьютором\n"
+    header += f"**Дата:** {date or datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
     if topic_title:
-        lines.append(f"**Тема:** {topic_title}\n")
-
-    lines.append("\n---\n\n")
+        header += f"**Тема:** {topic_title}\n"
+    yield header + "\n---\n\n"
 
     # Диалог
     for i, msg in enumerate(messages, 1):
-        role = msg["role"]
-        content = msg["content"]
-
         # Эмодзи для роли
-        if role == "user":
+        if msg["role"] == "user":
             icon = "👤"
             role_name = "Ученик"
         else:
             icon = "🤖"
             role_name = "Тьютор"
 
-        # Форматирование сообщения
-        lines.append(f"### {icon} {role_name} (сообщение {i})\n\n")
-        lines.append(f"{content}\n\n")
-        lines.append("---\n\n")
+        yield f"### {icon} {role_name} (сообщение {i})\n\n{msg['content']}\n\n---\n\n"
 
     # Футер
-    lines.append("\n\n*Экспортировано из Математического помощника AI*\n")
-
-    return "".join(lines)
+    yield "\n\n*Экспортировано из Математического помощника AI*\n"
 
 
-def format_chat_to_text(messages: list, topic_title: str = None) -> str:
+def format_chat_to_markdown(messages: list, topic_title: str = None, date: str = None) -> str:
     """
-    Форматирует историю чата в простой текстовый формат
+    Форматирует историю чата в красивый Markdown
 
     Args:
-        messages: Список сообщений
+        messages: Список сообщений [{"role": "user"/"assistant", "content": "..."}]
         topic_title: Название темы (опционально)
+        date: Дата диалога (по умолчанию - текущая)
 
     Returns:
-        Простой текст
+        Отформатированная строка в Markdown
     """
-    lines = []
+    return "".join(iter_chat_markdown(messages, topic_title, date))
 
-    # Заголовок
-    lines.append("=" * 60)
-    lines.append("\n    ДИАЛОГ С AI ТЬЮТОРОМ")
-    lines.append("\n" + "=" * 60 + "\n\n")
 
-    # Дата и тема
-    lines.append(f"Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n")
-    if topic_title:
-        lines.append(f"Тема: {topic_title}\n")
+def iter_chat_text(messages: list, topic_title: str = None, date: str = None):
+    """
+    Отдает диалог простым текстом по частям
 
-    lines.append("\n" + "-" * 60 + "\n\n")
+    Args:
+        messages: Список сообщений
+        topic_title: Название темы (опционально)
+        date: Дата диалога (по умолчанию - текущая)
+
+    Yields:
+        Фрагменты текста (заголовок, затем по фрагменту на сообщение, футер)
+    """
+    # Заголовок, дата и тема
+    header = "=" * 60 + "\n    ДИАЛОГ С AI ТЬЮТОРОМ" + "\n" + "=" * 60 + "\n\n"
+    header += f"Дата: {date or datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+    if topic_title:
+        header += f"Тема: {topic_title}\n"
+    yield header + "\n" + "-" * 60 + "\n\n"
 
     # Диалог
     for i, msg in enumerate(messages, 1):
         role = "УЧЕНИК" if msg["role"] == "user" else "ТЬЮТОР"
-        content = msg["content"]
-
-        lines.append(f"[{role}] (сообщение {i}):\n")
-        lines.append(f"{content}\n\n")
-        lines.append("-" * 60 + "\n\n")
+        yield f"[{role}] (сообщение {i}):\n{msg['content']}\n\n" + "-" * 60 + "\n\n"
 
     # Футер
-    lines.append("\nЭкспортировано из Математического помощника AI\n")
+    yield "\nЭкспортировано из Математического помощника AI\n"
+
+
+def format_chat_to_text(messages: list, topic_title: str = None, date: str = None) -> str:
+    """
+    Форматирует историю чата в простой текстовый формат
 
-    return "".join(lines)
+    Args:
+        messages: Список сообщений
+        topic_title: Название темы (опционально)
+        date: Дата диалога (по умолчанию - текущая)
+
+    Returns:
+        Простой текст
+    """
+    return "".join(iter_chat_text(messages, topic_title, date))
 
 
 def get_chat_filename(topic_title: str = None, format: str = "md") -> str:
@@ -105,10 +111,27 @@ def get_chat_filename(topic_title: str = None, format: str = "md") -> str:
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     if topic_title:
-        # Очищаем название темы от спецсимволов
-        clean_title = "".join(c if c.isalnum() or c in (' ', '-', '_') else '_'
-                              for c in topic_title)
-        clean_title = clean_title.replace(' ', '_')
-        return f"dialog_{clean_title}_{timestamp}.{format}"
+        return f"dialog_{_clean_title(topic_title)}_{timestamp}.{format}"
     else:
         return f"dialog_{timestamp}.{format}"
+
+
+def get_session_filename(session_id: str, topic_title: str = None, format: str = "md") -> str:
+    """
+    Имя файла диалога при выгрузке из журнала (одно на сессию, не зависит от времени выгрузки)
+
+    Args:
+        session_id: ID сессии
+        topic_title: Название темы
+        format: Формат файла (md, txt)
+    """
+    clean_session = _clean_title(session_id)
+    if topic_title and topic_title != "-":
+        return f"dialog_{_clean_title(topic_title)}_{clean_session}.{format}"
+    return f"dialog_{clean_session}.{format}"
+
+
+def _clean_title(title: str) -> str:
+    """Очищает название от спецсимволов для имени файла"""
+    clean_title = "".join(c if c.isalnum() or c in (' ', '-', '_') else '_' for c in title)
+    return clean_title.replace(' ', '_')
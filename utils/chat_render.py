@@ -0,0 +1,158 @@
+"""
+Инкрементальный вывод истории чата
+
+Streamlit на каждом прогоне заново отправляет в браузер все элементы страницы, но
+сообщения от 10 КБ (global.minCachedMessageSize) кеширует по хешу содержимого:
+если браузер уже получал такой же элемент, уходит только ссылка на него.
+Поэтому завершенная история выводится блоками по несколько сообщений с
+неизменной разметкой - старые блоки не пересылаются, а история не рендерится
+заново. Живыми элементами (st.chat_message) выводится только последний, еще не
+заполненный блок.
+"""
+import html
+from functools import lru_cache
+
+# Стили чата - вставляются один раз за прогон, а не на каждое сообщение с квизом
+CHAT_CSS = """
+<style>
+.stMarkdown .katex {
+    font-size: 1.5em !important;
+}
+.quiz-buttons {
+    display: flex;
+    gap: 0.5rem;
+    margin: 0.25rem 0 1rem 0;
+}
+.quiz-button {
+    flex: 1;
+    padding: 0.5rem 1rem;
+    border-radius: 0.5rem;
+    border: 2px solid #e0e0e0;
+    background-color: #f5f5f5;
+    cursor: default;
+    text-align: center;
+    margin: 0.25rem;
+    font-size: 1rem;
+}
+.quiz-button-correct {
+    background-color: #4caf50 !important;
+    color: white !important;
+    border-color: #45a049 !important;
+}
+.quiz-button-incorrect {
+    background-color: #f44336 !important;
+    color: white !important;
+    border-color: #da190b !important;
+}
+.chat-history-message {
+    display: flex;
+    gap: 0.5rem;
+    padding: 1rem;
+    border-radius: 0.5rem;
+    margin-bottom: 1rem;
+}
+.chat-history-user {
+    background-color: rgba(240, 242, 246, 0.5);
+}
+.chat-history-avatar {
+    flex-shrink: 0;
+    width: 2rem;
+    height: 2rem;
+    line-height: 2rem;
+    text-align: center;
+    font-size: 1.25rem;
+}
+.chat-history-content {
+    flex-grow: 1;
+    min-width: 0;
+}
+</style>
+"""
+
+# Сколько сообщений в блоке истории (завершенный блок выводится одной готовой разметкой)
+HISTORY_BLOCK_SIZE = 10
+
+_AVATARS = {"user": "👤", "assistant": "🤖"}
+
+
+def quiz_key(quiz_data: dict):
+    """Неизменяемый ключ выбранного ответа квиза (для кеша разметки) или None"""
+    if not quiz_data:
+        return None
+    return tuple(quiz_data["replies"]), quiz_data["selected"], quiz_data["correct"]
+
+
+@lru_cache(maxsize=1024)
+def render_quiz_html(quiz: tuple) -> str:
+    """
+    Разметка кнопок отвеченного квиза с подсветкой выбранного варианта
+
+    Args:
+        quiz: Ключ из quiz_key - (варианты, выбранный, правильно ли)
+    """
+    replies, selected, correct = quiz
+    buttons = []
+    for reply in replies:
+        # Определяем класс кнопки
+        if reply == selected:
+            button_class = "quiz-button quiz-button-correct" if correct else "quiz-button quiz-button-incorrect"
+        else:
+            button_class = "quiz-button"
+        buttons.append(f'<div class="{button_class}">{html.escape(reply)}</div>')
+    return f'<div class="quiz-buttons">{"".join(buttons)}</div>'
+
+
+@lru_cache(maxsize=4096)
+def render_message_html(role: str, content: str, quiz: tuple = None) -> str:
+    """
+    Готовая разметка одного сообщения истории (кешируется по роли, тексту и квизу)
+
+    Текст остается Markdown (с формулами KaTeX) - пустые строки вокруг него
+    отделяют его от HTML-обертки, чтобы Streamlit разобрал Markdown внутри.
+
+    Args:
+        role: "user" или "assistant"
+        content: Текст сообщения
+        quiz: Ключ квиза из quiz_key (кнопки выводятся под сообщением)
+    """
+    parts = [
+        f'<div class="chat-history-message chat-history-{role}">\n'
+        f'<div class="chat-history-avatar">{_AVATARS.get(role, "💬")}</div>\n'
+        f'<div class="chat-history-content">\n\n{content}\n\n</div>\n</div>\n\n'
+    ]
+    if quiz is not None:
+        parts.append(render_quiz_html(quiz) + "\n\n")
+    return "".join(parts)
+
+
+def split_history(messages: list, quiz_state: dict, offset: int = 0, block_size: int = HISTORY_BLOCK_SIZE) -> tuple:
+    """
+    Делит историю на готовые блоки и «живой» хвост
+
+    Границы блоков считаются по номеру сообщения в сессии (offset + индекс), поэтому
+    разметка завершенного блока не меняется от хода к ходу, в том числе после
+    восстановления сессии с окном сообщений.
+
+    Args:
+        messages: Сообщения в session_state
+        quiz_state: Ответы квиза {индекс сообщения + 1: данные квиза}
+        offset: Номер первого сообщения в журнале сессии
+        block_size: Сообщений в блоке
+
+    Returns:
+        (список разметок завершенных блоков, индекс первого сообщения хвоста)
+    """
+    if block_size <= 0:
+        return [], 0
+
+    live_start = max(0, len(messages) - (offset + len(messages)) % block_size)
+    blocks = []
+    start = 0
+    while start < live_start:
+        end = min(live_start, start + block_size - (offset + start) % block_size)
+        blocks.append("".join(
+            render_message_html(message["role"], message["content"], quiz_key(quiz_state.get(idx + 1)))
+            for idx, message in enumerate(messages[start:end], start)
+        ))
+        start = end
+    return blocks, live_start
@@ -0,0 +1,28 @@
+"""
+Статический префикс промпта - отдельным системным сообщением
+
+Gemini 2.5 и OpenAI-совместимые API сами (неявно) кешируют одинаковое начало
+запроса, без отдельного вызова и ссылки на кеш. Поэтому достаточно, чтобы
+статическая часть промпта (инструкции, класс ученика) всегда шла первым
+системным сообщением и совпадала байт в байт от хода к ходу.
+"""
+from langchain_core.messages import HumanMessage, SystemMessage
+
+
+def build_prompt_messages(template, **values) -> list:
+    """
+    Собирает сообщения для LLM: системный префикс + пользовательский остаток
+
+    Args:
+        template: CompiledPrompt (обычно после partial со статическими слотами)
+        **values: Значения оставшихся (изменяющихся на каждом ходе) слотов
+
+    Returns:
+        [SystemMessage(префикс), HumanMessage(остаток)] или [HumanMessage], если префикса нет
+    """
+    prefix, suffix = template.split_prefix()
+    user_part = suffix.render(**values)
+
+    if not prefix:
+        return [HumanMessage(content=user_part)]
+    return [SystemMessage(content=prefix), HumanMessage(content=user_part)]
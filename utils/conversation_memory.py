@@ -0,0 +1,137 @@
+"""
+Память разговора с бюджетом токенов: свежие реплики дословно, старые - в сводке
+"""
+import re
+
+# Грубая оценка: для русского текста ~3 символа на токен
+CHARS_PER_TOKEN = 3
+
+# Сколько символов реплики попадает в сводку
+SUMMARY_LINE_LENGTH = 160
+
+
+def estimate_tokens(text: str) -> int:
+    """Приблизительное количество токенов в тексте (без вызова токенизатора)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def format_message(msg: dict) -> str:
+    """Реплика в формате истории промпта: 'Ученик: ...' / 'Тьютор: ...'"""
+    return f"{'Ученик' if msg['role'] == 'user' else 'Тьютор'}: {msg['content']}"
+
+
+def summarize_message(msg: dict) -> str:
+    """
+    Сжимает реплику до одной строки сводки
+
+    Берет первое предложение (или первые SUMMARY_LINE_LENGTH символов) без переносов.
+    """
+    text = " ".join(msg['content'].split())
+    sentence = re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0]
+    if len(sentence) > SUMMARY_LINE_LENGTH:
+        sentence = sentence[:SUMMARY_LINE_LENGTH].rstrip() + "…"
+    return f"{'Ученик' if msg['role'] == 'user' else 'Тьютор'}: {sentence}"
+
+
+def normalize_answer(text: str) -> str:
+    """Нормализует короткий ответ для сравнения: без пробелов, регистра и точки в конце"""
+    return re.sub(r'\s+', '', text).lower().replace(',', '.').rstrip('.')
+
+
+class ConversationMemory:
+    """
+    Память разговора одной сессии с ограничением по токенам
+
+    Свежие реплики хранятся дословно, пока укладываются в token_budget; более
+    старые по одной сворачиваются в сводку (сводка тоже ограничена). Обновление
+    инкрементальное: при каждом ходе обрабатываются только новые сообщения.
+    Прогресс урока ведет LessonEngine, он передается в промпт отдельно.
+    """
+
+    def __init__(self, session_id: str = None,
+                 token_budget: int = 1500, summary_budget: int = 500, min_recent: int = 2):
+        self.session_id = session_id
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.min_recent = min_recent
+
+        self.summary_lines = []    # Сводка старых реплик
+        self.dropped_lines = 0     # Сколько строк сводки пришлось выбросить целиком
+        self.folded = 0            # Сколько первых сообщений уже в сводке
+
+    def sync(self, messages: list):
+        """
+        Учитывает новые сообщения: сворачивает старые реплики, пока свежие не уложатся в бюджет
+
+        Args:
+            messages: Полный список сообщений сессии
+        """
+        # Сворачиваем самые старые реплики, пока свежие не уложатся в бюджет
+        recent_tokens = sum(estimate_tokens(format_message(m)) for m in messages[self.folded:])
+        while recent_tokens > self.token_budget and len(messages) - self.folded > self.min_recent:
+            msg = messages[self.folded]
+            recent_tokens -= estimate_tokens(format_message(msg))
+            self.summary_lines.append(summarize_message(msg))
+            self.folded += 1
+
+        # Сводка тоже ограничена - выбрасываем самые старые строки
+        while self.summary_lines and sum(estimate_tokens(l) for l in self.summary_lines) > self.summary_budget:
+            self.summary_lines.pop(0)
+            self.dropped_lines += 1
+
+    def render_summary(self) -> str:
+        """Сводка старых реплик (пустая строка, если нечего сказать)"""
+        parts = []
+
+        if self.summary_lines:
+            header = "[Кратко о начале разговора"
+            if self.dropped_lines:
+                header += f", самые ранние {self.dropped_lines} реплик опущены"
+            parts.append(header + ":]")
+            parts.extend(f"- {line}" for line in self.summary_lines)
+
+        return "\n".join(parts)
+
+    def render_history(self, messages: list) -> str:
+        """
+        История для промпта хода: сводка + свежие реплики дословно
+
+        Args:
+            messages: Полный список сообщений сессии
+
+        Returns:
+            Текст для слота {chat_history}
+        """
+        self.sync(messages)
+
+        recent = "\n".join(format_message(m) for m in messages[self.folded:])
+        summary = self.render_summary()
+        return f"{summary}\n\n{recent}" if summary else recent
+
+    def render_feedback_context(self, messages: list, token_budget: int = 2500) -> str:
+        """
+        Компактный контекст для промпта фидбека с жестким ограничением размера
+
+        Args:
+            messages: Полный список сообщений сессии
+            token_budget: Максимальный размер контекста в токенах
+
+        Returns:
+            Сводка и столько последних реплик, сколько влезает в бюджет
+        """
+        self.sync(messages)
+
+        summary = self.render_summary()
+        budget = token_budget - estimate_tokens(summary)
+
+        recent = []
+        for msg in reversed(messages[self.folded:]):
+            line = format_message(msg)
+            cost = estimate_tokens(line)
+            if cost > budget:
+                break
+            recent.append(line)
+            budget -= cost
+
+        recent_text = "\n".join(reversed(recent))
+        return f"{summary}\n\n{recent_text}" if summary else recent_text
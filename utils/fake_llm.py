@@ -0,0 +1,80 @@
+"""
+Локальная детерминированная LLM для бенчмарков и нагрузочных тестов (без сетевых вызовов)
+"""
+import itertools
+import os
+import threading
+import time
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# Заготовленные ответы: с быстрыми ответами, без маркеров и с завершением урока
+DEFAULT_REPLIES = (
+    "Отлично, правильно! 👍 Переходим дальше.\n\n"
+    "Сколько килограммов в $1$ тонне?\n\n"
+    '[QUICK_REPLIES: "1000" | "100" | "10" | "Не знаю"]',
+
+    "Почти! Давай проверим ещё раз: $1 \\text{ т} = 1000 \\text{ кг}$. "
+    "Умножь количество тонн на $1000$ и напиши ответ.",
+
+    "Верно! Вот конспект урока:\n\n"
+    "✅ Переведи тонны в килограммы (умножь на $1000$)\n"
+    "✅ Прибавь оставшиеся килограммы\n\n"
+    "[УРОК_ЗАВЕРШЕН]",
+)
+
+
+class FakeTutorLLM:
+    """
+    Фейковая чат-модель с настраиваемой задержкой и заготовленными ответами
+
+    Ответы выдаются по кругу; stream режет ответ на чанки по chunk_size символов.
+
+    Args:
+        replies: Заготовленные ответы (по умолчанию DEFAULT_REPLIES)
+        ttft: Задержка до первого токена, секунды
+        token_delay: Задержка между чанками, секунды
+        chunk_size: Размер чанка в символах
+    """
+
+    def __init__(self, replies=DEFAULT_REPLIES, ttft: float = 0.0, token_delay: float = 0.0, chunk_size: int = 4):
+        self.replies = tuple(replies)
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self._cycle = itertools.cycle(self.replies)
+        self._lock = threading.Lock()
+
+    def _next_reply(self) -> str:
+        with self._lock:
+            self.calls += 1
+            return next(self._cycle)
+
+    def invoke(self, prompt, **kwargs):
+        reply = self._next_reply()
+        time.sleep(self.ttft + self.token_delay * (len(reply) // self.chunk_size))
+        return AIMessage(content=reply)
+
+    def stream(self, prompt, **kwargs):
+        reply = self._next_reply()
+        if self.ttft:
+            time.sleep(self.ttft)
+        for i in range(0, len(reply), self.chunk_size):
+            if i and self.token_delay:
+                time.sleep(self.token_delay)
+            yield AIMessageChunk(content=reply[i:i + self.chunk_size])
+
+
+def fake_llm_from_env():
+    """
+    FakeTutorLLM, если включен FAKE_LLM=1 (нагрузочные тесты), иначе None
+
+    Задержки берутся из FAKE_LLM_TTFT и FAKE_LLM_TOKEN_DELAY (секунды).
+    """
+    if os.getenv("FAKE_LLM") != "1":
+        return None
+    return FakeTutorLLM(
+        ttft=float(os.getenv("FAKE_LLM_TTFT", "0")),
+        token_delay=float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0"))
+    )
@@ -1,11 +1,31 @@
 """
 Интеграция с Google Sheets для сохранения диалогов
+
+Здесь - клиенты, листы и формат строк. Запись в таблицу идет только через
+SheetsExporter: он дописывает ее из журнала диалогов по курсору.
 """
 import gspread
 from google.oauth2.service_account import Credentials
-from datetime import datetime
+from datetime import datetime, timedelta
+import hashlib
 import json
 import os
+import threading
+
+# Заголовки таблицы с диалогами
+SHEET_HEADERS = ['Session ID', 'Начало сессии', 'Дата', 'Время', 'Тема', 'Роль', 'Сообщение']
+
+# Лимит Google Sheets - 50000 символов на ячейку, оставляем запас
+MAX_CELL_LENGTH = 40000
+
+# Обновляем токен заранее, чтобы запрос не упал на истекшем токене
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Пул авторизованных клиентов и кеш листов - общие для всех сессий и перезапусков скрипта
+_client_pool = {}         # {ключ credentials: gspread.Client}
+_worksheet_cache = {}     # {(ключ credentials, sheet_url, sheet_name): gspread.Worksheet}
+_headers_checked = set()  # Листы, где заголовки уже проверены
+_pool_lock = threading.RLock()
 
 
 def get_google_sheets_client(credentials_json: str = None):
@@ -48,97 +68,189 @@ def get_google_sheets_client(credentials_json: str = None):
         return None
 
 
-def save_chat_to_sheets(
+def _credentials_key(credentials_json: str = None) -> str:
+    """Ключ пула: хеш источника credentials (файл, JSON строка или переменная окружения)"""
+    if credentials_json and os.path.isfile(credentials_json):
+        source = f"file:{os.path.abspath(credentials_json)}:{os.path.getmtime(credentials_json)}"
+    elif credentials_json:
+        source = f"json:{credentials_json}"
+    else:
+        source = f"env:{os.getenv('GOOGLE_SHEETS_CREDENTIALS', '')}"
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def _refresh_if_expiring(client):
+    """Обновляет токен клиента, если он истекает в ближайшие TOKEN_REFRESH_MARGIN"""
+    expiry = client.http_client.auth.expiry
+    if expiry is None or expiry - TOKEN_REFRESH_MARGIN <= datetime.utcnow():
+        client.http_client.login()
+
+
+def get_pooled_client(credentials_json: str = None):
+    """
+    Возвращает авторизованный клиент из пула (создает при первом обращении)
+
+    Клиент переживает перезапуски скрипта Streamlit и общий для всех пользователей;
+    токен обновляется заранее, до истечения срока.
+
+    Args:
+        credentials_json: JSON строка с credentials или путь к файлу
+
+    Returns:
+        gspread.Client или None если не удалось авторизоваться
+    """
+    key = _credentials_key(credentials_json)
+
+    with _pool_lock:
+        client = _client_pool.get(key)
+        if client is None:
+            client = get_google_sheets_client(credentials_json)
+            if client is None:
+                return None
+            _client_pool[key] = client
+
+        try:
+            _refresh_if_expiring(client)
+        except Exception as e:
+            print(f"Ошибка обновления токена Google Sheets: {e}")
+            _client_pool.pop(key, None)
+            return None
+
+    return client
+
+
+def get_cached_worksheet(sheet_url: str = None, sheet_name: str = None, credentials_json: str = None):
+    """
+    Возвращает лист из кеша (открывает таблицу и проверяет заголовки один раз на процесс)
+
+    Args:
+        sheet_url: URL Google Sheets (приоритетнее названия)
+        sheet_name: Название таблицы (по умолчанию из GOOGLE_SHEET_NAME)
+        credentials_json: JSON строка с credentials или путь к файлу
+
+    Returns:
+        gspread.Worksheet или None если не удалось авторизоваться
+    """
+    client = get_pooled_client(credentials_json)
+    if client is None:
+        return None
+
+    cache_key = (_credentials_key(credentials_json), sheet_url, sheet_name)
+
+    with _pool_lock:
+        sheet = _worksheet_cache.get(cache_key)
+        if sheet is None:
+            sheet = open_worksheet(client, sheet_url, sheet_name)
+            _worksheet_cache[cache_key] = sheet
+
+        if cache_key not in _headers_checked:
+            ensure_headers(sheet)
+            _headers_checked.add(cache_key)
+
+    return sheet
+
+
+def invalidate_on_api_error(error: Exception):
+    """
+    Сбрасывает кеш листов, если ошибка API означает устаревший handle
+
+    404 (таблицу удалили) и 403 (закрыли доступ) - открываем таблицу заново
+    при следующем сохранении; ошибки квот (429) и 5xx кеш не трогают.
+    """
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) in (403, 404):
+        reset_sheets_cache()
+
+
+def reset_sheets_cache():
+    """Сбрасывает пул клиентов и кеш листов (например, после удаления таблицы)"""
+    with _pool_lock:
+        _client_pool.clear()
+        _worksheet_cache.clear()
+        _headers_checked.clear()
+
+
+def open_worksheet(client, sheet_url: str = None, sheet_name: str = None):
+    """
+    Открывает первый лист таблицы по URL или названию
+
+    Args:
+        client: gspread.Client
+        sheet_url: URL Google Sheets (приоритетнее названия)
+        sheet_name: Название таблицы (по умолчанию из GOOGLE_SHEET_NAME)
+
+    Returns:
+        gspread.Worksheet
+    """
+    if sheet_url:
+        return client.open_by_url(sheet_url).sheet1
+    if sheet_name:
+        return client.open(sheet_name).sheet1
+
+    # Используем название из переменной окружения
+    default_sheet = os.getenv('GOOGLE_SHEET_NAME', 'Math Tutor Dialogs')
+    return client.open(default_sheet).sheet1
+
+
+def ensure_headers(sheet):
+    """Добавляет строку заголовков, если лист пустой"""
+    if sheet.row_count == 0 or not sheet.row_values(1):
+        sheet.append_row(SHEET_HEADERS)
+
+
+def fit_sheet_cell(content: str, max_length: int = MAX_CELL_LENGTH) -> str:
+    """Обрезает текст до лимита ячейки Google Sheets (полный текст остается в журнале диалогов)"""
+    if len(content) > max_length:
+        return content[:max_length] + "... (обрезано)"
+    return content
+
+
+def build_sheet_rows(
     messages: list,
-    sheet_url: str = None,
-    sheet_name: str = None,
     topic_title: str = None,
     session_id: str = None,
     session_start: str = None,
-    credentials_json: str = None
-) -> bool:
+    now: datetime = None,
+    max_length: int = MAX_CELL_LENGTH
+) -> list:
     """
-    Сохраняет диалог в Google Sheets
+    Готовит строки таблицы для сообщений диалога
 
     Args:
         messages: Список сообщений [{"role": "user"/"assistant", "content": "..."}]
-        sheet_url: URL Google Sheets (необязательно, можно использовать sheet_name)
-        sheet_name: Название таблицы (если не указан sheet_url)
         topic_title: Название темы
         session_id: Уникальный ID сессии
         session_start: Время начала сессии
-        credentials_json: JSON с credentials
+        now: Время сохранения (по умолчанию - текущее)
+        max_length: Лимит длины сообщения (None - без обрезки, для локального журнала)
 
     Returns:
-        True если успешно, False если ошибка
-
-    Структура таблицы:
-    | Session ID | Начало сессии | Дата | Время | Тема | Роль | Сообщение |
+        Список строк в порядке SHEET_HEADERS
     """
-    try:
-        # Получаем клиент
-        client = get_google_sheets_client(credentials_json)
-        if not client:
-            print("Не удалось авторизоваться в Google Sheets")
-            return False
-
-        # Открываем таблицу
-        if sheet_url:
-            sheet = client.open_by_url(sheet_url).sheet1
-        elif sheet_name:
-            sheet = client.open(sheet_name).sheet1
-        else:
-            # Используем название из переменной окружения
-            default_sheet = os.getenv('GOOGLE_SHEET_NAME', 'Math Tutor Dialogs')
-            sheet = client.open(default_sheet).sheet1
-
-        # Проверяем, есть ли заголовки
-        if sheet.row_count == 0 or not sheet.row_values(1):
-            # Добавляем заголовки
-            headers = ['Session ID', 'Начало сессии', 'Дата', 'Время', 'Тема', 'Роль', 'Сообщение']
-            sheet.append_row(headers)
-
-        # Подготавливаем данные для вставки
-        now = datetime.now()
-        date_str = now.strftime('%d.%m.%Y')
-        time_str = now.strftime('%H:%M:%S')
-
-        rows_to_add = []
-        for msg in messages:
-            role = "Ученик" if msg["role"] == "user" else "Тьютор"
-            content = msg["content"]
-
-            # Ограничиваем длину сообщения (Google Sheets имеет лимит 50000 символов на ячейку)
-            if len(content) > 40000:
-                content = content[:40000] + "... (обрезано)"
-
-            row = [
-                session_id or "-",           # Session ID
-                session_start or "-",        # Начало сессии
-                date_str,                    # Дата сообщения
-                time_str,                    # Время сообщения
-                topic_title or "-",          # Тема
-                role,                        # Роль
-                content                      # Сообщение
-            ]
-            rows_to_add.append(row)
-
-        # Добавляем все строки одним запросом (эффективнее)
-        if rows_to_add:
-            sheet.append_rows(rows_to_add)
-
-        print(f"✅ Диалог сохранен в Google Sheets ({len(rows_to_add)} сообщений)")
-        return True
-
-    except gspread.exceptions.SpreadsheetNotFound:
-        print(f"❌ Таблица не найдена. Проверьте URL или название.")
-        return False
-    except gspread.exceptions.APIError as e:
-        print(f"❌ Ошибка Google Sheets API: {e}")
-        return False
-    except Exception as e:
-        print(f"❌ Ошибка при сохранении в Google Sheets: {e}")
-        return False
+    now = now or datetime.now()
+    date_str = now.strftime('%d.%m.%Y')
+    time_str = now.strftime('%H:%M:%S')
+
+    rows = []
+    for msg in messages:
+        role = "Ученик" if msg["role"] == "user" else "Тьютор"
+        content = msg["content"]
+
+        # Ограничиваем длину сообщения (Google Sheets имеет лимит 50000 символов на ячейку)
+        if max_length is not None:
+            content = fit_sheet_cell(content, max_length)
+
+        rows.append([
+            session_id or "-",           # Session ID
+            session_start or "-",        # Начало сессии
+            date_str,                    # Дата сообщения
+            time_str,                    # Время сообщения
+            topic_title or "-",          # Тема
+            role,                        # Роль
+            content                      # Сообщение
+        ])
+
+    return rows
 
 
 def create_new_sheet(sheet_name: str, credentials_json: str = None) -> str:
@@ -153,7 +265,7 @@ def create_new_sheet(sheet_name: str, credentials_json: str = None) -> str:
         URL созданной таблицы или None
     """
     try:
-        client = get_google_sheets_client(credentials_json)
+        client = get_pooled_client(credentials_json)
         if not client:
             return None
 
@@ -162,8 +274,7 @@ def create_new_sheet(sheet_name: str, credentials_json: str = None) -> str:
 
         # Добавляем заголовки
         sheet = spreadsheet.sheet1
-        headers = ['Session ID', 'Начало сессии', 'Дата', 'Время', 'Тема', 'Роль', 'Сообщение']
-        sheet.append_row(headers)
+        sheet.append_row(SHEET_HEADERS)
 
         # Форматируем заголовки (жирный шрифт)
         sheet.format('A1:G1', {
@@ -0,0 +1,212 @@
+"""
+Движок урока Learn Mode: план → блоки объяснения → шаги финальной задачи → конспект
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from .answer_checker import AnswerVerdict, check_answer, format_mistake_reply, unit_from_question
+from .topic_models import Topic
+
+# Этапы урока
+PHASE_PLAN = "plan"
+PHASE_EXPLANATION = "explanation"
+PHASE_BOSS = "boss"
+PHASE_DONE = "done"
+
+# После стольких неудачных попыток решение разбирается и урок идет дальше
+MAX_ATTEMPTS = 3
+
+
+@dataclass
+class LessonTurn:
+    """Решение движка на один ход ученика"""
+    task: str                               # present / correct / hint / mistake / reveal / free
+    context: str = ""                       # Текст для слота {lesson}: прогресс, активный блок, задание
+    verdict: Optional[AnswerVerdict] = None
+    reply: Optional[str] = None             # Готовый ответ без вызова LLM (известная ошибка)
+    completed: bool = False                 # На этом ходе урок завершен (пора показать фидбек)
+
+    @property
+    def needs_llm(self) -> bool:
+        return self.reply is None
+
+
+class LessonEngine:
+    """
+    Явное состояние урока по схеме темы (хранится в session_state)
+
+    Проверяемые пункты - блоки explanation, затем шаги boss. Движок сам проверяет
+    ответ (answer_checker), считает попытки на каждом пункте и переходит дальше;
+    в промпт хода попадает только активный блок и короткий прогресс.
+
+    Args:
+        topic_id: ID темы
+        topic: Тема (TOPICS[topic_id])
+        max_attempts: Сколько неудачных попыток до разбора решения
+    """
+
+    def __init__(self, topic_id: str, topic: Topic, max_attempts: int = MAX_ATTEMPTS):
+        self.topic_id = topic_id
+        self.topic = topic
+        self.max_attempts = max_attempts
+
+        self.items = []  # [(этап, номер, ExplanationBlock или BossStep)]
+        for block in topic.explanation:
+            self.items.append((PHASE_EXPLANATION, block.number, block))
+        for step in (topic.boss.steps if topic.boss else ()):
+            self.items.append((PHASE_BOSS, step.step_num, step))
+
+        self.phase = PHASE_PLAN
+        self.position = 0   # Индекс текущего пункта в items
+        self.attempts = {}  # {индекс пункта: неудачных попыток}
+
+    def snapshot(self) -> dict:
+        """Состояние урока для хранилища сессий (схема темы берется из каталога при восстановлении)"""
+        return {
+            "phase": self.phase,
+            "position": self.position,
+            "attempts": {str(position): count for position, count in self.attempts.items()},
+        }
+
+    def restore(self, state: dict):
+        """Восстанавливает состояние из snapshot()"""
+        self.phase = state.get("phase", PHASE_PLAN)
+        self.position = state.get("position", 0)
+        self.attempts = {int(position): count for position, count in state.get("attempts", {}).items()}
+        # Тему могли сократить, пока сессия лежала в хранилище
+        if self.phase not in (PHASE_PLAN, PHASE_DONE):
+            self.phase = self.items[self.position][0] if self.position < len(self.items) else PHASE_DONE
+
+    @property
+    def is_finished(self) -> bool:
+        return self.phase == PHASE_DONE
+
+    @property
+    def current_item(self):
+        """(этап, номер, данные) текущего пункта или None"""
+        if self.phase in (PHASE_PLAN, PHASE_DONE):
+            return None
+        return self.items[self.position]
+
+    @property
+    def current_action(self) -> str:
+        """Вопрос текущего пункта (пустая строка, если вопроса сейчас нет)"""
+        item = self.current_item
+        return item[2].action if item else ""
+
+    def step_fingerprint(self) -> str:
+        """Отпечаток шага урока: этап, пункт и попытка (для кеша ответов)"""
+        return f"{self.phase}:{self.position}:{self.attempts.get(self.position, 0)}"
+
+    def _item_name(self, position: int) -> str:
+        phase, number, _ = self.items[position]
+        if phase == PHASE_EXPLANATION:
+            total = sum(1 for item in self.items if item[0] == PHASE_EXPLANATION)
+            return f"Блок {number} из {total}"
+        return f"Финальная задача, шаг {number}"
+
+    def describe(self) -> str:
+        """Компактный прогресс урока"""
+        if self.phase == PHASE_PLAN:
+            return "Начало урока: план показан, ученик еще не начал"
+        if self.phase == PHASE_DONE:
+            return f"Урок пройден: все {len(self.items)} пунктов решены, конспект выдан"
+        return (f"{self._item_name(self.position)}, пройдено пунктов: {self.position} из {len(self.items)}, "
+                f"неудачных попыток на текущем: {self.attempts.get(self.position, 0)}")
+
+    def _format_item(self, position: int) -> str:
+        phase, _, data = self.items[position]
+        if phase == PHASE_EXPLANATION:
+            return data.formatted
+
+        text = data.formatted
+        # Первый шаг финальной задачи начинается с ее условия
+        if position == 0 or self.items[position - 1][0] != PHASE_BOSS:
+            text = f"### ФИНАЛЬНАЯ ЗАДАЧА 🎯\n\n**[problem] Условие:**\n{self.topic.boss.problem}\n\n{text}"
+        return text
+
+    def _context(self, task: str, verdict: AnswerVerdict = None, solved: int = None) -> str:
+        parts = [f"**Урок:** {self.topic.title}", f"**Прогресс:** {self.describe()}"]
+        if verdict is not None and verdict.prompt_note():
+            parts.append(f"**Проверка ответа:** {verdict.prompt_note()}")
+        if solved is not None and self.items[solved][2].solution:
+            parts.append(f"**Решение пройденного пункта (для похвалы или разбора):**\n{self.items[solved][2].solution}")
+        if self.current_item is not None:
+            parts.append(f"**Активный блок схемы:**\n\n{self._format_item(self.position)}".rstrip())
+        parts.append(f"**Задание на этот ход:**\n{task}")
+        return "\n\n".join(parts)
+
+    def _advance(self, task: str, verdict: AnswerVerdict) -> LessonTurn:
+        """Переход к следующему пункту (или к конспекту после последнего)"""
+        solved = self.position
+        self.position += 1
+
+        if self.position >= len(self.items):
+            self.phase = PHASE_DONE
+            summary = self.topic.summary
+            task += ("\nЭто был последний пункт урока. Похвали ученика за весь урок и дай "
+                     f"шпаргалку-конспект (предложи ее сохранить):\n\n{summary}")
+            return LessonTurn("summary", self._context(task, verdict, solved), verdict, completed=True)
+
+        self.phase = self.items[self.position][0]
+        task += "\nЗатем переходи к активному блоку: изложи `info` (если есть) и задай вопрос `action`."
+        if self.phase == PHASE_BOSS and self.items[solved][0] != PHASE_BOSS:
+            task += " Это финальная задача — объяви ее и дай условие `problem`."
+        return LessonTurn("correct", self._context(task, verdict, solved), verdict)
+
+    def handle(self, text: str) -> LessonTurn:
+        """
+        Обрабатывает сообщение ученика и сдвигает состояние урока
+
+        Args:
+            text: Сообщение ученика
+
+        Returns:
+            LessonTurn: задание для LLM (context) или готовый ответ (reply)
+        """
+        if self.phase == PHASE_PLAN:
+            if not self.items:
+                self.phase = PHASE_DONE
+                return LessonTurn("free", self._context("Ответь на сообщение ученика по теме урока."))
+            self.position = 0
+            self.phase = self.items[0][0]
+            task = "Ученик готов начать. Изложи `info` активного блока и задай вопрос `action`."
+            if self.phase == PHASE_BOSS:
+                task += " Начни с условия финальной задачи `problem`."
+            return LessonTurn("present", self._context(task))
+
+        if self.phase == PHASE_DONE:
+            task = ("Урок уже пройден. Коротко ответь на сообщение ученика по теме, опираясь на конспект:\n\n"
+                    f"{self.topic.summary}")
+            return LessonTurn("free", self._context(task))
+
+        _, _, data = self.items[self.position]
+        verdict = check_answer(text, data.answer, data.mistakes, unit=unit_from_question(data.action))
+
+        if verdict.is_correct:
+            return self._advance("Ученик ответил верно. Коротко и конкретно похвали, объясни, почему ответ верный.",
+                                 verdict)
+
+        if verdict.status == "unknown":
+            # Вопрос или сомнение - не попытка: счетчик не растет, ответ не раскрывается
+            task = ("Ученик не дал ответа на вопрос (спросил что-то или не уверен). Ответь на его вопрос или "
+                    "дай наводящую подсказку по `solution`, не называя ответ, и повтори вопрос `action`.")
+            return LessonTurn("hint", self._context(task, verdict), verdict)
+
+        # Неудачная попытка - только проверенный неверный ответ (известная ошибка или просто неверный)
+        attempts = self.attempts[self.position] = self.attempts.get(self.position, 0) + 1
+
+        if attempts >= self.max_attempts:
+            return self._advance(
+                f"Ученик не справился за {attempts} попытки. Без упреков разбери решение пошагово "
+                "(здесь можно назвать правильный ответ) и подбодри.",
+                verdict
+            )
+
+        if verdict.status == "known_mistake":
+            # Подсказка из схемы - сразу, без LLM
+            return LessonTurn("mistake", verdict=verdict, reply=format_mistake_reply(verdict, self.current_action))
+
+        task = ("Ответ неверный. Не называй правильный ответ: дай наводящую подсказку по `solution` "
+                "и предложи попробовать еще раз.")
+        return LessonTurn("hint", self._context(task, verdict), verdict)
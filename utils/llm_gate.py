@@ -0,0 +1,330 @@
+"""
+Шлюз исходящих запросов к LLM: лимит одновременных запросов, token bucket
+и предохранитель (circuit breaker) на провайдера и API ключ
+"""
+import hashlib
+import threading
+import time
+from collections import deque
+
+from .llm_metrics import get_metrics_registry, render_families
+
+# Место в очереди показывается, только если запрос ждет дольше этого (короткая пауза ведра не видна)
+SHOW_QUEUE_AFTER = 0.5
+
+# Семейства метрик шлюзов и их типы
+GATE_METRIC_TYPES = {
+    'llm_gate_in_flight': 'gauge',
+    'llm_gate_queued': 'gauge',
+    'llm_gate_queued_total': 'counter',
+    'llm_gate_rejected_total': 'counter',
+    'llm_gate_queue_timeouts_total': 'counter',
+    'llm_gate_cancelled_total': 'counter',
+    'llm_gate_wait_seconds_total': 'counter',
+    'llm_gate_circuit_open': 'gauge',
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Предохранитель разомкнут: провайдер недавно падал подряд, запросы не отправляются"""
+
+
+class QueueTimeoutError(TimeoutError):
+    """Запрос не дождался своей очереди к провайдеру"""
+
+
+class RequestCancelledError(RuntimeError):
+    """Запрос отменен вызывающим, пока ждал очереди или первого токена"""
+
+
+class TokenBucket:
+    """
+    Token bucket: rate запросов в секунду в среднем, до burst подряд
+
+    Args:
+        rate: Пополнение, токенов в секунду
+        burst: Емкость ведра
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        """Сколько секунд до следующего токена (0 - токен есть)"""
+        self._refill(time.monotonic())
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._refill(time.monotonic())
+        self._tokens -= 1
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold ошибок подряд размыкается на reset_timeout секунд,
+    затем пропускает один пробный запрос (half-open) и замыкается после его успеха
+
+    Не потокобезопасен сам по себе - используется под блокировкой OutboundGate.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self._trial_in_flight = False
+
+    def blocked(self) -> bool:
+        """Запрос сейчас не пройдет (разомкнут или пробный запрос уже идет) - без захвата пробы"""
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at < self.reset_timeout
+        return self.state == self.HALF_OPEN and self._trial_in_flight
+
+    def allow(self) -> bool:
+        """Пропускает запрос; в half-open первый пропущенный становится пробным"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+        return self.state == self.CLOSED
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def cancel_trial(self):
+        """Пробный запрос отменен, не дав результата - следующий может стать пробным"""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_total += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class OutboundGate:
+    """
+    Общий на процесс шлюз к одному провайдеру с одним ключом
+
+    Запросы ждут в очереди строго по порядку прихода: голова очереди проходит,
+    когда есть свободный слот (max_concurrent) и токен в ведре (rpm). Пока запрос
+    ждет, on_wait получает его место в очереди (1 - следующий).
+
+    Args:
+        name: Имя для метрик (провайдер)
+        max_concurrent: Сколько запросов одновременно
+        rpm: Запросов в минуту (квота провайдера)
+        burst: Сколько запросов подряд без ожидания
+        failure_threshold: Ошибок подряд до размыкания предохранителя
+        reset_timeout: Сколько секунд предохранитель разомкнут
+    """
+
+    def __init__(self, name: str, max_concurrent: int = 8, rpm: float = 600, burst: int = 10,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.bucket = TokenBucket(rpm / 60.0, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.in_flight = 0
+        self.queued_total = 0      # Сколько запросов ждали в очереди
+        self.rejected = 0          # Отказано: предохранитель разомкнут
+        self.queue_timeouts = 0
+        self.cancelled = 0         # Сняты с очереди вызывающим (брошенный фидбек и т.п.)
+        self.wait_seconds = 0.0
+        self._queue = deque()      # Билеты ожидающих запросов
+        self._cond = threading.Condition()
+
+    def _can_enter(self, ticket) -> bool:
+        return self._queue[0] is ticket and self.in_flight < self.max_concurrent and self.bucket.wait_time() == 0
+
+    def try_acquire(self) -> bool:
+        """Пропуск без ожидания (для хеджа): только если очереди нет и есть слот и токен"""
+        with self._cond:
+            if self._queue or self.in_flight >= self.max_concurrent or self.bucket.wait_time() > 0:
+                return False
+            if not self.breaker.allow():
+                return False
+            self.bucket.take()
+            self.in_flight += 1
+            return True
+
+    def acquire(self, timeout: float = 120.0, on_wait=None, cancel: threading.Event = None):
+        """
+        Занимает слот, дожидаясь своей очереди
+
+        Args:
+            timeout: Сколько ждать в очереди, секунды
+            on_wait: Функция on_wait(место в очереди) - вызывается, пока запрос ждет
+            cancel: Событие отмены - установленное снимает запрос с очереди
+
+        Raises:
+            CircuitOpenError: Предохранитель разомкнут (при постановке в очередь или при допуске)
+            QueueTimeoutError: Очередь не подошла за timeout
+            RequestCancelledError: Запрос отменен, пока ждал очереди
+        """
+        ticket = object()
+        started = time.monotonic()
+        deadline = started + timeout
+        reported = None
+        waited = False
+
+        with self._cond:
+            if self.breaker.blocked():
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name}: предохранитель разомкнут после ошибок подряд")
+            self._queue.append(ticket)
+
+            try:
+                while not self._can_enter(ticket):
+                    if cancel is not None and cancel.is_set():
+                        self.cancelled += 1
+                        raise RequestCancelledError(f"{self.name}: запрос отменен в очереди")
+                    now = time.monotonic()
+                    if now >= deadline:
+                        self.queue_timeouts += 1
+                        raise QueueTimeoutError(f"{self.name}: очередь не подошла за {timeout:g} с")
+
+                    waited = True
+                    position = self._queue.index(ticket) + 1
+                    if on_wait is not None and position != reported and now - started >= SHOW_QUEUE_AFTER:
+                        reported = position
+                        self._cond.release()
+                        try:
+                            on_wait(position)
+                        finally:
+                            self._cond.acquire()
+                        continue
+
+                    if self._queue[0] is ticket and self.in_flight < self.max_concurrent:
+                        pause = self.bucket.wait_time()  # Слот свободен - ждем токен ведра
+                    else:
+                        pause = 0.5  # Разбудит release(); место в очереди проверяется раз в полсекунды
+                    self._cond.wait(max(0.001, min(pause, deadline - now)))
+
+                # Предохранитель мог разомкнуться, пока запрос ждал: проверка (и захват
+                # пробного запроса в half-open) - при допуске, а не только при постановке
+                if not self.breaker.allow():
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.name}: предохранитель разомкнулся, пока запрос ждал очереди")
+            except BaseException:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+                raise
+
+            self._queue.popleft()
+            self.bucket.take()
+            self.in_flight += 1
+            if waited:
+                self.queued_total += 1
+            self.wait_seconds += time.monotonic() - started
+            self._cond.notify_all()
+
+    def release(self, success=True):
+        """
+        Освобождает слот
+
+        Args:
+            success: True/False - итог вызова для предохранителя, None - не учитывать (отмена)
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if success is True:
+                self.breaker.record_success()
+            elif success is False:
+                self.breaker.record_failure()
+            elif self.breaker.state == CircuitBreaker.HALF_OPEN:
+                # Отмененный пробный запрос ничего не показал - пробным станет следующий
+                self.breaker.cancel_trial()
+            self._cond.notify_all()
+
+    def record_failure(self):
+        """Ошибка, замеченная снаружи (например, таймаут первого токена в роутере)"""
+        with self._cond:
+            self.breaker.record_failure()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'gate': self.name,
+                'in_flight': self.in_flight,
+                'queued': len(self._queue),
+                'queued_total': self.queued_total,
+                'rejected': self.rejected,
+                'queue_timeouts': self.queue_timeouts,
+                'cancelled': self.cancelled,
+                'wait_seconds': self.wait_seconds,
+                'circuit': self.breaker.state,
+                'circuit_opened_total': self.breaker.opened_total,
+            }
+
+
+_gates = {}
+_gates_lock = threading.Lock()
+
+
+def get_outbound_gate(provider: str, api_key: str, **settings) -> OutboundGate:
+    """
+    Общий на процесс шлюз для пары (провайдер, ключ)
+
+    Ключ в реестре хранится только как хеш. Первый вызов подключает метрики к /metrics.
+
+    Args:
+        provider: Имя провайдера
+        api_key: API ключ (квоты провайдера считаются на ключ)
+        **settings: Параметры OutboundGate для нового шлюза
+    """
+    key = (provider, hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:12])
+    with _gates_lock:
+        if not _gates:
+            get_metrics_registry().add_collector(render_gate_metrics)
+        if key not in _gates:
+            _gates[key] = OutboundGate(f"{provider}/{key[1][:6]}", **settings)
+        return _gates[key]
+
+
+def render_gate_metrics() -> list:
+    """Строки метрик шлюзов в формате Prometheus (семейства выводятся подряд)"""
+    with _gates_lock:
+        gates = list(_gates.values())
+
+    samples = {name: [] for name in GATE_METRIC_TYPES}
+    for gate in gates:
+        stats = gate.stats()
+        label = 'gate="{}"'.format(stats['gate'].replace('"', '\\"'))
+        samples['llm_gate_in_flight'].append(f"llm_gate_in_flight{{{label}}} {stats['in_flight']}")
+        samples['llm_gate_queued'].append(f"llm_gate_queued{{{label}}} {stats['queued']}")
+        samples['llm_gate_queued_total'].append(f"llm_gate_queued_total{{{label}}} {stats['queued_total']}")
+        samples['llm_gate_rejected_total'].append(f"llm_gate_rejected_total{{{label}}} {stats['rejected']}")
+        samples['llm_gate_queue_timeouts_total'].append(
+            f"llm_gate_queue_timeouts_total{{{label}}} {stats['queue_timeouts']}"
+        )
+        samples['llm_gate_cancelled_total'].append(f"llm_gate_cancelled_total{{{label}}} {stats['cancelled']}")
+        samples['llm_gate_wait_seconds_total'].append(
+            f"llm_gate_wait_seconds_total{{{label}}} {stats['wait_seconds']:.6f}"
+        )
+        samples['llm_gate_circuit_open'].append(
+            f"llm_gate_circuit_open{{{label}}} {int(stats['circuit'] != CircuitBreaker.CLOSED)}"
+        )
+    return render_families(GATE_METRIC_TYPES, samples)
@@ -0,0 +1,353 @@
+"""
+Метрики вызовов LLM: размер промпта и ответа, время до первого токена, задержка, ошибки
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .conversation_memory import CHARS_PER_TOKEN, estimate_tokens
+
+# Границы гистограммы задержек (секунды)
+LATENCY_BUCKETS = (0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+# Метки, по которым агрегируются метрики
+METRIC_LABELS = ('call', 'mode', 'grade', 'topic_id', 'model')
+
+# Семейства метрик вызовов LLM и их типы (в порядке вывода)
+METRIC_TYPES = {
+    'llm_calls_total': 'counter',
+    'llm_errors_total': 'counter',
+    'llm_cancelled_total': 'counter',
+    'llm_prompt_tokens_total': 'counter',
+    'llm_completion_tokens_total': 'counter',
+    'llm_prompt_chars_max': 'gauge',
+    'llm_ttft_seconds': 'summary',
+    'llm_latency_seconds': 'histogram',
+}
+
+
+def render_families(types: dict, samples: dict) -> list:
+    """
+    Строки в формате Prometheus: у каждого семейства строка # TYPE и сразу все его сэмплы
+
+    Args:
+        types: {семейство: тип} в порядке вывода
+        samples: {семейство: [строки сэмплов]} (у гистограммы и summary - вместе с _bucket/_sum/_count)
+    """
+    lines = []
+    for name, kind in types.items():
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples.get(name, ()))
+    return lines
+
+
+def prompt_text(prompt) -> str:
+    """Текст промпта: строка или список сообщений LangChain"""
+    if isinstance(prompt, str):
+        return prompt
+    return "".join(getattr(msg, 'content', str(msg)) for msg in prompt)
+
+
+@dataclass
+class LLMCallRecord:
+    """Один вызов LLM"""
+    call: str                 # greeting / tutor / learn / feedback
+    mode: str = "-"
+    grade: str = "-"
+    topic_id: str = "-"
+    model: str = "-"          # model_choice
+    prompt_chars: int = 0
+    prompt_tokens: int = 0
+    completion_chars: int = 0
+    completion_tokens: int = 0
+    ttft: float = None        # Время до первого токена (только для потока)
+    latency: float = 0.0
+    error: str = None
+    cancelled: bool = False   # Поток закрыли до конца ответа (ученик ушел, запрос отменен)
+    streamed: bool = False
+    timestamp: float = field(default_factory=time.time)
+
+    def labels(self) -> tuple:
+        return tuple(str(getattr(self, name) or "-") for name in METRIC_LABELS)
+
+
+class _Aggregate:
+    """Накопленные значения для одного набора меток"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.latency_sum = 0.0
+        self.ttft_sum = 0.0
+        self.ttft_count = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.prompt_chars_max = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса
+
+    Хранит агрегаты по меткам (для Prometheus) и последние записи (для отладки);
+    если задан jsonl_path, каждая запись дописывается строкой в JSONL файл. Файл
+    пишется вне общей блокировки: строки копятся в буфере, и тот поток, который
+    сейчас пишет, забирает их пачкой - запись метрики не ждет чужой записи на диск.
+    """
+
+    def __init__(self, jsonl_path: str = None, keep_last: int = 1000):
+        self.jsonl_path = jsonl_path
+        self.records = deque(maxlen=keep_last)
+        self._aggregates = {}
+        self._collectors = []  # Дополнительные источники строк метрик (например, кеш ответов)
+        self._pending = []     # Строки JSONL, еще не записанные в файл
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def add_collector(self, collector):
+        """Подключает функцию без аргументов, которая возвращает строки метрик Prometheus"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def record(self, rec: LLMCallRecord):
+        """Добавляет запись о вызове"""
+        with self._lock:
+            self.records.append(rec)
+
+            agg = self._aggregates.get(rec.labels())
+            if agg is None:
+                agg = self._aggregates[rec.labels()] = _Aggregate()
+
+            agg.calls += 1
+            agg.errors += 1 if rec.error else 0
+            agg.cancelled += 1 if rec.cancelled else 0
+            agg.latency_sum += rec.latency
+            if rec.ttft is not None:
+                agg.ttft_sum += rec.ttft
+                agg.ttft_count += 1
+            agg.prompt_tokens += rec.prompt_tokens
+            agg.completion_tokens += rec.completion_tokens
+            agg.prompt_chars_max = max(agg.prompt_chars_max, rec.prompt_chars)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if rec.latency <= bound:
+                    agg.buckets[i] += 1
+
+            if self.jsonl_path:
+                self._pending.append(json.dumps(asdict(rec), ensure_ascii=False) + "\n")
+
+        if self.jsonl_path:
+            self._write_pending()
+
+    def _write_pending(self):
+        """Дописывает буфер в JSONL; если файл уже пишет другой поток, строки заберет он"""
+        while self._write_lock.acquire(blocking=False):
+            try:
+                with self._lock:
+                    lines, self._pending = self._pending, []
+                if lines:
+                    try:
+                        with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                            f.write("".join(lines))
+                    except OSError as e:
+                        print(f"Ошибка записи метрик в {self.jsonl_path}: {e}")
+            finally:
+                self._write_lock.release()
+            with self._lock:
+                if not self._pending:
+                    return
+
+    def snapshot(self) -> list:
+        """Агрегаты в виде списка словарей (для отладки и отчетов)"""
+        with self._lock:
+            result = []
+            for labels, agg in self._aggregates.items():
+                result.append({
+                    **dict(zip(METRIC_LABELS, labels)),
+                    'calls': agg.calls,
+                    'errors': agg.errors,
+                    'cancelled': agg.cancelled,
+                    'avg_latency': agg.latency_sum / agg.calls,
+                    'avg_ttft': agg.ttft_sum / agg.ttft_count if agg.ttft_count else None,
+                    'prompt_tokens': agg.prompt_tokens,
+                    'completion_tokens': agg.completion_tokens,
+                    'max_prompt_chars': agg.prompt_chars_max
+                })
+            return result
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        samples = {name: [] for name in METRIC_TYPES}
+
+        with self._lock:
+            for labels, agg in self._aggregates.items():
+                label_str = ",".join(
+                    f'{name}="{_escape_label(value)}"' for name, value in zip(METRIC_LABELS, labels)
+                )
+                samples['llm_calls_total'].append(f"llm_calls_total{{{label_str}}} {agg.calls}")
+                samples['llm_errors_total'].append(f"llm_errors_total{{{label_str}}} {agg.errors}")
+                samples['llm_cancelled_total'].append(f"llm_cancelled_total{{{label_str}}} {agg.cancelled}")
+                samples['llm_prompt_tokens_total'].append(f"llm_prompt_tokens_total{{{label_str}}} {agg.prompt_tokens}")
+                samples['llm_completion_tokens_total'].append(
+                    f"llm_completion_tokens_total{{{label_str}}} {agg.completion_tokens}"
+                )
+                samples['llm_prompt_chars_max'].append(f"llm_prompt_chars_max{{{label_str}}} {agg.prompt_chars_max}")
+                samples['llm_ttft_seconds'] += [
+                    f"llm_ttft_seconds_sum{{{label_str}}} {agg.ttft_sum:.6f}",
+                    f"llm_ttft_seconds_count{{{label_str}}} {agg.ttft_count}",
+                ]
+                latency = samples['llm_latency_seconds']
+                for bound, count in zip(LATENCY_BUCKETS, agg.buckets):
+                    latency.append(f'llm_latency_seconds_bucket{{{label_str},le="{bound}"}} {count}')
+                latency.append(f'llm_latency_seconds_bucket{{{label_str},le="+Inf"}} {agg.calls}')
+                latency.append(f"llm_latency_seconds_sum{{{label_str}}} {agg.latency_sum:.6f}")
+                latency.append(f"llm_latency_seconds_count{{{label_str}}} {agg.calls}")
+            collectors = list(self._collectors)
+
+        lines = render_families(METRIC_TYPES, samples)
+
+        for collector in collectors:
+            lines.extend(collector())
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _usage_tokens(message, key: str):
+    """Количество токенов из метаданных ответа, если провайдер их вернул"""
+    usage = getattr(message, 'usage_metadata', None) or {}
+    if key in usage:
+        return usage[key]
+    token_usage = (getattr(message, 'response_metadata', None) or {}).get('token_usage') or {}
+    return token_usage.get(key.replace('input', 'prompt').replace('output', 'completion'))
+
+
+class InstrumentedLLM:
+    """
+    Обертка над LLM из init_bot/init_tutor, которая замеряет каждый вызов
+
+    Поддерживает invoke и stream; метки вызова передаются в metrics_tags
+    (call, mode, grade, topic_id). Остальные атрибуты проксируются в исходную LLM.
+    """
+
+    def __init__(self, llm, model: str, registry: MetricsRegistry = None):
+        self.llm = llm
+        self.model = model
+        self.registry = registry or get_metrics_registry()
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def _new_record(self, prompt, metrics_tags: dict, streamed: bool) -> LLMCallRecord:
+        text = prompt_text(prompt)
+        tags = dict(metrics_tags or {})
+        return LLMCallRecord(
+            call=tags.pop('call', 'unknown'),
+            model=self.model,
+            prompt_chars=len(text),
+            prompt_tokens=estimate_tokens(text),
+            streamed=streamed,
+            **tags
+        )
+
+    def invoke(self, prompt, metrics_tags: dict = None, **kwargs):
+        rec = self._new_record(prompt, metrics_tags, streamed=False)
+        started = time.perf_counter()
+        try:
+            response = self.llm.invoke(prompt, **kwargs)
+        except Exception as e:
+            rec.error = type(e).__name__
+            raise
+        finally:
+            rec.latency = time.perf_counter() - started
+            if rec.error:
+                self.registry.record(rec)
+
+        content = response.content if hasattr(response, 'content') else str(response)
+        rec.completion_chars = len(content)
+        rec.completion_tokens = _usage_tokens(response, 'output_tokens') or estimate_tokens(content)
+        rec.prompt_tokens = _usage_tokens(response, 'input_tokens') or rec.prompt_tokens
+        self.registry.record(rec)
+        return response
+
+    def stream(self, prompt, metrics_tags: dict = None, **kwargs):
+        rec = self._new_record(prompt, metrics_tags, streamed=True)
+        started = time.perf_counter()
+        completion_chars = 0
+        try:
+            for chunk in self.llm.stream(prompt, **kwargs):
+                content = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if content and rec.ttft is None:
+                    rec.ttft = time.perf_counter() - started
+                completion_chars += len(content)
+                yield chunk
+        except GeneratorExit:
+            # Поток закрыли до конца ответа (ученик ушел со страницы, запрос отменили) - это не ошибка
+            rec.cancelled = True
+            raise
+        except BaseException as e:
+            rec.error = type(e).__name__
+            raise
+        finally:
+            rec.latency = time.perf_counter() - started
+            rec.completion_chars = completion_chars
+            rec.completion_tokens = completion_chars // CHARS_PER_TOKEN + 1 if completion_chars else 0
+            self.registry.record(rec)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Возвращает общий для процесса реестр метрик
+
+    Путь к JSONL файлу берется из переменной окружения LLM_METRICS_JSONL (необязательно).
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry(jsonl_path=os.getenv('LLM_METRICS_JSONL') or None)
+        return _registry
+
+
+def start_metrics_server(port: int, registry: MetricsRegistry = None) -> ThreadingHTTPServer:
+    """
+    Запускает HTTP endpoint /metrics в фоновом потоке (формат Prometheus)
+
+    Args:
+        port: Порт для endpoint
+        registry: Реестр метрик (по умолчанию общий)
+
+    Returns:
+        Запущенный сервер
+    """
+    registry = registry or get_metrics_registry()
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="llm-metrics", daemon=True).start()
+    return server
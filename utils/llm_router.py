@@ -0,0 +1,464 @@
+"""
+Маршрутизатор вызовов LLM: таймауты провайдеров, повторы с джиттером,
+переключение на запасного провайдера и хеджированные запросы
+"""
+import os
+import queue
+import random
+import statistics
+import threading
+import time
+from collections import deque
+
+from .llm_gate import CircuitOpenError, QueueTimeoutError, RequestCancelledError
+from .llm_metrics import get_metrics_registry, render_families
+
+# После стольких ошибок подряд провайдер считается нездоровым и идет в конец очереди
+UNHEALTHY_AFTER = 3
+
+# Как часто гонка за первым токеном проверяет отмену запроса, секунды
+CANCEL_POLL = 0.25
+
+# Семейства метрик провайдеров и их типы
+PROVIDER_METRIC_TYPES = {
+    'llm_provider_calls_total': 'counter',
+    'llm_provider_errors_total': 'counter',
+    'llm_provider_timeouts_total': 'counter',
+    'llm_provider_hedges_total': 'counter',
+    'llm_provider_hedge_wins_total': 'counter',
+    'llm_provider_consecutive_failures': 'gauge',
+    'llm_provider_ttft_p95_seconds': 'gauge',
+}
+
+
+class ProviderTimeoutError(TimeoutError):
+    """Провайдер не прислал ответ (первый или очередной чанк) за отведенное время"""
+
+
+class AllProvidersFailedError(RuntimeError):
+    """Ни один провайдер не ответил за все попытки"""
+
+    def __init__(self, errors: list):
+        self.errors = errors  # [(провайдер, исключение)]
+        details = "; ".join(f"{name}: {type(e).__name__}: {e}" for name, e in errors) or "нет провайдеров"
+        super().__init__(f"Все провайдеры LLM недоступны ({details})")
+
+
+class ProviderHealth:
+    """
+    Здоровье и задержки одного провайдера (общие на процесс)
+
+    Args:
+        name: Имя провайдера (model_choice)
+        window: Сколько последних значений времени до первого токена хранить
+    """
+
+    def __init__(self, name: str, window: int = 200):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.hedges = 0          # Сколько раз провайдер запускался как хедж
+        self.hedge_wins = 0      # ...и ответил раньше основного
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_failure_at = 0.0
+        self._ttfts = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_success(self, ttft: float):
+        with self._lock:
+            self.calls += 1
+            self.consecutive_failures = 0
+            self._ttfts.append(ttft)
+
+    def record_failure(self, error: BaseException):
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            if isinstance(error, ProviderTimeoutError):
+                self.timeouts += 1
+            self.consecutive_failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            self.last_failure_at = time.time()
+
+    def record_hedge(self, won: bool = False):
+        with self._lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedges += 1
+
+    def ttft_quantile(self, q: int = 95, min_samples: int = 20):
+        """Перцентиль времени до первого токена или None, если замеров мало"""
+        with self._lock:
+            samples = list(self._ttfts)
+        if len(samples) < min_samples:
+            return None
+        return statistics.quantiles(samples, n=100, method='inclusive')[q - 1]
+
+    def is_healthy(self, cooldown: float) -> bool:
+        """Нездоров после UNHEALTHY_AFTER ошибок подряд, пока не пройдет cooldown секунд"""
+        with self._lock:
+            return (self.consecutive_failures < UNHEALTHY_AFTER
+                    or time.time() - self.last_failure_at > cooldown)
+
+    def snapshot(self) -> dict:
+        p50, p95 = self.ttft_quantile(50, 2), self.ttft_quantile(95, 2)
+        with self._lock:
+            return {
+                'provider': self.name,
+                'calls': self.calls,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'consecutive_failures': self.consecutive_failures,
+                'last_error': self.last_error,
+                'ttft_p50': p50,
+                'ttft_p95': p95,
+            }
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def get_provider_health(name: str) -> ProviderHealth:
+    """Общая на процесс статистика провайдера (первый вызов подключает метрики к /metrics)"""
+    with _health_lock:
+        if not _health:
+            get_metrics_registry().add_collector(render_provider_health)
+        if name not in _health:
+            _health[name] = ProviderHealth(name)
+        return _health[name]
+
+
+def provider_health_stats() -> list:
+    """Статистика всех провайдеров (для отладки и отчетов)"""
+    with _health_lock:
+        providers = list(_health.values())
+    return [health.snapshot() for health in providers]
+
+
+def render_provider_health() -> list:
+    """Строки метрик провайдеров в формате Prometheus (семейства выводятся подряд)"""
+    samples = {name: [] for name in PROVIDER_METRIC_TYPES}
+    for stats in provider_health_stats():
+        label = 'provider="{}"'.format(stats['provider'].replace('"', '\\"'))
+        samples['llm_provider_calls_total'].append(f"llm_provider_calls_total{{{label}}} {stats['calls']}")
+        samples['llm_provider_errors_total'].append(f"llm_provider_errors_total{{{label}}} {stats['errors']}")
+        samples['llm_provider_timeouts_total'].append(f"llm_provider_timeouts_total{{{label}}} {stats['timeouts']}")
+        samples['llm_provider_hedges_total'].append(f"llm_provider_hedges_total{{{label}}} {stats['hedges']}")
+        samples['llm_provider_hedge_wins_total'].append(
+            f"llm_provider_hedge_wins_total{{{label}}} {stats['hedge_wins']}"
+        )
+        samples['llm_provider_consecutive_failures'].append(
+            f"llm_provider_consecutive_failures{{{label}}} {stats['consecutive_failures']}"
+        )
+        if stats['ttft_p95'] is not None:
+            samples['llm_provider_ttft_p95_seconds'].append(
+                f"llm_provider_ttft_p95_seconds{{{label}}} {stats['ttft_p95']:.6f}"
+            )
+    return render_families(PROVIDER_METRIC_TYPES, samples)
+
+
+class LLMProvider:
+    """
+    Провайдер для LLMRouter
+
+    Args:
+        name: Имя провайдера (model_choice)
+        llm: LLM с invoke/stream (обычно InstrumentedLLM)
+        timeout: Сколько ждать первый токен (и каждый следующий чанк), секунды
+        gate: Шлюз исходящих запросов (OutboundGate) - очередь, лимиты, предохранитель
+    """
+
+    def __init__(self, name: str, llm, timeout: float = 20.0, gate=None):
+        self.name = name
+        self.llm = llm
+        self.timeout = timeout
+        self.gate = gate
+        self.health = get_provider_health(name)
+
+
+class _Attempt:
+    """Один запрос к провайдеру в фоновом потоке; события кладутся в общую очередь гонки"""
+
+    def __init__(self, provider: LLMProvider, method: str, prompt, kwargs: dict, events: queue.Queue):
+        self.provider = provider
+        self.events = events
+        self.cancelled = threading.Event()
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(
+            target=self._run, args=(method, prompt, kwargs), name=f"llm-{provider.name}", daemon=True
+        )
+        self.thread.start()
+
+    @property
+    def deadline(self) -> float:
+        return self.started + self.provider.timeout
+
+    def _release(self, success):
+        if self.provider.gate is not None:
+            # Отмененная попытка (проиграла хедж, брошена по таймауту) не влияет на предохранитель
+            self.provider.gate.release(None if self.cancelled.is_set() else success)
+
+    def _run(self, method: str, prompt, kwargs: dict):
+        if self.cancelled.is_set():
+            # Отменили до отправки (хедж или гонка уже не нужны) - провайдер не вызывается
+            self._release(None)
+            return
+        response = None
+        try:
+            if method == "invoke":
+                response = self.provider.llm.invoke(prompt, **kwargs)
+            else:
+                stream = self.provider.llm.stream(prompt, **kwargs)
+                try:
+                    for chunk in stream:
+                        if self.cancelled.is_set():
+                            break
+                        self.events.put((self, "chunk", chunk))
+                finally:
+                    # Отмену видно только на следующем чанке: тогда поток закрывается,
+                    # и провайдер, потеряв соединение, перестает генерировать
+                    close = getattr(stream, 'close', None)
+                    if close is not None:
+                        close()
+        except Exception as e:
+            self._release(False)
+            self.events.put((self, "error", e))
+            return
+        # Слот освобождается до сигнала "done", чтобы успех успел замкнуть предохранитель
+        self._release(True)
+        if response is not None:
+            self.events.put((self, "chunk", response))
+        self.events.put((self, "done", None))
+
+
+class LLMRouter:
+    """
+    LLM поверх нескольких провайдеров с тем же интерфейсом invoke/stream
+
+    Провайдеры перебираются по порядку (нездоровые - в конце). Провайдер, который
+    ошибся или не прислал первый токен за свой timeout, заменяется следующим; когда
+    провайдеры кончились, круг повторяется после паузы с экспоненциальным ростом
+    и случайным джиттером (retries повторов). После первого чанка ответа
+    переключение невозможно - ошибка потока передается вызывающему.
+
+    С hedge=True, если основной провайдер молчит дольше своего p95 времени до
+    первого токена (hedge_delay, пока замеров мало), параллельно запускается
+    следующий провайдер; берется ответ того, кто начал отвечать первым.
+
+    Если у провайдера есть шлюз (gate), запрос сначала ждет в его очереди в
+    вызывающем потоке: stream/invoke принимают on_queue(место в очереди), чтобы
+    показать ученику очередь. Разомкнутый предохранитель - сразу следующий провайдер.
+    Событие cancel (threading.Event) снимает запрос с очереди: отмененный до
+    допуска запрос провайдеру не отправляется. Уже отправленный запрос прервать
+    посреди ожидания нельзя - интерфейс invoke/stream этого не дает: роутер сразу
+    отвечает RequestCancelledError, а поток попытки закрывает stream на следующем
+    чанке (соединение рвется, и провайдер дальше не генерирует). invoke отработает
+    до конца, его токены тратятся.
+
+    Args:
+        providers: Список LLMProvider, первый - основной
+        retries: Сколько повторных кругов по провайдерам
+        backoff: Базовая пауза перед повтором, секунды
+        max_backoff: Максимальная пауза, секунды
+        hedge: Включить хеджированные запросы
+        hedge_delay: Задержка хеджа, пока у провайдера нет p95, секунды
+        cooldown: Сколько секунд нездоровый провайдер стоит в конце очереди
+        queue_timeout: Сколько ждать в очереди шлюза, секунды
+    """
+
+    def __init__(self, providers: list, retries: int = 1, backoff: float = 0.5, max_backoff: float = 4.0,
+                 hedge: bool = False, hedge_delay: float = 3.0, cooldown: float = 30.0,
+                 queue_timeout: float = 120.0):
+        if not providers:
+            raise ValueError("Нужен хотя бы один провайдер LLM")
+        self.providers = list(providers)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.cooldown = cooldown
+        self.queue_timeout = queue_timeout
+
+    def __getattr__(self, name):
+        return getattr(self.providers[0].llm, name)
+
+    def _ordered(self) -> list:
+        healthy = [p for p in self.providers if p.health.is_healthy(self.cooldown)]
+        return healthy + [p for p in self.providers if p not in healthy]
+
+    def _hedge_after(self, provider: LLMProvider) -> float:
+        p95 = provider.health.ttft_quantile(95)
+        return min(p95 if p95 is not None else self.hedge_delay, provider.timeout)
+
+    def _sleep_before_retry(self, round_number: int):
+        delay = min(self.max_backoff, self.backoff * 2 ** (round_number - 1))
+        time.sleep(delay * random.uniform(0.5, 1.5))
+
+    def _admit(self, pending: list, errors: list, on_queue, cancel=None):
+        """Первый провайдер из pending, который пропустил шлюз (ожидание очереди - здесь), или None"""
+        while pending:
+            provider = pending.pop(0)
+            if provider.gate is None:
+                return provider
+            try:
+                provider.gate.acquire(self.queue_timeout, on_wait=on_queue, cancel=cancel)
+            except (CircuitOpenError, QueueTimeoutError) as e:
+                errors.append((provider.name, e))
+                continue
+            if cancel is not None and cancel.is_set():
+                # Отменили, пока подходила очередь - слот возвращается, запрос не отправляется
+                provider.gate.release(None)
+                raise RequestCancelledError(f"{provider.name}: запрос отменен до отправки")
+            return provider
+        return None
+
+    def _race(self, method: str, prompt, kwargs: dict, pending: list, errors: list, on_queue=None, cancel=None):
+        """
+        Ждет первый чанк от провайдеров из pending (с хеджем - от двух сразу)
+
+        Returns:
+            (попытка-победитель, первый чанк, очередь событий) или None, если все упали
+        """
+        provider = self._admit(pending, errors, on_queue, cancel)
+        if provider is None:
+            return None
+
+        events = queue.Queue()
+        running = [_Attempt(provider, method, prompt, kwargs, events)]
+        hedge_at = running[0].started + self._hedge_after(running[0].provider) if self.hedge else None
+        hedge = None
+
+        while running:
+            if cancel is not None and cancel.is_set():
+                for attempt in running:
+                    attempt.cancelled.set()
+                raise RequestCancelledError("запрос отменен до первого токена")
+
+            wake_at = min(attempt.deadline for attempt in running)
+            if hedge_at is not None and pending:
+                wake_at = min(wake_at, hedge_at)
+            if cancel is not None:
+                wake_at = min(wake_at, time.perf_counter() + CANCEL_POLL)
+
+            try:
+                attempt, kind, payload = events.get(timeout=max(0.0, wake_at - time.perf_counter()))
+            except queue.Empty:
+                now = time.perf_counter()
+                for attempt in [a for a in running if now >= a.deadline]:
+                    attempt.cancelled.set()
+                    running.remove(attempt)
+                    error = ProviderTimeoutError(f"нет ответа за {attempt.provider.timeout:g} с")
+                    attempt.provider.health.record_failure(error)
+                    if attempt.provider.gate is not None:
+                        attempt.provider.gate.record_failure()
+                    errors.append((attempt.provider.name, error))
+                if hedge_at is not None and pending and running and now >= hedge_at:
+                    hedge_at = None
+                    # Хедж не ждет в очереди: если у запасного провайдера нет свободного слота - без хеджа
+                    if pending[0].gate is None or pending[0].gate.try_acquire():
+                        hedge = _Attempt(pending.pop(0), method, prompt, kwargs, events)
+                        hedge.provider.health.record_hedge()
+                        running.append(hedge)
+                continue
+
+            if attempt not in running:
+                continue  # Событие от уже отброшенной попытки
+
+            if kind == "error":
+                running.remove(attempt)
+                attempt.provider.health.record_failure(payload)
+                errors.append((attempt.provider.name, payload))
+                continue
+
+            # Первый чанк (или пустой ответ): попытка победила, остальные отменяются
+            attempt.provider.health.record_success(time.perf_counter() - attempt.started)
+            if attempt is hedge:
+                attempt.provider.health.record_hedge(won=True)
+            for other in running:
+                if other is not attempt:
+                    other.cancelled.set()
+            return attempt, (payload if kind == "chunk" else None), events
+
+        return None
+
+    def _run(self, method: str, prompt, kwargs: dict):
+        on_queue = kwargs.pop('on_queue', None)
+        cancel = kwargs.pop('cancel', None)
+        errors = []
+        for round_number in range(self.retries + 1):
+            if round_number:
+                self._sleep_before_retry(round_number)
+                if cancel is not None and cancel.is_set():
+                    raise RequestCancelledError("запрос отменен перед повтором")
+
+            pending = self._ordered()
+            while pending:
+                raced = self._race(method, prompt, kwargs, pending, errors, on_queue, cancel)
+                if raced is None:
+                    continue
+
+                winner, first, events = raced
+                try:
+                    if first is None:
+                        return
+                    yield first
+
+                    # Остаток ответа - только от победителя
+                    while True:
+                        try:
+                            attempt, kind, payload = events.get(timeout=winner.provider.timeout)
+                        except queue.Empty:
+                            error = ProviderTimeoutError(f"поток прервался на {winner.provider.timeout:g} с")
+                            winner.provider.health.record_failure(error)
+                            raise error
+                        if attempt is not winner:
+                            continue
+                        if kind == "done":
+                            return
+                        if kind == "error":
+                            winner.provider.health.record_failure(payload)
+                            raise payload
+                        yield payload
+                finally:
+                    winner.cancelled.set()
+
+        raise AllProvidersFailedError(errors)
+
+    def invoke(self, prompt, **kwargs):
+        for response in self._run("invoke", prompt, kwargs):
+            return response
+        raise AllProvidersFailedError([])
+
+    def stream(self, prompt, **kwargs):
+        yield from self._run("stream", prompt, kwargs)
+
+    def stats(self) -> list:
+        """Здоровье и задержки провайдеров этого роутера"""
+        return [provider.health.snapshot() for provider in self.providers]
+
+
+def create_llm_router(providers: list) -> LLMRouter:
+    """
+    LLMRouter с настройками из окружения
+
+    LLM_RETRIES (повторных кругов, 1), LLM_BACKOFF (базовая пауза, 0.5 с),
+    LLM_HEDGE=1 (хеджированные запросы), LLM_HEDGE_DELAY (задержка хеджа
+    до накопления p95, 3 с), LLM_UNHEALTHY_COOLDOWN (30 с), LLM_QUEUE_TIMEOUT
+    (ожидание в очереди шлюза, 120 с).
+    """
+    return LLMRouter(
+        providers,
+        retries=int(os.getenv('LLM_RETRIES', "1")),
+        backoff=float(os.getenv('LLM_BACKOFF', "0.5")),
+        hedge=os.getenv('LLM_HEDGE') == "1",
+        hedge_delay=float(os.getenv('LLM_HEDGE_DELAY', "3")),
+        cooldown=float(os.getenv('LLM_UNHEALTHY_COOLDOWN', "30")),
+        queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT', "120")),
+    )
@@ -0,0 +1,225 @@
+"""
+Фоновые вызовы LLM: запрос идет в пуле потоков, скрипт Streamlit читает ответ из handle
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .llm_gate import RequestCancelledError
+from .llm_metrics import get_metrics_registry
+
+
+class LLMTask:
+    """
+    Handle одного фонового вызова LLM - хранится в st.session_state
+
+    Текст копится по мере генерации. Если перезапуск скрипта прервал вывод, вызов
+    не теряется: следующий прогон найдет handle в session_state и дочитает ответ.
+
+    Статусы: "pending" (идет), "done" (готово), "failed" (ошибка), "cancelled" (отменено)
+    """
+
+    def __init__(self, call: str):
+        self.call = call
+        self.status = "pending"
+        self.error = None
+        self.queue_position = None  # Место в очереди к провайдеру, пока запрос ждет шлюз
+        self.submitted_at = time.time()
+        self.first_chunk_at = None
+        self.finished_at = None
+        self._chunks = []
+        self._cancelled = threading.Event()
+        self._cond = threading.Condition()
+
+    @property
+    def text(self) -> str:
+        """Полученный на данный момент «сырой» ответ (вместе с маркерами)"""
+        with self._cond:
+            return "".join(self._chunks)
+
+    @property
+    def is_pending(self) -> bool:
+        return self.status == "pending"
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Отменяет задачу: запрос снимается с очереди к провайдеру, а начатый поток закрывается
+
+        Нужна для спекулятивных вызовов (фидбек урока), ставших ненужными. Запрос, отмененный
+        в очереди, не отправляется; уже отправленный поток закрывается на следующем чанке.
+        """
+        self._cancelled.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Ждет завершения задачи (для скриптов и тестов)"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.status != "pending", timeout)
+
+    def iter_text(self, on_idle=None, poll: float = 0.25):
+        """
+        Отдает фрагменты ответа по мере поступления (с начала, даже если задача уже завершена)
+
+        Args:
+            on_idle: Функция без аргументов - вызывается каждые poll секунд без новых фрагментов
+            poll: Интервал проверки, секунды
+
+        Raises:
+            Исключение вызова LLM, если задача завершилась ошибкой
+        """
+        sent = 0
+        while True:
+            with self._cond:
+                if sent == len(self._chunks) and self.status == "pending":
+                    self._cond.wait(poll)
+                new = self._chunks[sent:]
+                status = self.status
+            sent += len(new)
+
+            yield from new
+            if not new:
+                if status != "pending":
+                    break
+                if on_idle is not None:
+                    on_idle()
+
+        if status == "failed":
+            raise self.error
+
+    def _set_queue_position(self, position: int):
+        self.queue_position = position
+
+    def _append(self, piece: str):
+        with self._cond:
+            if self.first_chunk_at is None:
+                self.first_chunk_at = time.time()
+            self._chunks.append(piece)
+            self._cond.notify_all()
+
+    def _finish(self, status: str, error: Exception = None):
+        with self._cond:
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+
+class LLMTaskRunner:
+    """
+    Пул потоков для вызовов LLM вне потока скрипта
+
+    Рабочий поток читает llm.stream(...) и складывает фрагменты в LLMTask. Очередь,
+    лимиты и переключение провайдеров остаются за LLMRouter и OutboundGate - пул
+    только не дает сетевому ожиданию занимать поток скрипта.
+
+    Args:
+        max_workers: Сколько вызовов выполняется одновременно (остальные ждут в пуле)
+    """
+
+    def __init__(self, max_workers: int = 64):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-task")
+        self._lock = threading.Lock()
+
+        self.running = 0
+        self.submitted = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def submit(self, llm, prompt, call: str = "llm", **kwargs) -> LLMTask:
+        """
+        Запускает llm.stream(prompt, **kwargs) в фоне и сразу возвращает handle
+
+        Args:
+            llm: LLM из init_bot/init_tutor
+            prompt: Полный промпт
+            call: Тип вызова (greeting, tutor, learn, feedback)
+            **kwargs: Параметры stream (metrics_tags, cache_key)
+
+        Returns:
+            LLMTask для вывода ответа и опроса статуса
+        """
+        task = LLMTask(call)
+        with self._lock:
+            self.submitted += 1
+        self._executor.submit(self._run, task, llm, prompt, kwargs)
+        return task
+
+    def _run(self, task: LLMTask, llm, prompt, kwargs: dict):
+        if task.cancelled:
+            self._finish(task, "cancelled")
+            return
+
+        with self._lock:
+            self.running += 1
+        try:
+            # cancel - событие отмены для LLMRouter: снимает запрос с очереди шлюза, начатый поток закрывается на следующем чанке
+            chunks = llm.stream(prompt, on_queue=task._set_queue_position, cancel=task._cancelled, **kwargs)
+            try:
+                for chunk in chunks:
+                    if task.cancelled:
+                        break
+                    task._append(chunk.content if hasattr(chunk, 'content') else str(chunk))
+            finally:
+                # Ранний выход закрывает поток роутера: попытки отменяются, слот шлюза освобождается
+                close = getattr(chunks, 'close', None)
+                if close is not None:
+                    close()
+        except RequestCancelledError:
+            self._finish(task, "cancelled")
+        except Exception as e:
+            self._finish(task, "failed", e)
+        else:
+            self._finish(task, "cancelled" if task.cancelled else "done")
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _finish(self, task: LLMTask, status: str, error: Exception = None):
+        with self._lock:
+            if status == "failed":
+                self.failed += 1
+            elif status == "cancelled":
+                self.cancelled += 1
+        task._finish(status, error)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'running': self.running,
+                'submitted': self.submitted,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+            }
+
+    def render_prometheus(self) -> list:
+        """Строки метрик в формате Prometheus (подключаются к MetricsRegistry)"""
+        stats = self.stats()
+        return [
+            "# TYPE llm_tasks_running gauge",
+            f"llm_tasks_running {stats['running']}",
+            "# TYPE llm_tasks_submitted_total counter",
+            f"llm_tasks_submitted_total {stats['submitted']}",
+            "# TYPE llm_tasks_failed_total counter",
+            f"llm_tasks_failed_total {stats['failed']}",
+            "# TYPE llm_tasks_cancelled_total counter",
+            f"llm_tasks_cancelled_total {stats['cancelled']}",
+        ]
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_llm_task_runner() -> LLMTaskRunner:
+    """Возвращает общий для процесса пул вызовов LLM (размер - LLM_TASK_WORKERS)"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = LLMTaskRunner(max_workers=int(os.getenv('LLM_TASK_WORKERS', "64")))
+            get_metrics_registry().add_collector(_runner.render_prometheus)
+        return _runner
@@ -0,0 +1,240 @@
+"""
+Кеш ответов LLM для повторяющихся ходов урока (память + диск, LRU и TTL)
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from .conversation_memory import normalize_answer
+from .llm_metrics import get_metrics_registry
+
+
+def make_cache_key(topic_id: str, grade: str, step: str, student_input: str, version: str = "") -> str:
+    """
+    Ключ кеша хода Learn Mode
+
+    Args:
+        topic_id: ID темы
+        grade: Класс ученика
+        step: Отпечаток шага урока (LessonEngine.step_fingerprint)
+        student_input: Сообщение ученика (нормализуется: регистр, пробелы, запятая/точка)
+        version: Версия шаблона и модель - после правки промпта или темы ключи меняются
+
+    Returns:
+        sha256 в hex
+    """
+    parts = (topic_id, grade, step, normalize_answer(student_input), version)
+    return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Двухуровневый кеш ответов: LRU в памяти и SQLite на диске (переживает перезапуск)
+
+    Каждая запись живет ttl секунд. Вместе с ответом хранится задержка исходного
+    вызова LLM - из нее считается сэкономленное время при попаданиях.
+
+    Args:
+        max_entries: Размер LRU в памяти
+        ttl: Время жизни записи, секунды
+        disk_path: Путь к файлу SQLite (None - только память)
+        max_disk_entries: Сколько записей держать на диске
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 7 * 24 * 3600,
+                 disk_path: str = None, max_disk_entries: int = 50000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.max_disk_entries = max_disk_entries
+
+        self._memory = OrderedDict()  # {key: (expires_at, response, latency)}
+        self._lock = threading.Lock()
+        self._disk = None
+        self._disk_puts = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT, latency REAL, created_at REAL)"
+            )
+            self._disk.commit()
+
+    def _remember(self, key: str, expires_at: float, response: str, latency: float):
+        self._memory[key] = (expires_at, response, latency)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        Ищет ответ сначала в памяти, затем на диске (найденное на диске поднимается в память)
+
+        Returns:
+            Текст ответа или None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    self.saved_latency += entry[2]
+                    return entry[1]
+                del self._memory[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT response, latency, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[2] + self.ttl > now:
+                    self._remember(key, row[2] + self.ttl, row[0], row[1])
+                    self.disk_hits += 1
+                    self.saved_latency += row[1]
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str, latency: float):
+        """Сохраняет ответ в память и на диск"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now + self.ttl, response, latency)
+
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, latency, created_at) VALUES (?, ?, ?, ?)",
+                    (key, response, latency, now)
+                )
+                self._disk_puts += 1
+                # Чистим диск не на каждой записи: устаревшие и самые старые сверх лимита
+                if self._disk_puts % 100 == 0:
+                    self._disk.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                    self._disk.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_disk_entries,)
+                    )
+                self._disk.commit()
+
+    def stats(self) -> dict:
+        """Попадания, промахи, доля попаданий и сэкономленное время (секунды)"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': hits / total if total else 0.0,
+                'saved_latency': self.saved_latency,
+                'size': len(self._memory),
+            }
+
+    def render_prometheus(self) -> list:
+        """Строки метрик в формате Prometheus (подключаются к MetricsRegistry)"""
+        stats = self.stats()
+        return [
+            "# TYPE llm_response_cache_hits_total counter",
+            f'llm_response_cache_hits_total{{tier="memory"}} {stats["memory_hits"]}',
+            f'llm_response_cache_hits_total{{tier="disk"}} {stats["disk_hits"]}',
+            "# TYPE llm_response_cache_misses_total counter",
+            f"llm_response_cache_misses_total {stats['misses']}",
+            "# TYPE llm_response_cache_hit_ratio gauge",
+            f"llm_response_cache_hit_ratio {stats['hit_ratio']:.6f}",
+            "# TYPE llm_response_cache_saved_seconds_total counter",
+            f"llm_response_cache_saved_seconds_total {stats['saved_latency']:.6f}",
+            "# TYPE llm_response_cache_entries gauge",
+            f"llm_response_cache_entries {stats['size']}",
+        ]
+
+
+class CachedLLM:
+    """
+    Обертка над LLM, которая отдает готовый ответ из ResponseCache
+
+    Кешируются только вызовы с cache_key; остальные (Study Mode, фидбек) проходят
+    в исходную LLM без изменений. Прерванный или упавший поток не кешируется.
+    """
+
+    def __init__(self, llm, cache: ResponseCache):
+        self.llm = llm
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def invoke(self, prompt, cache_key: str = None, **kwargs):
+        if cache_key is None:
+            return self.llm.invoke(prompt, **kwargs)
+
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return AIMessage(content=cached)
+
+        started = time.perf_counter()
+        response = self.llm.invoke(prompt, **kwargs)
+        content = response.content if hasattr(response, 'content') else str(response)
+        if content:
+            self.cache.put(cache_key, content, time.perf_counter() - started)
+        return response
+
+    def stream(self, prompt, cache_key: str = None, **kwargs):
+        if cache_key is None:
+            yield from self.llm.stream(prompt, **kwargs)
+            return
+
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            yield AIMessageChunk(content=cached)
+            return
+
+        started = time.perf_counter()
+        chunks = []
+        for chunk in self.llm.stream(prompt, **kwargs):
+            chunks.append(chunk.content if hasattr(chunk, 'content') else str(chunk))
+            yield chunk
+
+        content = "".join(chunks)
+        if content:
+            self.cache.put(cache_key, content, time.perf_counter() - started)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Возвращает общий для процесса кеш ответов или None, если кеш выключен
+
+    Включается RESPONSE_CACHE=1. Настройки: RESPONSE_CACHE_PATH (файл SQLite,
+    пустая строка - только память), RESPONSE_CACHE_TTL (секунды), RESPONSE_CACHE_SIZE.
+    """
+    global _cache
+    if os.getenv('RESPONSE_CACHE') != "1":
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', "2000")),
+                ttl=float(os.getenv('RESPONSE_CACHE_TTL', str(7 * 24 * 3600))),
+                disk_path=os.getenv('RESPONSE_CACHE_PATH', "response_cache.sqlite3") or None
+            )
+            get_metrics_registry().add_collector(_cache.render_prometheus)
+        return _cache
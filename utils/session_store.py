@@ -0,0 +1,209 @@
+"""
+Хранилище сессий: журнал сообщений (только дозапись) и небольшое состояние урока
+
+Обновление страницы или перезапуск сервера не стирает урок: сессия находится по
+секретному токену (параметр ?session= в адресе) и поднимается из хранилища.
+Токен и есть ключ сессии в хранилище; короткий session_id для экрана и выгрузок
+хранится внутри состояния.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass
+class StoredSession:
+    """Сессия, прочитанная из хранилища"""
+    session_id: str                               # Ключ сессии (токен из адреса)
+    state: dict                                   # Режим, тема, класс, квиз, состояние LessonEngine...
+    messages: list = field(default_factory=list)  # Последние сообщения (окно)
+    offset: int = 0                               # Номер первого из них в полном журнале
+    total: int = 0                                # Сообщений в журнале всего
+
+
+def quiz_state_to_log(quiz_state: dict, offset: int) -> dict:
+    """
+    Ключи квиза для хранилища: номер сообщения в поднятом окне -> номер в журнале
+
+    Args:
+        quiz_state: {номер сообщения в session_state + 1: данные квиза}
+        offset: Номер первого сообщения окна в журнале
+    """
+    return {index + offset: quiz for index, quiz in quiz_state.items()}
+
+
+def quiz_state_from_log(quiz_state: dict, offset: int) -> dict:
+    """
+    Ключи квиза из хранилища -> номера в поднятом окне (квизы до окна отбрасываются)
+
+    Args:
+        quiz_state: {номер в журнале: данные квиза} (после JSON ключи - строки)
+        offset: Номер первого сообщения окна в журнале
+    """
+    return {int(index) - offset: quiz for index, quiz in quiz_state.items() if int(index) - offset >= 1}
+
+
+class SessionStore(ABC):
+    """
+    Интерфейс хранилища сессий
+
+    Сообщения пишутся в журнал по номерам: повторная запись того же номера
+    ничего не меняет, поэтому дописывать можно с любого прогона без дублей.
+    Состояние - небольшой словарь, заменяется целиком.
+    """
+
+    @abstractmethod
+    def append_messages(self, session_id: str, start: int, messages: list):
+        """
+        Дописывает сообщения в журнал сессии
+
+        Args:
+            session_id: Ключ сессии (токен из адреса)
+            start: Номер первого сообщения в журнале
+            messages: Сообщения {"role", "content"}
+        """
+
+    @abstractmethod
+    def save_state(self, session_id: str, state: dict):
+        """Заменяет состояние сессии (должно сериализоваться в JSON)"""
+
+    @abstractmethod
+    def load(self, session_id: str, window: int = 200) -> Optional[StoredSession]:
+        """
+        Читает состояние и последние window сообщений (стоимость не зависит от длины журнала)
+
+        Returns:
+            StoredSession или None, если сессии нет
+        """
+
+
+class MemorySessionStore(SessionStore):
+    """Хранилище в памяти процесса (для тестов и запуска без диска)"""
+
+    def __init__(self):
+        self._sessions = {}  # {session_id: (state, [сообщения])}
+        self._lock = threading.Lock()
+
+    def append_messages(self, session_id: str, start: int, messages: list):
+        with self._lock:
+            state, log = self._sessions.setdefault(session_id, ({}, []))
+            for index, message in enumerate(messages, start):
+                if index == len(log):
+                    log.append({"role": message["role"], "content": message["content"]})
+
+    def save_state(self, session_id: str, state: dict):
+        with self._lock:
+            log = self._sessions.get(session_id, ({}, []))[1]
+            self._sessions[session_id] = (json.loads(json.dumps(state)), log)
+
+    def load(self, session_id: str, window: int = 200) -> Optional[StoredSession]:
+        with self._lock:
+            if session_id not in self._sessions:
+                return None
+            state, log = self._sessions[session_id]
+            offset = max(0, len(log) - window)
+            return StoredSession(session_id, json.loads(json.dumps(state)), [dict(m) for m in log[offset:]],
+                                 offset, len(log))
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Хранилище в SQLite (WAL): строка состояния на сессию и журнал сообщений с ключом (сессия, номер)
+
+    Окно последних сообщений читается диапазоном по первичному ключу - без
+    просмотра всего журнала.
+
+    Args:
+        path: Путь к файлу базы
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(session_id TEXT PRIMARY KEY, state TEXT NOT NULL, message_count INTEGER NOT NULL, updated_at REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages "
+                "(session_id TEXT, idx INTEGER, role TEXT, content TEXT, created_at REAL, "
+                "PRIMARY KEY (session_id, idx)) WITHOUT ROWID"
+            )
+            self._db.commit()
+
+    def append_messages(self, session_id: str, start: int, messages: list):
+        if not messages:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO messages (session_id, idx, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(session_id, index, m["role"], m["content"], now) for index, m in enumerate(messages, start)]
+            )
+            self._db.execute(
+                "INSERT INTO sessions (session_id, state, message_count, updated_at) VALUES (?, '{}', ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET "
+                "message_count = max(message_count, excluded.message_count), updated_at = excluded.updated_at",
+                (session_id, start + len(messages), now)
+            )
+            self._db.commit()
+
+    def save_state(self, session_id: str, state: dict):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO sessions (session_id, state, message_count, updated_at) VALUES (?, ?, 0, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (session_id, json.dumps(state, ensure_ascii=False), time.time())
+            )
+            self._db.commit()
+
+    def load(self, session_id: str, window: int = 200) -> Optional[StoredSession]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state, message_count FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            offset = max(0, row[1] - window)
+            messages = [
+                {"role": role, "content": content}
+                for role, content in self._db.execute(
+                    "SELECT role, content FROM messages WHERE session_id = ? AND idx >= ? ORDER BY idx",
+                    (session_id, offset)
+                )
+            ]
+        return StoredSession(session_id, json.loads(row[0]), messages, offset, row[1])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> Optional[SessionStore]:
+    """
+    Возвращает общее для процесса хранилище сессий или None, если оно выключено
+
+    SESSION_STORE: sqlite (по умолчанию), memory или off. Файл базы - SESSION_STORE_PATH.
+    """
+    global _store
+    backend = os.getenv('SESSION_STORE', "sqlite")
+    if backend == "off":
+        return None
+
+    with _store_lock:
+        if _store is None:
+            if backend == "memory":
+                _store = MemorySessionStore()
+            else:
+                _store = SQLiteSessionStore(os.getenv('SESSION_STORE_PATH', "sessions.sqlite3"))
+        return _store
@@ -0,0 +1,250 @@
+"""
+Реплика журнала диалогов в Google Sheets (фоновый поток с курсором)
+"""
+import os
+import random
+import threading
+import time
+
+import gspread
+
+from .google_sheets import (
+    fit_sheet_cell,
+    get_cached_worksheet,
+    invalidate_on_api_error
+)
+from .transcript_log import TranscriptLog, get_transcript_log
+
+
+class ExportHandle:
+    """
+    Статус одной задачи экспорта - UI опрашивает его вместо ожидания
+
+    Диалог записан в локальный журнал сразу при submit; статус - про реплику в Google Sheets.
+    Статусы: "pending" (ждет отправки), "done" (в таблице), "failed" (ошибка отправки)
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.rows_count = 0  # Сколько новых строк записано в журнал
+        self.seq = 0         # Номер последней строки сессии в журнале
+        self.status = "pending"
+        self.error = None
+        self.attempts = 0
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def is_pending(self) -> bool:
+        return self.status == "pending"
+
+    def wait(self, timeout: float = None) -> bool:
+        """Ждет завершения задачи (для скриптов и тестов; UI не блокируется)"""
+        return self._done.wait(timeout)
+
+    def _finish(self, status: str, error: str = None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        self._done.set()
+
+
+class SheetsExporter:
+    """
+    Экспортер: локальный журнал - основной приемник, таблица Google Sheets - его реплика
+
+    submit() сразу дописывает новые сообщения диалога в TranscriptLog (сообщения
+    целиком, без обрезки) - после этого данные не теряются, даже если Sheets API
+    недоступен. Рабочий поток переносит строки журнала в таблицу большими пачками
+    (append_rows до max_batch_rows строк), повторяя запрос с backoff при APIError.
+    Курсор реплики сдвигается только после успешной записи и хранится в журнале,
+    поэтому после ошибки или перезапуска процесса отправка продолжается с того же места.
+
+    Args:
+        log: Журнал диалогов (по умолчанию - общий для процесса)
+        credentials_json: JSON строка с credentials или путь к файлу
+        sheet_url: URL таблицы-реплики (приоритетнее названия)
+        sheet_name: Название таблицы (по умолчанию из GOOGLE_SHEET_NAME)
+        retry_interval: Через сколько секунд повторить отправку после ошибок API
+    """
+
+    def __init__(
+        self,
+        log: TranscriptLog = None,
+        credentials_json: str = None,
+        sheet_url: str = None,
+        sheet_name: str = None,
+        batch_window: float = 1.0,
+        max_batch_rows: int = 2000,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        retry_interval: float = 60.0
+    ):
+        self.log = log or get_transcript_log()
+        self.credentials_json = credentials_json
+        self.sheet_url = sheet_url
+        self.sheet_name = sheet_name
+        self.batch_window = batch_window
+        self.max_batch_rows = max_batch_rows
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_interval = retry_interval
+
+        # Курсор на каждую таблицу: новая таблица получает весь журнал с начала
+        target = sheet_url or sheet_name or os.getenv('GOOGLE_SHEET_NAME', 'Math Tutor Dialogs')
+        self.cursor_name = f"sheets:{target}"
+
+        self._handles = []  # Handle, ждущие отправки своих строк
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        messages: list,
+        topic_title: str = None,
+        session_id: str = None,
+        session_start: str = None,
+        grade: str = None,
+        offset: int = 0
+    ) -> ExportHandle:
+        """
+        Дописывает диалог в журнал, ставит отправку в Google Sheets в фон и сразу возвращает handle
+
+        Args:
+            messages: Список сообщений
+            topic_title: Название темы
+            session_id: Уникальный ID сессии
+            session_start: Время начала сессии
+            grade: Класс ученика (только в журнал - для выгрузок по классам)
+            offset: Номер первого из messages в сессии (окно восстановленной сессии)
+
+        Returns:
+            ExportHandle для опроса статуса
+        """
+        handle = ExportHandle(session_id)
+        # Время в журнале и таблице - момент записи в журнал
+        handle.rows_count, handle.seq = self.log.append(messages, topic_title, session_id, session_start,
+                                                        grade=grade, offset=offset)
+
+        with self._lock:
+            if handle.seq <= self.log.get_cursor(self.cursor_name):
+                handle._finish("done")  # Все сообщения сессии уже в таблице
+                return handle
+            self._handles.append(handle)
+
+        self._ensure_worker()
+        self._wake.set()
+        return handle
+
+    def resume(self):
+        """Запускает отправку строк, оставшихся в журнале с прошлого запуска"""
+        if self.pending_count():
+            self._ensure_worker()
+            self._wake.set()
+
+    def pending_count(self) -> int:
+        """Количество строк журнала, еще не отправленных в таблицу"""
+        return self.log.count_after(self.log.get_cursor(self.cursor_name))
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sheets-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        retry_after = None
+        while True:
+            self._wake.wait(retry_after)
+            self._wake.clear()
+            # Собираем дозаписи из многих сессий за окно, чтобы отправить их одним запросом
+            time.sleep(self.batch_window)
+
+            error, retryable = self._replicate()
+            if error:
+                self._finish_handles(error=error)
+                print(f"❌ Ошибка фонового сохранения в Google Sheets: {error} (строки остались в журнале)")
+            # Ошибки API - повтор по таймеру; без авторизации ждем следующего submit
+            retry_after = self.retry_interval if error and retryable else None
+
+    def _replicate(self):
+        """Отправляет строки журнала после курсора; возвращает (текст ошибки или None, стоит ли повторить)"""
+        cursor = self.log.get_cursor(self.cursor_name)
+        while True:
+            batch = self.log.read_after(cursor, self.max_batch_rows)
+            if not batch:
+                return None, False
+
+            # В журнале сообщение целиком, в ячейку таблицы - не длиннее ее лимита
+            rows = [values[:-1] + [fit_sheet_cell(values[-1])] for _, values in batch]
+            error, retryable = self._append_with_retry(rows)
+            if error:
+                return error, retryable
+
+            cursor = batch[-1][0]
+            self.log.set_cursor(self.cursor_name, cursor)
+            self._finish_handles(cursor=cursor)
+            print(f"✅ Фоновое сохранение в Google Sheets: {len(rows)} строк (журнал до #{cursor})")
+
+    def _finish_handles(self, cursor: int = None, error: str = None):
+        with self._lock:
+            waiting = []
+            for handle in self._handles:
+                if error:
+                    handle._finish("failed", error)
+                elif handle.seq <= cursor:
+                    handle._finish("done")
+                else:
+                    waiting.append(handle)
+            self._handles = waiting
+
+    def _append_with_retry(self, rows):
+        """Пишет строки с повторами; возвращает (текст ошибки или None, стоит ли повторить позже)"""
+        for attempt in range(1, self.max_retries + 1):
+            with self._lock:
+                for handle in self._handles:
+                    handle.attempts = attempt
+            try:
+                sheet = get_cached_worksheet(self.sheet_url, self.sheet_name, self.credentials_json)
+                if not sheet:
+                    return "Не удалось авторизоваться в Google Sheets", False
+
+                sheet.append_rows(rows)
+                return None, False
+
+            except gspread.exceptions.SpreadsheetNotFound:
+                return "Таблица не найдена. Проверьте URL или название.", False
+            except gspread.exceptions.APIError as e:
+                # Лист могли удалить или закрыть доступ - следующая попытка откроет его заново
+                invalidate_on_api_error(e)
+                if attempt == self.max_retries:
+                    return f"Ошибка Google Sheets API: {e}", True
+                # Экспоненциальный backoff с джиттером (квоты Sheets API - на минуту)
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+            except Exception as e:
+                return f"Ошибка при сохранении в Google Sheets: {e}", True
+
+        return None, False
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_sheets_exporter() -> SheetsExporter:
+    """
+    Возвращает общий для процесса экспортер (один рабочий поток на все сессии)
+
+    При создании дослает в таблицу строки, оставшиеся в журнале с прошлого запуска.
+    """
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = SheetsExporter()
+            _exporter.resume()
+        return _exporter
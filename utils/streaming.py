@@ -0,0 +1,178 @@
+"""
+Потоковый вывод ответов LLM и разбор ответов (служебные маркеры, оценка правильности)
+"""
+import re
+from typing import Iterable, Iterator
+
+# Служебные маркеры, которые LLM добавляет в ответ
+QUICK_REPLIES_PATTERN = r'\[QUICK_REPLIES:\s*(.+?)\]'
+QUICK_REPLIES_PREFIX = "[QUICK_REPLIES:"
+LESSON_COMPLETE_MARKER = "[УРОК_ЗАВЕРШЕН]"
+
+
+def parse_quick_replies(text):
+    """
+    Парсит маркер быстрых ответов из текста
+
+    Формат: [QUICK_REPLIES: "Вариант 1" | "Вариант 2" | ...]
+
+    Returns:
+        tuple: (cleaned_text, list_of_replies)
+    """
+    match = re.search(QUICK_REPLIES_PATTERN, text)
+
+    if match:
+        # Извлекаем варианты ответов
+        replies_str = match.group(1)
+        # Разбиваем по разделителю |
+        replies = [r.strip().strip('"\'') for r in replies_str.split('|')]
+        # Убираем маркер из текста
+        cleaned_text = re.sub(QUICK_REPLIES_PATTERN, '', text).strip()
+        return cleaned_text, replies
+
+    return text, []
+
+
+def check_answer_correctness(response_text):
+    """
+    Определяет правильность ответа по тексту ответа AI
+
+    Args:
+        response_text: Текст ответа AI
+
+    Returns:
+        bool: True если ответ правильный, False если неправильный, None если не удалось определить
+    """
+    response_lower = response_text.lower()
+
+    # Ищем явные маркеры правильности
+    correct_markers = ['правильно', 'верно', 'точно', 'отлично', 'молодец', 'именно так', 'да, это правильный ответ']
+    incorrect_markers = ['неправильно', 'неверно', 'ошибка', 'не совсем', 'почти', 'к сожалению, нет']
+
+    # Проверяем первые 100 символов ответа (обычно там содержится оценка)
+    first_part = response_lower[:150]
+
+    has_correct = any(marker in first_part for marker in correct_markers)
+    has_incorrect = any(marker in first_part for marker in incorrect_markers)
+
+    if has_correct and not has_incorrect:
+        return True
+    elif has_incorrect and not has_correct:
+        return False
+
+    return None
+
+
+def _match_marker(tail: str):
+    """
+    Проверяет, начинается ли tail (всегда начинается с '[') со служебного маркера
+
+    Returns:
+        int - длина полного маркера (его нужно вырезать),
+        True - маркер может продолжиться в следующих токенах,
+        None - это обычный текст
+    """
+    # [УРОК_ЗАВЕРШЕН]
+    if tail.startswith(LESSON_COMPLETE_MARKER):
+        return len(LESSON_COMPLETE_MARKER)
+    if LESSON_COMPLETE_MARKER.startswith(tail):
+        return True
+
+    # [QUICK_REPLIES: ...] - как и в регулярке, маркер не переносится на новую строку
+    if tail.startswith(QUICK_REPLIES_PREFIX):
+        body = tail[len(QUICK_REPLIES_PREFIX):]
+        end = body.find("]")
+        newline = body.find("\n")
+        if newline != -1 and (end == -1 or newline < end):
+            return None
+        if end == -1:
+            return True
+        return len(QUICK_REPLIES_PREFIX) + end + 1
+    if QUICK_REPLIES_PREFIX.startswith(tail):
+        return True
+
+    return None
+
+
+class MarkerStreamFilter:
+    """
+    Фильтр потока токенов: пропускает видимый текст и придерживает служебные маркеры
+
+    Токены, которые могут оказаться началом маркера, не выводятся, пока не станет
+    ясно, маркер это или обычный текст. Полный ответ (вместе с маркерами)
+    накапливается и доступен через свойство text - его разбирают после окончания потока.
+    """
+
+    def __init__(self):
+        self._chunks = []   # Все полученные токены как есть
+        self._pending = ""  # Придержанный хвост, который может быть началом маркера
+
+    @property
+    def text(self) -> str:
+        """Полный «сырой» ответ LLM"""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> str:
+        """
+        Принимает очередной токен и возвращает текст, который можно показать
+
+        Args:
+            chunk: Очередной фрагмент ответа LLM
+
+        Returns:
+            Видимая часть (может быть пустой строкой)
+        """
+        self._chunks.append(chunk)
+        pending = self._pending + chunk
+        visible = []
+
+        while pending:
+            start = pending.find("[")
+            if start == -1:
+                visible.append(pending)
+                pending = ""
+                break
+
+            visible.append(pending[:start])
+            tail = pending[start:]
+            matched = _match_marker(tail)
+
+            if matched is True:
+                # Ждем следующие токены
+                pending = tail
+                break
+            if matched is None:
+                # Обычная квадратная скобка - выводим и ищем дальше
+                visible.append("[")
+                pending = tail[1:]
+            else:
+                # Вырезаем маркер целиком
+                pending = tail[matched:]
+
+        self._pending = pending
+        return "".join(visible)
+
+    def flush(self) -> str:
+        """Возвращает придержанный хвост после окончания потока (незавершенный маркер - это текст)"""
+        rest, self._pending = self._pending, ""
+        return rest
+
+    def iter_visible(self, chunks: Iterable) -> Iterator[str]:
+        """
+        Оборачивает поток чанков LLM (llm.stream(...)) в поток видимого текста
+
+        Args:
+            chunks: Итератор сообщений-чанков LangChain или строк
+
+        Yields:
+            Непустые фрагменты текста без служебных маркеров
+        """
+        for chunk in chunks:
+            text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+            visible = self.feed(text)
+            if visible:
+                yield visible
+
+        rest = self.flush()
+        if rest:
+            yield rest
@@ -0,0 +1,222 @@
+"""
+Модели схемы темы Learn Mode: проверка данных и готовые строки для промптов
+
+Тема собирается один раз при загрузке (TopicCatalog): опечатка в ключе или
+неверный тип поля дает ошибку с путем к полю, а не молча пропавший раздел промпта.
+"""
+import difflib
+from dataclasses import dataclass, field
+from typing import Optional, Union
+
+from .schema_formatter import format_boss_step, format_explanation_block, topic_content_hash
+
+
+class TopicSchemaError(ValueError):
+    """Схема темы не прошла проверку"""
+
+
+def _check_keys(data, allowed: tuple, required: tuple, where: str):
+    if not isinstance(data, dict):
+        raise TopicSchemaError(f"{where}: ожидался объект, получено {type(data).__name__}")
+
+    for key in data:
+        if key not in allowed:
+            hint = difflib.get_close_matches(key, allowed, n=1)
+            suggestion = f" (возможно, {hint[0]}?)" if hint else ""
+            raise TopicSchemaError(f"{where}: неизвестное поле '{key}'{suggestion}")
+
+    for key in required:
+        if data.get(key) in (None, ""):
+            raise TopicSchemaError(f"{where}: не заполнено обязательное поле '{key}'")
+
+
+def _text(data: dict, key: str, where: str) -> str:
+    value = data.get(key, "")
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise TopicSchemaError(f"{where}.{key}: ожидалась строка, получено {type(value).__name__}")
+    return str(value)
+
+
+def _mistakes(data: dict, where: str) -> Union[dict, str]:
+    value = data.get('mistake_explanation', {})
+    if isinstance(value, str):
+        return value
+    if not isinstance(value, dict):
+        raise TopicSchemaError(f"{where}.mistake_explanation: ожидался объект {{ответ: объяснение}} или строка")
+    return {str(answer): _text(value, answer, f"{where}.mistake_explanation") for answer in value}
+
+
+@dataclass(slots=True)
+class ExplanationBlock:
+    """Блок объяснения: теория, вопрос, решение, типичные ошибки, ответ"""
+    number: int
+    action: str
+    answer: str
+    info: str = ""
+    solution: str = ""
+    mistake_explanation: Union[dict, str] = field(default_factory=dict)  # {неверный ответ: объяснение} или текст
+    formatted: str = ""  # Блок в формате промпта (format_explanation_block)
+
+    FIELDS = ('info', 'action', 'solution', 'mistake_explanation', 'answer')
+
+    @classmethod
+    def from_dict(cls, data: dict, number: int, where: str) -> "ExplanationBlock":
+        _check_keys(data, cls.FIELDS, ('action', 'answer'), where)
+        block = cls(
+            number=number,
+            action=_text(data, 'action', where),
+            answer=_text(data, 'answer', where),
+            info=_text(data, 'info', where),
+            solution=_text(data, 'solution', where),
+            mistake_explanation=_mistakes(data, where),
+        )
+        block.formatted = format_explanation_block(block)
+        return block
+
+    @property
+    def mistakes(self) -> dict:
+        """Известные ошибки для автопроверки (текстовое описание ошибок не проверяется)"""
+        return self.mistake_explanation if isinstance(self.mistake_explanation, dict) else {}
+
+
+@dataclass(slots=True)
+class BossStep:
+    """Шаг финальной задачи"""
+    step_num: Union[int, str]
+    action: str
+    answer: str
+    solution: str = ""
+    formatted: str = ""  # Шаг в формате промпта (format_boss_step)
+
+    FIELDS = ('step_num', 'action', 'solution', 'answer')
+
+    @classmethod
+    def from_dict(cls, data: dict, number: int, where: str) -> "BossStep":
+        _check_keys(data, cls.FIELDS, ('action', 'answer'), where)
+        step = cls(
+            step_num=data.get('step_num', number),
+            action=_text(data, 'action', where),
+            answer=_text(data, 'answer', where),
+            solution=_text(data, 'solution', where),
+        )
+        step.formatted = format_boss_step(step)
+        return step
+
+    @property
+    def mistakes(self) -> dict:
+        return {}
+
+
+@dataclass(slots=True)
+class Boss:
+    """Финальная задача: условие, шаги и итоговый ответ"""
+    problem: str
+    steps: tuple = ()
+    final_answer: str = ""
+
+    FIELDS = ('problem', 'steps', 'final_answer')
+
+    @classmethod
+    def from_dict(cls, data: dict, where: str) -> "Boss":
+        _check_keys(data, cls.FIELDS, ('problem',), where)
+        steps = data.get('steps', [])
+        if not isinstance(steps, list):
+            raise TopicSchemaError(f"{where}.steps: ожидался список шагов")
+        return cls(
+            problem=_text(data, 'problem', where),
+            steps=tuple(BossStep.from_dict(step, i, f"{where}.steps[{i}]") for i, step in enumerate(steps, 1)),
+            final_answer=_text(data, 'final_answer', where),
+        )
+
+
+@dataclass(slots=True)
+class Topic:
+    """
+    Тема Learn Mode, проверенная и подготовленная при загрузке
+
+    Готовые строки (welcome_message, fingerprint, formatted у блоков) считаются один раз,
+    потребители берут их атрибутами.
+    """
+    topic_id: str
+    title: str
+    description: str = ""
+    grades: tuple = ()        # Классы ("1-4", "5-6", ...); пустой - тема для всех классов
+    plan: str = ""
+    explanation: tuple = ()   # ExplanationBlock
+    boss: Optional[Boss] = None
+    summary: str = ""
+    welcome_message: str = ""  # Первое сообщение урока: название, описание, план
+    fingerprint: str = ""      # Хеш содержимого (версия темы в ключах кешей)
+
+    FIELDS = ('title', 'description', 'grades', 'plan', 'explanation', 'boss', 'summary')
+
+    @classmethod
+    def from_dict(cls, topic_id: str, data: dict) -> "Topic":
+        """
+        Проверяет схему темы и собирает модель
+
+        Структура файла темы (data/topics/<topic_id>.json):
+        {
+            "title": "Название темы",
+            "plan": "План урока...",
+            "explanation": [
+                {
+                    "info": "Теория",
+                    "action": "Вопрос",
+                    "solution": "Решение",
+                    "mistake_explanation": "Объяснение ошибок",
+                    "answer": "Ответ"
+                }
+            ],
+            "boss": {
+                "problem": "Условие задачи",
+                "steps": [
+                    {
+                        "step_num": 1,
+                        "action": "...",
+                        "solution": "...",
+                        "answer": "..."
+                    }
+                ],
+                "final_answer": "Итоговый ответ"
+            },
+            "summary": "Конспект"
+        }
+
+        Raises:
+            TopicSchemaError: Неизвестное поле, пропущенное обязательное поле или неверный тип
+        """
+        where = topic_id
+        _check_keys(data, cls.FIELDS, ('title',), where)
+
+        grades = data.get('grades') or []
+        if not isinstance(grades, list) or not all(isinstance(grade, str) for grade in grades):
+            raise TopicSchemaError(f"{where}.grades: ожидался список классов, например [\"5-6\"]")
+
+        explanation = data.get('explanation', [])
+        if not isinstance(explanation, list):
+            raise TopicSchemaError(f"{where}.explanation: ожидался список блоков")
+
+        topic = cls(
+            topic_id=topic_id,
+            title=_text(data, 'title', where),
+            description=_text(data, 'description', where),
+            grades=tuple(grades),
+            plan=_text(data, 'plan', where),
+            explanation=tuple(
+                ExplanationBlock.from_dict(block, i, f"{where}.explanation[{i}]")
+                for i, block in enumerate(explanation, 1)
+            ),
+            boss=Boss.from_dict(data['boss'], f"{where}.boss") if data.get('boss') else None,
+            summary=_text(data, 'summary', where),
+        )
+
+        welcome_message = f"**{topic.title}**\n\n{topic.description}\n\n"
+        if topic.plan:
+            welcome_message += f"{topic.plan}\n\n"
+        topic.welcome_message = welcome_message + "Готов? Поехали! 🚀"
+        topic.fingerprint = topic_content_hash(data)
+        return topic
+
+    def fits_grade(self, grade: str) -> bool:
+        return not self.grades or grade in self.grades
@@ -0,0 +1,216 @@
+"""
+Локальный журнал диалогов (SQLite WAL) - основной приемник экспорта
+
+Строки журнала - те же колонки, что в Google Sheets (SHEET_HEADERS), но сообщения
+хранятся целиком, без обрезки до лимита ячейки. Таблица Google Sheets - реплика
+журнала (SheetsExporter дописывает ее от курсора); выгрузки и аналитика читают журнал.
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from .google_sheets import SHEET_HEADERS, build_sheet_rows
+
+# Дата строки ('дд.мм.гггг') в виде 'гггг-мм-дд' - для отбора по диапазону дат
+_ISO_DATE = "substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2)"
+
+
+class TranscriptLog:
+    """
+    Журнал только на дозапись: строка на сообщение, seq - сквозной номер строки
+
+    Номер сообщения в сессии (message_index) уникален, поэтому повторная запись
+    того же диалога добавляет только новые сообщения. Курсоры реплик (до какого
+    seq строки уже переданы) хранятся в той же базе и переживают перезапуск.
+
+    Args:
+        path: Путь к файлу базы
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS transcript ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "session_id TEXT NOT NULL, message_index INTEGER NOT NULL, "
+                "session_start TEXT, date TEXT, time TEXT, topic TEXT, role TEXT, message TEXT, grade TEXT, "
+                "UNIQUE (session_id, message_index))"
+            )
+            # Журналы первой версии - без класса ученика
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(transcript)")}
+            if 'grade' not in columns:
+                self._db.execute("ALTER TABLE transcript ADD COLUMN grade TEXT")
+            self._db.execute("CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, seq INTEGER NOT NULL)")
+            self._db.commit()
+
+    def append(
+        self,
+        messages: list,
+        topic_title: str = None,
+        session_id: str = None,
+        session_start: str = None,
+        now: datetime = None,
+        grade: str = None,
+        offset: int = 0
+    ) -> tuple:
+        """
+        Дописывает сообщения диалога, которых еще нет в журнале
+
+        Args:
+            messages: Сообщения сессии, начиная с номера offset
+            topic_title: Название темы
+            session_id: Уникальный ID сессии
+            session_start: Время начала сессии
+            now: Время записи (по умолчанию - текущее)
+            grade: Класс ученика (в таблицу Google Sheets не передается, нужен для выгрузок)
+            offset: Номер первого из messages в сессии (после восстановления сессии в
+                session_state лежит только окно последних сообщений)
+
+        Returns:
+            (сколько строк добавлено, seq последней строки сессии или 0)
+        """
+        session_id = session_id or "-"
+        with self._lock:
+            row = self._db.execute(
+                "SELECT max(message_index), max(seq) FROM transcript WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            # Номер первого нового сообщения - в сессии, а не в списке messages
+            start = max(offset, row[0] + 1 if row[0] is not None else 0)
+
+            rows = build_sheet_rows(messages[start - offset:], topic_title, session_id, session_start, now,
+                                    max_length=None)
+            last_seq = row[1] or 0
+            for index, values in enumerate(rows, start):
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO transcript "
+                    "(session_id, message_index, session_start, date, time, topic, role, message, grade) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (values[0], index, *values[1:], grade)
+                )
+                if cursor.rowcount:
+                    last_seq = cursor.lastrowid
+            self._db.commit()
+        return len(rows), last_seq
+
+    def read_after(self, seq: int, limit: int = 2000) -> list:
+        """
+        Строки после seq по порядку
+
+        Returns:
+            Список (seq, строка в порядке SHEET_HEADERS)
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, session_id, session_start, date, time, topic, role, message "
+                "FROM transcript WHERE seq > ? ORDER BY seq LIMIT ?",
+                (seq, limit)
+            ).fetchall()
+        return [(row[0], list(row[1:])) for row in rows]
+
+    def iter_rows(self, batch_size: int = 1000):
+        """
+        Все строки журнала по порядку, пачками (память не растет с размером журнала)
+
+        Yields:
+            Словари {заголовок из SHEET_HEADERS: значение}
+        """
+        seq = 0
+        while True:
+            batch = self.read_after(seq, batch_size)
+            if not batch:
+                return
+            for seq, values in batch:
+                yield dict(zip(SHEET_HEADERS, values))
+
+    @staticmethod
+    def _filter(since: str = None, until: str = None, topics: list = None, grades: list = None) -> tuple:
+        """WHERE для отбора строк: даты 'гггг-мм-дд' включительно, темы (названия), классы"""
+        conditions, params = [], []
+        if since:
+            conditions.append(f"{_ISO_DATE} >= ?")
+            params.append(since)
+        if until:
+            conditions.append(f"{_ISO_DATE} <= ?")
+            params.append(until)
+        for column, values in (("topic", topics), ("grade", grades)):
+            if values:
+                conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        return (" AND ".join(conditions) or "1"), params
+
+    def iter_sessions(self, since: str = None, until: str = None, topics: list = None, grades: list = None,
+                      batch_size: int = 1000):
+        """
+        ID сессий, у которых есть строки под фильтр, в порядке первой записи
+
+        Читается курсором пачками - список сессий целиком в памяти не собирается.
+        """
+        where, params = self._filter(since, until, topics, grades)
+        with self._lock:
+            cursor = self._db.execute(
+                f"SELECT session_id FROM transcript WHERE {where} GROUP BY session_id ORDER BY min(seq)", params
+            )
+            batch = cursor.fetchmany(batch_size)
+        while batch:
+            for row in batch:
+                yield row[0]
+            with self._lock:
+                batch = cursor.fetchmany(batch_size)
+
+    def session_rows(self, session_id: str, since: str = None, until: str = None, topics: list = None,
+                     grades: list = None) -> list:
+        """
+        Строки одной сессии под фильтр по порядку сообщений
+
+        Returns:
+            Словари {заголовок из SHEET_HEADERS: значение, 'Класс': класс}
+        """
+        where, params = self._filter(since, until, topics, grades)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT session_id, session_start, date, time, topic, role, message, grade FROM transcript "
+                f"WHERE session_id = ? AND {where} ORDER BY message_index",
+                [session_id, *params]
+            ).fetchall()
+        return [dict(zip(SHEET_HEADERS + ['Класс'], row)) for row in rows]
+
+    def get_cursor(self, name: str) -> int:
+        """seq последней строки, переданной в реплику name (0 - ничего)"""
+        with self._lock:
+            row = self._db.execute("SELECT seq FROM cursors WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def set_cursor(self, name: str, seq: int):
+        """Сдвигает курсор реплики (только вперед)"""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO cursors (name, seq) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET seq = max(seq, excluded.seq)",
+                (name, seq)
+            )
+            self._db.commit()
+
+    def count_after(self, seq: int) -> int:
+        """Сколько строк после seq (отставание реплики)"""
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM transcript WHERE seq > ?", (seq,)).fetchone()[0]
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_transcript_log() -> TranscriptLog:
+    """Возвращает общий для процесса журнал диалогов (файл - TRANSCRIPT_LOG_PATH)"""
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = TranscriptLog(os.getenv('TRANSCRIPT_LOG_PATH', "transcripts.sqlite3"))
+        return _log